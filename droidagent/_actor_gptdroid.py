@@ -26,6 +26,7 @@ class GPTDroidActor():
             'system_message': None,
             'user_messages': [],
             'assistant_messages': [],
+            'page_templates': {}, # page templates already described in the conversation: name -> description
         }
         self.performed_actions = []
         self.logger = logging.getLogger('agent')
@@ -55,6 +56,7 @@ class GPTDroidActor():
                 self.full_prompt['assistant_messages'].extend(self.current_prompt['assistant_messages'])
                 self.current_prompt['user_messages'] = []
                 self.current_prompt['assistant_messages'] = []
+                self.current_prompt['page_templates'] = {}
 
                 contain_feedback = False
 
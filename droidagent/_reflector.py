@@ -43,6 +43,9 @@ class Reflector:
             'visited_pages_during_task': self.memory.visited_pages_for_task,
             'task_execution_history': working_memory_record
         }
+        new_macro_count = self.memory.macros.observe_task(self.memory.working_memory, task_result)
+        if new_macro_count > 0:
+            self.logger.info(f'* New action macros: {new_macro_count}')
         self.memory.exp_data['API_usage'] = APIUsageManager.usage
         self.memory.exp_data['API_response_time'] = APIUsageManager.response_time
 
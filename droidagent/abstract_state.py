@@ -0,0 +1,155 @@
+from .gui_state import SIGNATURE_SEPARATOR, SIGNATURE_CHILD_SEPARATOR, SIGNATURE_DIGEST_SIZE
+
+import re
+import hashlib
+
+MASKED_TEXT = '<text>'
+MAX_LABEL_TEXTS = 3
+DIGITS = re.compile(r'\d')
+
+
+def is_dynamic_text(widget, in_scrollable):
+    """
+    Texts that vary between visits of the same screen: content of lists, user inputs, counters, dates, ...
+    """
+    return in_scrollable or 'set_text' in widget.possible_action_types or DIGITS.search(widget.text) is not None
+
+
+def get_masked_widget_key(widget, in_scrollable):
+    """
+    Key of a widget within an abstract state (dynamic content masked)
+    """
+    text = widget.text
+    if text is not None and is_dynamic_text(widget, in_scrollable):
+        text = MASKED_TEXT
+    content_description = MASKED_TEXT if in_scrollable and widget.content_description is not None else widget.content_description
+
+    return '\x1f'.join([widget.widget_type, widget.resource_id or '', content_description or '', text or '', ','.join(widget.possible_action_types)])
+
+
+def compute_masked_hashes(widgets, masked_keys, in_scrollable=False):
+    """
+    Bottom-up hashes of the masked widget subtrees
+    Inside scrollable containers, the children are hashed as a set: the number, order and content of list rows do not matter.
+    :param masked_keys: dict, filled with id(widget) -> masked widget key for every widget
+    :return: list of str, hashes of the given widgets
+    """
+    hashes = []
+    for widget in widgets:
+        child_in_scrollable = in_scrollable or 'scroll' in widget.possible_action_types
+        masked_keys[id(widget)] = get_masked_widget_key(widget, in_scrollable)
+
+        child_hashes = compute_masked_hashes(widget.children, masked_keys, child_in_scrollable)
+        if child_in_scrollable:
+            child_hashes = sorted(set(child_hashes))
+
+        hasher = hashlib.blake2b(masked_keys[id(widget)].encode('utf-8'), digest_size=SIGNATURE_DIGEST_SIZE)
+        for child_hash in child_hashes:
+            hasher.update(SIGNATURE_CHILD_SEPARATOR + child_hash.encode('ascii'))
+        hashes.append(hasher.hexdigest())
+
+    return hashes
+
+
+def get_static_texts(widgets, in_scrollable=False):
+    for widget in widgets:
+        child_in_scrollable = in_scrollable or 'scroll' in widget.possible_action_types
+        if widget.text is not None and not is_dynamic_text(widget, in_scrollable):
+            yield widget.text
+        yield from get_static_texts(widget.children, child_in_scrollable)
+
+
+class AbstractState:
+    def __init__(self, state_id, activity, label):
+        self.state_id = state_id
+        self.activity = activity
+        self.label = label
+        self.visit_count = 0
+        self.widget_keys = set() # masked keys of the interactable widgets seen in the state
+        self.tried_widget_keys = set()
+
+    @property
+    def untried_widget_count(self):
+        return len(self.widget_keys - self.tried_widget_keys)
+
+    def describe(self):
+        if len(self.label) == 0:
+            return f'{self.state_id} on {self.activity}'
+        return f'{self.state_id} on {self.activity} ({self.label})'
+
+    def to_dict(self):
+        return {
+            'activity': self.activity,
+            'label': self.label,
+            'visit_count': self.visit_count,
+            'widget_count': len(self.widget_keys),
+            'tried_widget_count': len(self.tried_widget_keys),
+        }
+
+
+class AbstractStateRegistry:
+    """
+    Clusters GUI states into abstract states: screens with the same structure once dynamic content (list rows, inputs, numbers) is masked
+    Distinguishes dialogs and fragments of the same activity, while the variants of a screen with different texts share one state.
+    Visit counts and tried widgets are maintained incrementally per abstract state.
+    """
+    def __init__(self):
+        self.states = {} # abstract state key -> AbstractState
+        self.state_ids = {} # abstract state ID -> AbstractState
+        self.visit_counts = {} # abstract state ID -> number of visits (live view for exp_data)
+
+    def get_abstract_state_key(self, gui_state, masked_keys):
+        hasher = hashlib.blake2b(gui_state.activity.encode('utf-8'), digest_size=SIGNATURE_DIGEST_SIZE)
+        for root_hash in compute_masked_hashes(gui_state.root_widgets, masked_keys):
+            hasher.update(SIGNATURE_SEPARATOR + root_hash.encode('ascii'))
+        return hasher.hexdigest()
+
+    def observe(self, gui_state):
+        """
+        Register a visit of the given GUI state; sets its `abstract_state_id` and `abstract_widget_keys`
+        :return: str, the abstract state ID
+        """
+        masked_keys = {}
+        key = self.get_abstract_state_key(gui_state, masked_keys)
+
+        abstract_state = self.states.get(key)
+        if abstract_state is None:
+            label = ', '.join(list(get_static_texts(gui_state.root_widgets))[:MAX_LABEL_TEXTS])
+            abstract_state = AbstractState(f'S{len(self.states) + 1}', gui_state.activity, label)
+            self.states[key] = abstract_state
+            self.state_ids[abstract_state.state_id] = abstract_state
+
+        abstract_state.visit_count += 1
+        self.visit_counts[abstract_state.state_id] = abstract_state.visit_count
+        for widget in gui_state.widgets:
+            if len(widget.possible_action_types) > 0:
+                abstract_state.widget_keys.add(masked_keys[id(widget)])
+
+        gui_state.abstract_state_id = abstract_state.state_id
+        gui_state.abstract_widget_keys = masked_keys
+        return abstract_state.state_id
+
+    def record_action(self, gui_state, widget):
+        """
+        Mark the target widget of an action as tried in the abstract state of the GUI state it was performed on
+        """
+        abstract_state = self.state_ids.get(gui_state.abstract_state_id)
+        if abstract_state is None or id(widget) not in gui_state.abstract_widget_keys:
+            return
+        abstract_state.tried_widget_keys.add(gui_state.abstract_widget_keys[id(widget)])
+
+    def get_state(self, state_id):
+        return self.state_ids.get(state_id)
+
+    def get_unexplored_states(self, limit=None):
+        """
+        :return: list of AbstractState with interactable widgets never tried, the least explored first
+        """
+        unexplored_states = [s for s in self.states.values() if s.untried_widget_count > 0]
+        unexplored_states.sort(key=lambda s: (-s.untried_widget_count, s.visit_count))
+        if limit is not None:
+            unexplored_states = unexplored_states[:limit]
+        return unexplored_states
+
+    def to_dict(self):
+        return {state.state_id: state.to_dict() for state in self.states.values()}
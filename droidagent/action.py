@@ -12,11 +12,18 @@ class Action:
         self.text = None    # for set_text event
         self.direction = None  # for scroll event
         self.name = None    # for key event
+        self.target_page = None # for navigate action
+        self.reached_page = None # for navigate action, set once the route is followed
+        self.navigation_hops = [] # for navigate action, reproducible records of the replayed events
+        self.macro = None # for run_macro action
+        self.macro_steps = [] # for run_macro action, reproducible records of the performed steps
         self.events = []
 
-    def from_props(self, event_type, text=None, direction=None, name=None, target_widget=None):
+    def from_props(self, event_type, text=None, direction=None, name=None, target_widget=None, target_page=None, macro=None):
         self.event_type = event_type
         self.target_widget = target_widget
+        self.target_page = target_page
+        self.macro = macro
 
         if text is not None:
             self.text = text
@@ -71,6 +78,8 @@ class Action:
             return [KeyEvent(name=self.name)]
         elif self.event_type == 'wait':
             return [None]
+        elif self.event_type in ['navigate', 'run_macro']:
+            return [] # the events are sent step by step by the navigator
 
     def get_action_type(self):
         if self.event_type == 'scroll':
@@ -78,6 +87,13 @@ class Action:
         else:
             return self.event_type
 
+    def set_navigation_result(self, reached_page, navigation_hops):
+        self.reached_page = reached_page
+        self.navigation_hops = navigation_hops
+
+    def set_macro_result(self, macro_steps):
+        self.macro_steps = macro_steps
+
     def update_event_type(self, event_type):
         self.event_type = event_type
 
@@ -106,6 +122,18 @@ class Action:
         if self.event_type == 'wait':
             action_str = f'{agent_config.persona_name} waited for a loading state to finish'
 
+        if self.event_type == 'navigate':
+            if self.reached_page is None or self.reached_page == self.target_page:
+                action_str = f'{agent_config.persona_name} navigated to the {self.target_page} page through a known route'
+            else:
+                action_str = f'{agent_config.persona_name} tried to navigate to the {self.target_page} page through a known route, but the route led to the {self.reached_page} page'
+
+        if self.event_type == 'run_macro':
+            if len(self.macro_steps) == len(self.macro.steps):
+                action_str = f'{agent_config.persona_name} performed the action sequence {self.macro.macro_id} ({self.macro.describe()})'
+            else:
+                action_str = f'{agent_config.persona_name} performed {len(self.macro_steps)} of the {len(self.macro.steps)} actions of the sequence {self.macro.macro_id} ({self.macro.describe()}), then the screen did not match the next action'
+
         if self.event_type in ['set_text', 'scroll', 'touch', 'long_touch']:
             if self.target_widget is not None:
                 widget_info = str(self.target_widget)
@@ -138,6 +166,12 @@ class Action:
         if self.event_type == 'wait':
             action_str = f'Wait for a loading state to finish'
 
+        if self.event_type == 'navigate':
+            action_str = f'Navigate to the {self.target_page} page'
+
+        if self.event_type == 'run_macro':
+            action_str = f'Perform the action sequence {self.macro.macro_id} ({self.macro.describe()})'
+
         if self.event_type in ['set_text', 'scroll', 'touch', 'long_touch']:
             if self.target_widget is not None:
                 widget_info = str(self.target_widget)
@@ -166,6 +200,12 @@ class Action:
             'target_widget_text': self.target_widget.text if self.target_widget is not None else None,
             'target_widget_bounds': self.target_widget.bounds if self.target_widget is not None else None,
         }
+        if self.event_type == 'navigate':
+            record['target_page'] = self.target_page
+            record['navigation_hops'] = self.navigation_hops
+        if self.event_type == 'run_macro':
+            record['macro_id'] = self.macro.macro_id
+            record['macro_steps'] = self.macro_steps
         return record
 
     def __str__(self):
@@ -1,5 +1,4 @@
 import os
-import json
 import time
 import random
 import requests
@@ -18,6 +17,7 @@ from ._planner import Planner
 from ._actor import Actor
 from ._reflector import Reflector
 from .config import agent_config
+from .artifact_writer import artifact_writer
 
 from ._actor_gptdroid import GPTDroidActor
 from ._actor_nocritique_noknowledge import NoCritiqueActor
@@ -45,12 +45,15 @@ class PromptRecorder:
     
     def record(self, prompt, mode):
         prompt_str = stringify_prompt(prompt)
-        with open(os.path.join(agent_config.agent_output_dir, 'prompts', f'prompt_{self.state_tag}_{datetime.now().strftime("%H%M%S")}_{mode}.txt'), 'w') as f:
-            f.write(prompt_str)
+        prompt_file = os.path.join(agent_config.agent_output_dir, 'prompts', f'prompt_{self.state_tag}_{datetime.now().strftime("%H%M%S")}_{mode}.txt')
+        artifact_writer.write(prompt_file, prompt_str, compressible=True, droppable=True)
 
     
 class Agent:
-    def __init__(self, output_dir, app=None):
+    def __init__(self, output_dir, app=None, knowledge_service=None):
+        """
+        :param knowledge_service: KnowledgeService (or a proxy of a served one), shared with the other agents exploring the same app
+        """
         if app is None:
             raise NotImplementedError # TODO: load agent snapshot from output_dir
         
@@ -63,7 +66,7 @@ class Agent:
 
             self.exp_id = exp_id
             self.prompt_recorder = PromptRecorder(exp_id)
-            self.memory = Memory(name=self.exp_id)
+            self.memory = Memory(name=self.exp_id, knowledge_service=knowledge_service)
 
         self.logger = logging.getLogger('agent')
         self.logger.setLevel(logging.DEBUG)
@@ -78,9 +81,10 @@ class Agent:
         self.logger.info(f'Agent ID: {exp_id}')
 
     def save_memory_snapshot(self):
+        # the memory is serialized right away, the files are written by the artifact writer
         memory_snapshot_dir = os.path.join(agent_config.agent_output_dir, 'memory_snapshots', f'step_{self.step_count}')
-        os.makedirs(memory_snapshot_dir, exist_ok=True)
-        self.memory.save_snapshot(memory_snapshot_dir)
+        for file_name, content in self.memory.capture_snapshot().items():
+            artifact_writer.write(os.path.join(memory_snapshot_dir, file_name), content, compressible=True)
 
     def step(self, droidbot_state=None):
         raise NotImplementedError
@@ -113,10 +117,14 @@ class Agent:
     def capture_temporary_message(self, droidbot_state):
         gui_state = GUIState().from_droidbot_state(droidbot_state)
 
-        _, appeared_widgets, _ = self.current_gui_state.diff_widgets(gui_state)
+        changed_widgets, appeared_widgets, _ = self.current_gui_state.diff_widgets(gui_state)
+
+        # a message can also replace the text of an existing label in place (text typed into an input field is not a message)
+        new_widget_ids = {id(widget) for widget in appeared_widgets}
+        new_widget_ids.update(id(widget) for widget, change in changed_widgets if 'new_text' in change and 'set_text' not in widget.possible_action_types)
 
         temp_message_count = 0
-        for widget in appeared_widgets:
+        for widget in [w for w in gui_state.widgets if id(w) in new_widget_ids]:
             if widget.text is not None and len(widget.text) > 0:
                 self.memory.temp_messages.append(widget)
                 temp_message_count += 1
@@ -149,8 +157,8 @@ class TaskBasedAgent(Agent):
     """
     Task-based Agent
     """
-    def __init__(self, output_dir, app=None, persona=None, debug_mode=False):
-        super().__init__(output_dir, app=app)
+    def __init__(self, output_dir, app=None, persona=None, debug_mode=False, knowledge_service=None):
+        super().__init__(output_dir, app=app, knowledge_service=knowledge_service)
 
         if app is None:
             raise NotImplementedError # TODO: load agent snapshot from output_dir
@@ -206,8 +214,7 @@ class TaskBasedAgent(Agent):
         if droidbot_state is not None:
             self.set_current_gui_state(droidbot_state)
 
-        with open(os.path.join(agent_config.agent_output_dir, 'exp_data.json'), 'w') as f:
-            json.dump(self.memory.exp_data, f, indent=2)
+        artifact_writer.write_json(self.memory.exp_data, os.path.join(agent_config.agent_output_dir, 'exp_data.json'))
 
         if self.mode == MODE_PLAN:
             """
@@ -235,6 +242,7 @@ class TaskBasedAgent(Agent):
 
             self.logger.info(f'* Task Reflection: {task_result}')
 
+            self.memory.flush() # task boundary: commit buffered memory entries in a single batch
             self.mode = MODE_PLAN
 
             return None
@@ -277,8 +285,8 @@ class TaskBasedAgent(Agent):
 
 # Ablation 1: Actor-only, GPTDroid replication
 class ActorOnlyAgent(Agent):
-    def __init__(self, output_dir, app=None):
-        super().__init__(output_dir, app=app)
+    def __init__(self, output_dir, app=None, knowledge_service=None):
+        super().__init__(output_dir, app=app, knowledge_service=knowledge_service)
 
         self.actor = GPTDroidActor(self.memory)
         self.step_count = 0
@@ -310,11 +318,8 @@ class ActorOnlyAgent(Agent):
             'user_messages': self.actor.full_prompt['user_messages'] + self.actor.current_prompt['user_messages'],
             'assistant_messages': self.actor.full_prompt['assistant_messages'] + self.actor.current_prompt['assistant_messages'],
         }
-        with open(os.path.join(agent_config.agent_output_dir, 'conversation.json'), 'w') as f:
-            json.dump(full_prompt, f, indent=2)
-
-        with open(os.path.join(agent_config.agent_output_dir, 'conversation.txt'), 'w') as f:
-            f.write(stringify_prompt(zip_messages(full_prompt['system_message'], full_prompt['user_messages'], full_prompt['assistant_messages'])))
+        artifact_writer.write_json(full_prompt, os.path.join(agent_config.agent_output_dir, 'conversation.json'))
+        artifact_writer.write(os.path.join(agent_config.agent_output_dir, 'conversation.txt'), stringify_prompt(zip_messages(full_prompt['system_message'], full_prompt['user_messages'], full_prompt['assistant_messages'])))
     
         return action
 
@@ -323,8 +328,8 @@ class TaskBasedAgentNoCritiqueNoKnowledge(Agent):
     """
     Task-based Agent
     """
-    def __init__(self, output_dir, app=None, persona=None, debug_mode=False):
-        super().__init__(output_dir, app=app)
+    def __init__(self, output_dir, app=None, persona=None, debug_mode=False, knowledge_service=None):
+        super().__init__(output_dir, app=app, knowledge_service=knowledge_service)
 
         if app is None:
             raise NotImplementedError # TODO: load agent snapshot from output_dir
@@ -380,8 +385,7 @@ class TaskBasedAgentNoCritiqueNoKnowledge(Agent):
         if droidbot_state is not None:
             self.set_current_gui_state(droidbot_state)
 
-        with open(os.path.join(agent_config.agent_output_dir, 'exp_data.json'), 'w') as f:
-            json.dump(self.memory.exp_data, f, indent=2)
+        artifact_writer.write_json(self.memory.exp_data, os.path.join(agent_config.agent_output_dir, 'exp_data.json'))
 
         if self.mode == MODE_PLAN:
             """
@@ -408,6 +412,7 @@ class TaskBasedAgentNoCritiqueNoKnowledge(Agent):
 
             self.logger.info(f'* Task Reflection: {task_result}')
 
+            self.memory.flush() # task boundary: commit buffered memory entries in a single batch
             self.mode = MODE_PLAN
 
             return None
@@ -454,8 +459,8 @@ class TaskBasedAgentNoKnowledge(Agent):
     """
     Task-based Agent
     """
-    def __init__(self, output_dir, app=None, persona=None, debug_mode=False):
-        super().__init__(output_dir, app=app)
+    def __init__(self, output_dir, app=None, persona=None, debug_mode=False, knowledge_service=None):
+        super().__init__(output_dir, app=app, knowledge_service=knowledge_service)
 
         if app is None:
             raise NotImplementedError # TODO: load agent snapshot from output_dir
@@ -511,8 +516,7 @@ class TaskBasedAgentNoKnowledge(Agent):
         if droidbot_state is not None:
             self.set_current_gui_state(droidbot_state)
 
-        with open(os.path.join(agent_config.agent_output_dir, 'exp_data.json'), 'w') as f:
-            json.dump(self.memory.exp_data, f, indent=2)
+        artifact_writer.write_json(self.memory.exp_data, os.path.join(agent_config.agent_output_dir, 'exp_data.json'))
 
         if self.mode == MODE_PLAN:
             """
@@ -540,6 +544,7 @@ class TaskBasedAgentNoKnowledge(Agent):
 
             self.logger.info(f'* Task Reflection: {task_result}')
 
+            self.memory.flush() # task boundary: commit buffered memory entries in a single batch
             self.mode = MODE_PLAN
 
             return None
@@ -0,0 +1,153 @@
+import os
+import gzip
+import queue
+import atexit
+import logging
+import threading
+
+from .utils import dumps_json
+
+MAX_QUEUE_SIZE = 512
+BATCH_SIZE = 64
+
+BACKPRESSURE_BLOCK = 'block' # the caller waits for a free slot when the queue is full
+BACKPRESSURE_DROP = 'drop' # droppable artifacts (e.g., prompt dumps) are discarded when the queue is full
+
+_CLOSE = object()
+
+
+class ArtifactWriter:
+    """
+    Writes the experiment artifacts (event records, prompts, memory snapshots, exp_data.json, ...) on a dedicated thread
+    - bounded queue: a disk latency spike stalls the agent only once the queue is full (never for droppable artifacts with the drop policy)
+    - batching: queued writes are drained in batches, and an artifact overwritten later in the same batch (e.g., exp_data.json) is written only once
+    - compression: compressible artifacts are gzipped (written as <path>.gz) when `compress` is set; artifacts read back by the scripts must not be marked compressible
+    - the queue is flushed at exit; a failed write is logged and re-raised on the caller side by the next `write` or `flush`
+    - a writer thread that died (e.g., killed by an unexpected error) is restarted by the next `write`, `flush` or `close`, so queued artifacts are not lost
+    """
+    def __init__(self, max_queue_size=MAX_QUEUE_SIZE, batch_size=BATCH_SIZE, compress=False, backpressure=BACKPRESSURE_BLOCK):
+        assert backpressure in (BACKPRESSURE_BLOCK, BACKPRESSURE_DROP), f'Unknown backpressure policy: {backpressure}'
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.batch_size = batch_size
+        self.compress = compress
+        self.backpressure = backpressure
+        self.thread = None
+        self.lock = threading.Lock()
+        self.created_dirs = set()
+        self.error = None
+        self.written_count = 0
+        self.coalesced_count = 0
+        self.dropped_count = 0
+        self.logger = logging.getLogger('agent')
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if self.thread is not None:
+                self.logger.warning('Artifact writer thread died, restarting it')
+            self.thread = threading.Thread(target=self.run, name='artifact-writer', daemon=True)
+            self.thread.start()
+        atexit.register(self.close)
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def write(self, file_path, content, append=False, compressible=False, droppable=False):
+        """
+        :param content: str or bytes, the full content of the artifact (serialized by the caller, so later mutations do not leak into the file)
+        :param append: bool, append to the file instead of overwriting it
+        :param compressible: bool, the artifact is only for human inspection and can be gzipped
+        :param droppable: bool, the artifact can be discarded under the drop backpressure policy
+        """
+        self.raise_error()
+        if not self.is_running():
+            self.start() # otherwise a full queue would block forever
+
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        if compressible and self.compress and not append:
+            file_path, content = f'{file_path}.gz', gzip.compress(content, compresslevel=1)
+
+        item = (str(file_path), content, append)
+        if droppable and self.backpressure == BACKPRESSURE_DROP:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.dropped_count += 1
+                self.logger.warning(f'Artifact writer queue is full, dropped {file_path}')
+        else:
+            self.queue.put(item)
+
+    def write_json(self, obj, file_path, **kwargs):
+        self.write(file_path, dumps_json(obj), **kwargs)
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.write_batch([item for item in batch if item is not _CLOSE])
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+            if any(item is _CLOSE for item in batch):
+                return
+
+    def write_batch(self, batch):
+        # an artifact overwritten later in the batch does not need to be written now
+        last_overwrite = {file_path: i for i, (file_path, _, append) in enumerate(batch) if not append}
+        for i, (file_path, content, append) in enumerate(batch):
+            if last_overwrite.get(file_path, i) > i:
+                self.coalesced_count += 1
+                continue
+            try:
+                self.write_file(file_path, content, append)
+                self.written_count += 1
+            except Exception as e: # not only OSError: any error would kill the thread and lose the queued artifacts
+                self.logger.exception(f'Failed to write {file_path}')
+                if self.error is None:
+                    self.error = e
+
+    def write_file(self, file_path, content, append):
+        dir_path = os.path.dirname(file_path)
+        if dir_path not in self.created_dirs:
+            os.makedirs(dir_path or '.', exist_ok=True)
+            self.created_dirs.add(dir_path)
+        with open(file_path, 'ab' if append else 'wb') as f:
+            f.write(content)
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush(self):
+        """
+        Wait until every queued artifact is on disk
+        """
+        if self.thread is not None:
+            self.start() # the queued artifacts of a dead thread are written by a new one
+            self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.start()
+        with self.lock:
+            thread, self.thread = self.thread, None
+        self.queue.put(_CLOSE)
+        thread.join()
+
+    def describe_stats(self):
+        return f'Artifacts written: {self.written_count}, coalesced: {self.coalesced_count}, dropped: {self.dropped_count}, queued: {self.queue.qsize()}'
+
+
+artifact_writer = ArtifactWriter()
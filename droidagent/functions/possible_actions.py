@@ -4,6 +4,8 @@ from ..config import agent_config
 class Context:
     def __init__(self):
         self.actiontype2widgets = {}
+        self.reachable_pages = []
+        self.macros = {} # macro ID -> Macro
 
     def set_widgets(self, actiontype2widgets):
         self.actiontype2widgets = actiontype2widgets
@@ -20,6 +22,21 @@ class Context:
         self.widget_ids = self.scrollable_widget_ids + self.clickable_widget_ids + self.long_clickable_widget_ids + self.editable_widget_ids
         self.widget_ids.sort()
 
+    def set_reachable_pages(self, reachable_pages):
+        self.reachable_pages = reachable_pages
+
+    def get_reachable_pages(self):
+        return self.reachable_pages
+
+    def set_macros(self, macros):
+        self.macros = {macro.macro_id: macro for macro in macros}
+
+    def get_macro_ids(self):
+        return list(self.macros.keys())
+
+    def get_macro(self, macro_id):
+        return self.macros.get(macro_id, None)
+
     def get_widget_ids(self):
         return self.widget_ids
 
@@ -131,6 +148,63 @@ def create_wait_definition():
     }, wait
 
 
+def navigate(target_page):
+    if target_page not in current_context.get_reachable_pages():
+        return None, f'There is no known route to the page "{target_page}". Please select one of the following pages: {current_context.get_reachable_pages()}, or other action.'
+
+    return Action().from_props('navigate', target_page=target_page), None
+
+def create_navigate_action_definition():
+    return {
+        "type": "function",
+        "function": {
+            "name": "navigate",
+            "description": "Use this function to go to another page that was already visited, by following the route taken before (the actions on the way are performed automatically).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "target_page": {
+                        "type": "string",
+                        "enum": current_context.get_reachable_pages(),
+                        "description": "The name of the page to go to.",
+                    }
+                },
+                "required": ["target_page"]
+            }
+        }
+    }, navigate
+
+
+def run_macro(macro_ID):
+    macro = current_context.get_macro(macro_ID)
+
+    if macro is None:
+        return None, f'There is no action sequence with ID {macro_ID} that can be performed on the current page. Please select one of {current_context.get_macro_ids()}, or other action.'
+
+    return Action().from_props('run_macro', macro=macro), None
+
+def create_run_macro_definition():
+    macro_descriptions = '; '.join(f'{macro_id}: {macro.describe()}' for macro_id, macro in current_context.macros.items())
+    return {
+        "type": "function",
+        "function": {
+            "name": "run_macro",
+            "description": f"Use this function to perform a sequence of actions that was repeated in previously completed tasks, in one go. Available sequences: {macro_descriptions}",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "macro_ID": {
+                        "type": "string",
+                        "enum": current_context.get_macro_ids(),
+                        "description": "The ID of the action sequence to perform.",
+                    }
+                },
+                "required": ["macro_ID"]
+            }
+        }
+    }, run_macro
+
+
 def scroll(direction, target_widget_ID):
     target_widget = current_context.get_scrollable_widget(target_widget_ID)
 
@@ -1,21 +1,30 @@
 from collections import defaultdict
 from .config import agent_config
 from .action import initialize_possible_actions, initialize_screen_scroll_action, initialize_go_back_action, initialize_enter_key_action
-from .utils import GUIStateManager, remove_quotes
+from .utils import GUIStateManager, dumps_unquoted
+from .screen_renderer import ScreenPruner, SCREEN_TOKEN_BUDGET, SCREEN_INDENT, estimate_tokens, iter_rendered_widgets, iter_subtree, collapse_repeated_siblings
+from .state_diff import compute_state_diff, APPEARED, DISAPPEARED, STATE_CHANGED, TEXT_CHANGED
 
 from collections import OrderedDict
-from functools import cached_property
+from functools import cached_property, wraps
 
+import sys
 import json
-import copy
-import difflib
+import hashlib
 import logging
 
 CONTEXT_LENGTH_LIMIT = 15000
+MAX_CACHED_GUI_STATES = 128
+INTERNED_LISTS = {}
+
+# view properties read when parsing a GUI state: DroidBot's `state_str` does not cover all of them, and replaces texts longer than 50 characters with "None"
+LAYOUT_PROPERTIES = ['parent', 'class', 'resource_id', 'text', 'visible', 'enabled', 'clickable', 'long_clickable', 'editable', 'scrollable', 'checkable', 'checked', 'selected', 'focused', 'content_description', 'is_password', 'package']
 
 def minimize_view_tree(view_tree):
-    view_tree = copy.deepcopy(view_tree)
-    
+    """
+    Build a pruned copy of the DroidBot view tree in a single pass.
+    The source tree is never modified; only the kept nodes are (shallowly) copied.
+    """
     new_root_elems = []
     for root_elem in prune_elements(view_tree):
         new_root_elems.extend(additionally_prune_elements(root_elem))
@@ -23,31 +32,40 @@ def minimize_view_tree(view_tree):
     return new_root_elems
 
 
+def is_cached_file_picker_element(elem):
+    # hotfix for DocumentsUI (removed screenshot files are cached)
+    if elem.get('package') != 'com.android.documentsui':
+        return False
+
+    file_picker_elem_text = elem.get('text')
+    if file_picker_elem_text is not None:
+        file_picker_elem_text = file_picker_elem_text.strip()
+        if file_picker_elem_text.startswith('screen_') and file_picker_elem_text.endswith('.png'):
+            return True
+
+    file_picker_elem_content_desc = elem.get('content_description')
+    if file_picker_elem_content_desc is not None and 'Photo taken on' in file_picker_elem_content_desc:
+        return True
+
+    return False
+
+
+def is_file_picker_title_element(elem):
+    return elem.get('package') == 'com.android.documentsui' and elem.get('resource_id') == 'android:id/title'
+
+
 def is_meaningful_element(elem):
     if not elem.get('visible', False):
         return False
 
     if not elem.get('enabled', False):
         return False
-    
-    if elem.get('package') == 'com.android.documentsui': # hotfix for DocumentsUI (removed screenshot files are cached)
-        file_picker_elem_text = elem.get('text')
-        if file_picker_elem_text is not None:
-            file_picker_elem_text = file_picker_elem_text.strip()
-            if file_picker_elem_text.startswith('screen_') and file_picker_elem_text.endswith('.png'):
-                elem['children'] = []
-                del elem['text']
-                return False
-
-        file_picker_elem_content_desc = elem.get('content_description')
-        if file_picker_elem_content_desc is not None and 'Photo taken on' in file_picker_elem_content_desc:
-            elem['children'] = []
-            del elem['content_description']
-            return False
-
-        if elem.get('resource_id') == 'android:id/title':
-            elem['clickable'] = True
-            return True
+
+    if is_cached_file_picker_element(elem):
+        return False
+
+    if is_file_picker_title_element(elem):
+        return True
 
     if any(elem.get(property_name, False) for property_name in ['clickable', 'long_clickable', 'editable', 'scrollable', 'checkable']):
         return True 
@@ -56,8 +74,18 @@ def is_meaningful_element(elem):
 
     return False
 
+def intern_list(values):
+    """
+    Share a single list object among widgets with the same (read-only) property list
+    """
+    key = tuple(values)
+    if key not in INTERNED_LISTS:
+        INTERNED_LISTS[key] = values
+    return INTERNED_LISTS[key]
+
+
 def traverse_widgets(elem, widget_list, view_list):
-    new_elem = OrderedDict()
+    new_elem = {}
     possible_action_types = []
     state_properties = []
 
@@ -82,20 +110,21 @@ def traverse_widgets(elem, widget_list, view_list):
         new_elem['ID'] = elem_ID
         new_elem['view_str'] = view_list[elem_ID]['view_str']
     if 'class' in elem:
-        new_elem['widget_type'] = elem['class'].split('.')[-1]
-        new_elem['class'] = elem['class']
+        widget_class = sys.intern(elem['class'])
+        new_elem['widget_type'] = sys.intern(widget_class.split('.')[-1])
+        new_elem['class'] = widget_class
     if 'text' in elem and elem['text'] is not None and len(elem['text'].strip()) > 0:
         new_elem['text'] = elem['text'] if len(elem['text']) < 100 else elem['text'][:100] + '[...]'
     if 'content_description' in elem and elem['content_description'] is not None:
         new_elem['content_description'] = elem['content_description']
     if 'resource_id' in elem and elem['resource_id'] is not None:
-        new_elem['resource_id'] = elem['resource_id'].split('/')[-1]
+        new_elem['resource_id'] = sys.intern(elem['resource_id'].split('/')[-1])
     if 'is_password' in elem and elem['is_password']:
         new_elem['is_password'] = True
     if len(state_properties) > 0:
-        new_elem['state'] = state_properties
+        new_elem['state'] = intern_list(state_properties)
     if len(possible_action_types) > 0:
-        new_elem['possible_action_types'] = possible_action_types
+        new_elem['possible_action_types'] = intern_list(possible_action_types)
 
     if 'view_str' in elem:
         new_elem['view_str'] = elem['view_str']
@@ -114,25 +143,28 @@ def traverse_widgets(elem, widget_list, view_list):
 
     return widget
 
-def prune_elements(json_data):
-    if is_meaningful_element(json_data):
-        # If the current node is interactable or has a text property, recursively prune its children
-        if "children" in json_data and isinstance(json_data["children"], list):
-            new_children = []
-            for child in json_data["children"]:
-                new_children.extend(prune_elements(child))
-            json_data["children"] = new_children
-        return [json_data]
-    else:
-        # If the current node either is not interactable or doesn't have a text property, recursively prune its children and lift them
-        if "children" in json_data:
-            lifted_children = []
-            for child in json_data["children"]:
-                lifted_children.extend(prune_elements(child))
-            return lifted_children
+def prune_elements(elem):
+    if elem.get('visible', False) and elem.get('enabled', False) and is_cached_file_picker_element(elem):
+        # drop the cached file entry together with its subtree
         return []
 
+    pruned_children = []
+    for child in elem.get('children', []):
+        pruned_children.extend(prune_elements(child))
+
+    if is_meaningful_element(elem):
+        # If the current node is interactable or has a text property, keep it with its pruned children
+        new_elem = dict(elem) # shallow copy: the source tree is left untouched
+        new_elem['children'] = pruned_children
+        if is_file_picker_title_element(elem):
+            new_elem['clickable'] = True
+        return [new_elem]
+
+    # If the current node either is not interactable or doesn't have a text property, lift its pruned children
+    return pruned_children
+
 def additionally_prune_elements(json_data):
+    # json_data is a node created by prune_elements, so it can be modified in place
     # if the current node has only one child that doesn't have any children, lift the child
     if len(json_data.get('children', [])) == 1 and len(json_data['children'][0].get('children', [])) == 0:
         only_child = json_data['children'][0]
@@ -145,31 +177,112 @@ def additionally_prune_elements(json_data):
 
     return [json_data]
 
+def get_gui_state_cache_key(droidbot_state):
+    """
+    Content key of a DroidBot state: `state_str` only covers class/resource_id/short texts and a few flags,
+    so every view property read by the parser (tree structure, bounds, texts, flags) is hashed as well to avoid reusing stale widgets.
+    """
+    layout = []
+    for view in droidbot_state.views:
+        (left, top), (right, bottom) = view['bounds']
+        layout.append((left, top, right, bottom, *map(view.get, LAYOUT_PROPERTIES)))
+
+    return (droidbot_state.state_str, hash(tuple(layout)))
+
+
+class GUIStateCache:
+    """
+    Bounded LRU cache of parsed GUI states keyed by the structural key of the DroidBot state
+    """
+    cache = OrderedDict()
+    max_size = MAX_CACHED_GUI_STATES
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def get(cls, key):
+        gui_state = cls.cache.get(key)
+        if gui_state is None:
+            cls.misses += 1
+            return None
+
+        cls.hits += 1
+        cls.cache.move_to_end(key)
+        return gui_state
+
+    @classmethod
+    def put(cls, key, gui_state):
+        cls.cache[key] = gui_state
+        cls.cache.move_to_end(key)
+        while len(cls.cache) > cls.max_size:
+            cls.cache.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        cls.cache.clear()
+        cls.hits = 0
+        cls.misses = 0
+
+
+def memoize_rendering(describe_method):
+    """
+    Cache the result of a describe_* method that does not depend on the memory, per GUI state and arguments
+    """
+    @wraps(describe_method)
+    def wrapper(self, *args, **kwargs):
+        key = (describe_method.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in self.rendering_cache:
+            self.rendering_cache[key] = describe_method(self, *args, **kwargs)
+        return self.rendering_cache[key]
+
+    return wrapper
+
+
 class GUIState:
     def __init__(self):
         self.tag = None
         self.activity = None
-        self.droidbot_state = None
+        self.state_str = None
         self.activity_stack = []
         self.possible_actions = []
         self.lost_messages = set()
         self.logger = logging.getLogger('agent')
+        # renderings of the screen, shared with the other visits of the same screen through GUIStateCache
+        self.rendering_cache = {}
+        self.widget_knowledge_cache = {} # id(widget) -> (number of observations of the widget, inferred widget role)
+        self.abstract_state_id = None # set by AbstractStateRegistry
+        self.abstract_widget_keys = {}
 
-    def from_droidbot_state(self, droidbot_state):
+    def from_droidbot_state(self, droidbot_state, use_cache=True):
         """
         Convert the view tree and view list from DroidBot to a GUI state
-        :param _view_tree: dict, the view tree from DroidBot
+        :param droidbot_state: DeviceState, the device state captured by DroidBot
+        :param use_cache: bool, reuse the parsed widgets of a previously seen identical screen
         """
-        self.droidbot_state = droidbot_state
-        self.activity = GUIStateManager.fix_activity_name(droidbot_state.foreground_activity)
+        cache_key = get_gui_state_cache_key(droidbot_state) if use_cache else None
+
+        cached_gui_state = GUIStateCache.get(cache_key) if use_cache else None
+        if cached_gui_state is not None:
+            # share the parsed widgets and already computed properties (signature, actiontype2widgets, ...)
+            self.__dict__.update(cached_gui_state.__dict__)
+            self.lost_messages = set()
+        else:
+            self.activity = GUIStateManager.fix_activity_name(droidbot_state.foreground_activity)
+            view_tree = minimize_view_tree(droidbot_state.view_tree)
+
+            self.root_widgets = []
+            self.widgets =[]
+            for root_elem in view_tree:
+                self.root_widgets.append(traverse_widgets(root_elem, self.widgets, droidbot_state.views))
+
+        # per-visit information (the DroidBot state itself is not retained: its view list and tree dominate memory)
+        self.state_str = droidbot_state.state_str
         self.activity_stack = droidbot_state.activity_stack
         self.tag = droidbot_state.tag
-        view_tree = minimize_view_tree(droidbot_state.view_tree)
 
-        self.root_widgets = []
-        self.widgets =[]
-        for root_elem in view_tree:
-            self.root_widgets.append(traverse_widgets(root_elem, self.widgets, droidbot_state.views))
+        if use_cache:
+            # the latest visit becomes the cache entry, so properties computed from now on are kept warm
+            GUIStateCache.put(cache_key, self)
 
         return self
     
@@ -189,46 +302,138 @@ class GUIState:
         :param view_id: int, the view ID
         :return: Widget, the widget with the given view ID
         """
-        for widget in self.widgets:
-            if widget.view_id == view_id:
-                return widget
-        
-        return None
+        return self.id2widget.get(view_id, None)
 
     def get_widget_by_signature(self, signature):
         """
         Get the widget with the given signature
         :param signature: str, the signature
-        :return: Widget, the widget with the given signature
+        :return: Widget, the (first) widget with the given signature
         """
-        for widget in self.widgets:
-            if widget.signature == signature:
-                return widget
+        widgets = self.signature2widgets.get(signature)
+        if widgets is None:
+            return None
         
-        return None
+        return widgets[0]
+
+    def get_widgets_by_resource_id(self, resource_id):
+        """
+        Get the widgets with the given resource ID
+        :param resource_id: str, the resource ID (without the package prefix)
+        :return: list of Widget, in traversal order
+        """
+        return self.resource_id2widgets.get(resource_id, [])
+
+    def get_widgets_by_text(self, text):
+        """
+        Get the widgets with the given text
+        :param text: str, the (possibly truncated) text property of the widget
+        :return: list of Widget, in traversal order
+        """
+        return self.text2widgets.get(text, [])
+
+    @staticmethod
+    def build_widget_index(widgets, key_func):
+        index = defaultdict(list)
+        for w in widgets:
+            key = key_func(w)
+            if key is None:
+                continue
+            index[key].append(w)
+        
+        return dict(index)
+
+    @cached_property
+    def id2widget(self):
+        id2widget = {}
+        for w in self.widgets:
+            if w.view_id is not None and w.view_id not in id2widget:
+                id2widget[w.view_id] = w
+        return id2widget
+
+    @cached_property
+    def signature2widgets(self):
+        return self.build_widget_index(self.widgets, lambda w: w.signature)
+
+    @cached_property
+    def resource_id2widgets(self):
+        return self.build_widget_index(self.widgets, lambda w: w.resource_id)
+
+    @cached_property
+    def text2widgets(self):
+        return self.build_widget_index(self.widgets, lambda w: w.text)
 
     def __str__(self):
         return self.describe_screen()
 
-    def describe_screen_w_memory(self, memory, length_limit=CONTEXT_LENGTH_LIMIT, show_id=True, during_task=False, prompt_recorder=None, include_widget_knowledge=True):
+    def describe_screen_w_memory(self, memory, token_budget=SCREEN_TOKEN_BUDGET, show_id=True, during_task=False, prompt_recorder=None, include_widget_knowledge=True, collapse_repeated=True, page_template=None, template_widgets=None):
         """
         From a given GUI state, creates a description of the GUI state including the list of interactable widgets and non-interactable widgets
+        The description is reused as long as the memory-dependent values (page visit count, action counts and inferred roles of the widgets) are unchanged.
+        :param page_template: str, name of a page template (see PageTemplateStore) already described to the LLM
+        :param template_widgets: list of Widget, subtrees covered by the page template; they are left out, except for the number of previous actions on them
         """
-        get_performed_actions_func = memory.get_performed_action_types_on_widget
         action_count_key = 'num_prev_actions'
 
-        def inject_widget_knowledge(widget, show_id):
-            widget_info = widget.to_dict(include_id=show_id)
+        def get_widget_knowledge(widget):
+            performed_action_types = memory.get_performed_action_types_on_widget(self.activity, widget.signature)
+            interaction_count = 0
+            for action_type in performed_action_types:
+                interaction_count += performed_action_types[action_type]
+
+            widget_knowledge = None
+            if include_widget_knowledge and memory.get_widget_knowledge(self.activity, widget.signature) is not None:
+                # the inferred role (summarized by the LLM) can only change when a new observation of the widget is recorded
+                observation_count = memory.get_widget_observation_count(self.activity, widget.signature)
+                cached_widget_knowledge = self.widget_knowledge_cache.get(id(widget))
+                if cached_widget_knowledge is not None and cached_widget_knowledge[0] == observation_count:
+                    widget_knowledge = cached_widget_knowledge[1]
+                else:
+                    widget_knowledge = memory.retrieve_widget_knowledge_by_state(self.activity, widget, prompt_recorder=prompt_recorder)
+                    self.widget_knowledge_cache[id(widget)] = (observation_count, widget_knowledge)
+
+            return interaction_count, widget_knowledge
+
+        widget_knowledge_map = {id(w): get_widget_knowledge(w) for w in self.widgets if len(w.possible_action_types) > 0}
+
+        is_main_page = 'Main' in memory.current_activity or memory.current_activity == agent_config.main_activity
+
+        page_count_key = 'page_visit_count'
+        if self.activity not in agent_config.app_activities:
+            page_count = '[current page does not belong to the app; just use the page as an intermediate step to accomplish the task]'
+        else:
+            page_count = memory.visited_activities[self.activity]
+
+        omitted_widget_ids = set()
+        for template_widget in (template_widgets or []):
+            omitted_widget_ids.update(id(w) for w in iter_subtree(template_widget))
+
+        rendering_key = ('describe_screen_w_memory', token_budget, show_id, include_widget_knowledge, collapse_repeated, page_template, frozenset(omitted_widget_ids))
+        memory_values = (page_count, is_main_page, widget_knowledge_map)
+        if rendering_key in self.rendering_cache and self.rendering_cache[rendering_key][0] == memory_values:
+            return self.rendering_cache[rendering_key][1]
 
-            if ('Main' in memory.current_activity or memory.current_activity == agent_config.main_activity) and 'content_description' in widget_info:
+        def get_widget_node(widget):
+            # memory-independent properties of a widget, patched with the memory-dependent ones on every rendering
+            node_key = ('widget_node', id(widget), show_id)
+            if node_key not in self.rendering_cache:
+                self.rendering_cache[node_key] = widget.to_dict(include_id=show_id, include_children=False)
+            return dict(self.rendering_cache[node_key])
+
+        def inject_widget_knowledge(widget, show_id, excluded_widget_ids):
+            widget_info = get_widget_node(widget)
+
+            if is_main_page and 'content_description' in widget_info:
                 # If "Navigate up" widget is in the main page, change its name to "Menu"
                 if widget_info['content_description'].lower() == 'navigate up':
                     widget_info['content_description'] = 'Menu'
 
+            children = [child for child in iter_rendered_widgets(widget.children, excluded_widget_ids) if id(child) not in omitted_widget_ids]
+
             # merge textview children
-            text_only_children = [child for child in widget.children if child.widget_type == 'TextView' and len(child.children) == 0 and len(child.possible_action_types) == 0 and child.text is not None]
+            text_only_children = [child for child in children if child.widget_type == 'TextView' and len(child.children) == 0 and len(child.possible_action_types) == 0 and child.text is not None]
 
-            children_merged = len(text_only_children) > 0 and len(text_only_children) == len(widget.children) and widget.text is None
+            children_merged = len(text_only_children) > 0 and len(text_only_children) == len(children) and widget.text is None
 
             if children_merged:
                 # all children are textviews and it does not have text property
@@ -237,145 +442,174 @@ class GUIState:
                     del widget_info['text']
 
             if len(widget.possible_action_types) > 0:
-                performed_action_types = get_performed_actions_func(self.activity, widget.signature)
-                interaction_count = 0
-                for action_type in performed_action_types:
-                    interaction_count += performed_action_types[action_type]
-
+                interaction_count, widget_knowledge = widget_knowledge_map[id(widget)]
                 widget_info[action_count_key] = interaction_count
 
-                if include_widget_knowledge and memory.get_widget_knowledge(self.activity, widget.signature) is not None:
-                    widget_knowledge = memory.retrieve_widget_knowledge_by_state(self.activity, widget, prompt_recorder=prompt_recorder)
-                    if widget_knowledge is not None:
-                        widget_info['widget_role_inference'] = widget_knowledge
+                if widget_knowledge is not None:
+                    widget_info['widget_role_inference'] = widget_knowledge
 
             children_w_knowledge = []
 
             if not children_merged:
-                for child in widget.children:
-                    children_w_knowledge.append(inject_widget_knowledge(child, show_id))
+                for child in children:
+                    children_w_knowledge.append(inject_widget_knowledge(child, show_id, excluded_widget_ids))
 
-            if 'children' in widget_info:
-                del widget_info['children']
             if len(children_w_knowledge) > 0:
                 widget_info['children'] = children_w_knowledge
             return widget_info
 
-        page_count_key = 'page_visit_count'
-        if self.activity not in agent_config.app_activities:
-            page_count = '[current page does not belong to the app; just use the page as an intermediate step to accomplish the task]'
-        else:
-            page_count = memory.visited_activities[self.activity]
+        def render(excluded_widget_ids):
+            view_hierarchy = {
+                'page_name': self.activity,
+                page_count_key: page_count,
+                'children': []
+            }
+            if page_template is not None:
+                view_hierarchy['page_template'] = page_template
+                template_widget_ids = self.get_template_widget_ids(template_widgets)
+                if show_id and len(template_widget_ids) > 0:
+                    view_hierarchy['template_widget_IDs'] = {template_widget_ids[id(w)]: w.view_id for w in self.widgets if id(w) in template_widget_ids}
+                template_action_counts = {w.view_id: widget_knowledge_map[id(w)][0] for w in self.widgets if id(w) in template_widget_ids and widget_knowledge_map[id(w)][0] > 0}
+                if len(template_action_counts) > 0:
+                    view_hierarchy[f'{action_count_key}_in_template'] = template_action_counts
+
+            for widget in iter_rendered_widgets(self.root_widgets, excluded_widget_ids):
+                if id(widget) in omitted_widget_ids:
+                    continue
+                view_hierarchy['children'].append(inject_widget_knowledge(widget, show_id, excluded_widget_ids))
+
+            if collapse_repeated:
+                # rows of lists/grids: one template and a compact table instead of a full subtree per row
+                view_hierarchy = collapse_repeated_siblings(view_hierarchy)
+
+            return dumps_unquoted(view_hierarchy, indent=SCREEN_INDENT) # without quotes and with a compact indentation to reduce the number of tokens
+
+        desc = self.render_within_budget(render, token_budget)
+        self.rendering_cache[rendering_key] = (memory_values, desc)
+        return desc
+    
+    @staticmethod
+    def get_template_widget_ids(template_widgets):
+        """
+        IDs of the interactable widgets of a page template: unlike the view IDs, they do not change between the visits of the page
+        :return: dict, id(widget) -> template widget ID (str)
+        """
+        template_widget_ids = {}
+        for template_widget in template_widgets:
+            for widget in iter_subtree(template_widget):
+                if len(widget.possible_action_types) > 0:
+                    template_widget_ids[id(widget)] = f'T{len(template_widget_ids) + 1}'
+        return template_widget_ids
+
+    def describe_page_template(self, page_template, template_widgets):
+        """
+        Describe the widgets covered by a page template (sent once, then referred to by name in describe_screen_w_memory)
+        """
+        template_widget_ids = self.get_template_widget_ids(template_widgets)
+
+        def render_widget(widget):
+            widget_info = widget.to_dict(include_id=False, include_children=False)
+            if id(widget) in template_widget_ids:
+                widget_info = {'ID': template_widget_ids[id(widget)], **widget_info}
+            if len(widget.children) > 0:
+                widget_info['children'] = [render_widget(child) for child in widget.children]
+            return widget_info
+
         view_hierarchy = {
+            'page_template': page_template,
             'page_name': self.activity,
-            page_count_key: page_count,
-            'children': []
+            'children': [render_widget(widget) for widget in template_widgets]
         }
-        for widget in self.root_widgets:
-            view_hierarchy['children'].append(inject_widget_knowledge(widget, show_id))
+        return dumps_unquoted(view_hierarchy, indent=SCREEN_INDENT)
 
-        screen_description = json.dumps(view_hierarchy, indent=2, ensure_ascii=False)
+    @memoize_rendering
+    def describe_screen(self, token_budget=SCREEN_TOKEN_BUDGET, show_id=True, collapse_repeated=True):
+        def render(excluded_widget_ids):
+            view_hierarchy = {
+                'page_name': self.activity,
+                'children': []
+            }
 
-        if length_limit and len(screen_description) > length_limit:
-            screen_description = screen_description[:length_limit] + '[...truncated...]'
-            self.logger.warning(f'Screen description is too long ({len(screen_description)} > {length_limit}). Truncated. (state tag: {self.tag}))')
-        
-        screen_description = remove_quotes(screen_description) # remove all quotes to reduce the number of tokens
-        return screen_description
-    
-    def describe_screen(self, length_limit=CONTEXT_LENGTH_LIMIT, show_id=True):
-        view_hierarchy = {
-            'page_name': self.activity,
-            'children': []
-        }
+            for widget in iter_rendered_widgets(self.root_widgets, excluded_widget_ids):
+                view_hierarchy['children'].append(widget.to_dict(include_id=show_id, excluded_widget_ids=excluded_widget_ids))
 
-        for widget in self.root_widgets:
-            view_hierarchy['children'].append(widget.to_dict(include_id=show_id))
+            if collapse_repeated:
+                view_hierarchy = collapse_repeated_siblings(view_hierarchy)
 
-        screen_description = json.dumps(view_hierarchy, indent=2, ensure_ascii=False)
+            return dumps_unquoted(view_hierarchy, indent=SCREEN_INDENT)
 
-        if length_limit and len(screen_description) > length_limit:
-            screen_description = screen_description[:length_limit] + '[...truncated...]'
-            self.logger.warning(f'Screen description is too long ({len(screen_description)} > {length_limit}). Truncated. (state tag: {self.tag}))')
+        return self.render_within_budget(render, token_budget)
 
-        screen_description = remove_quotes(screen_description) # remove all double quotes to reduce the number of tokens
-        return screen_description
+    @memoize_rendering
+    def describe_widgets(self, token_budget=SCREEN_TOKEN_BUDGET, show_id=True):
+        def render(excluded_widget_ids):
+            desc = ''
 
-    def describe_widgets(self, length_limit=CONTEXT_LENGTH_LIMIT, show_id=True):
-        desc = ''
+            for widget in self.widgets:
+                if id(widget) in excluded_widget_ids:
+                    continue
+                desc += widget.dump(indent=None, excluded_widget_ids=excluded_widget_ids) + '\n'
+            
+            return desc.strip()
 
-        for widget in self.widgets:
-            desc += widget.dump(indent=None) + '\n'
-        
-        desc = desc.strip()
+        return self.render_within_budget(render, token_budget)
 
-        if length_limit and len(desc) > length_limit:
-            desc = desc[:length_limit] + '[...truncated...]'
-            self.logger.warning(f'Screen description is too long ({len(screen_description)} > {length_limit}). Truncated. (state tag: {self.tag}))')
-        
-        return desc
+    @memoize_rendering
+    def describe_widgets_NL(self, token_budget=SCREEN_TOKEN_BUDGET):
+        def render(excluded_widget_ids):
+            desc = ''
+
+            for widget in self.widgets:
+                if id(widget) in excluded_widget_ids:
+                    continue
+                desc += widget.stringify(include_children_text=False) + '\n'
+            
+            return desc.strip()
 
-    def describe_widgets_NL(self, length_limit=CONTEXT_LENGTH_LIMIT):
-        desc = ''
+        return self.render_within_budget(render, token_budget)
 
-        for widget in self.widgets:
-            desc += widget.stringify(include_children_text=False) + '\n'
-        
-        desc = desc.strip()
+    def render_within_budget(self, render, token_budget):
+        """
+        Render a screen description, pruning less important widgets (never interactable ones) until it fits the token budget
+        :param render: function, set of excluded widget ids -> str
+        """
+        desc, pruned_count = ScreenPruner(self.root_widgets).render_within_budget(render, token_budget)
+        if pruned_count > 0:
+            self.logger.info(f'Screen description exceeded the token budget ({token_budget}). Pruned {pruned_count} widgets, ~{estimate_tokens(desc)} tokens left. (state tag: {self.tag})')
+        if token_budget is not None and estimate_tokens(desc) > token_budget:
+            self.logger.warning(f'Screen description is too long even after pruning ({estimate_tokens(desc)} > {token_budget} tokens). (state tag: {self.tag})')
 
-        if length_limit and len(desc) > length_limit:
-            desc = desc[:length_limit] + '[...truncated...]'
-            self.logger.warning(f'Screen description is too long ({len(desc)} > {length_limit}). Truncated. (state tag: {self.tag}))')
-        
         return desc
 
     def diff(self, other):
         """
         Calculate the difference between two GUI states
         """
-        diff = difflib.ndiff(self.describe_widgets().splitlines(keepends=True), other.describe_widgets().splitlines(keepends=True))
-        return ''.join(diff)
+        return compute_state_diff(self, other).render(fromfile=f'Previous ({self.activity})', tofile=f'Current ({other.activity})', describe=lambda w: w.dump(indent=None))
 
     def diff_widgets(self, other):
         changed_widgets = []
         appeared_widgets = []
         disappeared_widgets = []
 
-        old_widgets = {}
-        new_widgets = {}
-
-        for w in self.widgets:
-            if w.signature is None:
-                continue
-            key = w.signature
-            old_widgets[key] = w
-
-        for w in other.widgets:
-            if w.signature is None:
-                continue
-            key = w.signature
-            new_widgets[key] = w
-
-            if key not in old_widgets:
-                appeared_widgets.append(w)
-            else:
-                old_w = old_widgets[key]
-                if old_w.elem_dict.get('state', []) != w.elem_dict.get('state', []):
-                    changed_widgets.append((w, {
-                        'old_state': old_w.elem_dict.get('state', []),
-                        'new_state': w.elem_dict.get('state', [])
-                    }))
-                elif old_w.elem_dict.get('text', '') != w.elem_dict.get('text', ''):
-                    old_text = old_w.elem_dict.get('text', '')
-                    new_text = w.elem_dict.get('text', '')
-                    changed_widgets.append((w, {
-                        'old_text': old_text,
-                        'new_text': new_text
-                    }))
-                    
-        for key in old_widgets:
-            if key not in new_widgets:
-                disappeared_widgets.append(old_widgets[key])
+        state_diff = compute_state_diff(self, other)
+        state_changed_widgets = set()
+        for edit in state_diff.edits:
+            if edit.edit_type == APPEARED:
+                appeared_widgets.append(edit.new_widget)
+            elif edit.edit_type == DISAPPEARED:
+                disappeared_widgets.append(edit.old_widget)
+            elif edit.edit_type == STATE_CHANGED:
+                state_changed_widgets.add(id(edit.new_widget))
+                changed_widgets.append((edit.new_widget, {
+                    'old_state': edit.old_widget.elem_dict.get('state', []),
+                    'new_state': edit.new_widget.elem_dict.get('state', [])
+                }))
+            elif edit.edit_type == TEXT_CHANGED and id(edit.new_widget) not in state_changed_widgets:
+                changed_widgets.append((edit.new_widget, {
+                    'old_text': edit.old_widget.elem_dict.get('text', ''),
+                    'new_text': edit.new_widget.elem_dict.get('text', '')
+                }))
 
         return changed_widgets, appeared_widgets, disappeared_widgets
 
@@ -409,11 +643,30 @@ class GUIState:
         return interactable_widget_ids
 
 
+NON_RENDERED_PROPERTIES = frozenset(['class', 'bounds', 'view_str'])
+EMPTY_LIST = []
+
+SIGNATURE_DIGEST_SIZE = 8 # bytes, i.e., 16 hex characters
+SIGNATURE_SEPARATOR = b'\x1f'
+SIGNATURE_CHILD_SEPARATOR = b'\x1e'
+MAX_LABEL_LENGTH = 30
+
+
 class Widget:
+    """
+    Immutable record of a widget in a GUI state (do not modify `elem_dict` after construction)
+    Slotted to keep the thousands of widgets retained by long runs compact.
+    """
+    __slots__ = ('view_id', 'widget_type', 'possible_action_types', 'children', 'elem_dict', '_all_text', '_signature')
+
     def __init__(self):
         self.view_id = None
         self.widget_type = None
         self.possible_action_types = []
+        self.children = []
+        self.elem_dict = None
+        self._all_text = None
+        self._signature = None
 
     def from_dict(self, elem_dict):
         self.view_id = elem_dict.get('ID', None)
@@ -425,51 +678,54 @@ class Widget:
             del elem_dict['children']
         
         self.elem_dict = elem_dict
+        self._signature = self.compute_signature()
 
         return self
 
-    def to_dict(self, include_id=True, only_rep_property=True):
-        children = [child.to_dict(include_id=include_id) for child in self.children]
-        elem_dict = copy.deepcopy(self.elem_dict)
-
-        del elem_dict['class']
-        del elem_dict['bounds']
-        if not include_id and 'ID' in elem_dict:
-            del elem_dict['ID']
-
-        if only_rep_property:
-            if 'text' in elem_dict:
-                if 'resource_id' in elem_dict:
-                    del elem_dict['resource_id']
-                if 'content_description' in elem_dict:
-                    del elem_dict['content_description']
-            
-        if 'view_str' in elem_dict:
-            del elem_dict['view_str']
+    def to_dict(self, include_id=True, only_rep_property=True, include_children=True, excluded_widget_ids=None):
+        """
+        Render the widget as a fresh dict (copy-on-write: the widget record itself is never modified,
+        so callers may freely add/replace top-level keys of the returned dict)
+        :param excluded_widget_ids: set of id(widget), descendants to leave out (their children are rendered in their place)
+        """
+        excluded_keys = NON_RENDERED_PROPERTIES
+        if not include_id or (only_rep_property and 'text' in self.elem_dict):
+            excluded_keys = set(excluded_keys)
+            if not include_id:
+                excluded_keys.add('ID')
+            if only_rep_property and 'text' in self.elem_dict:
+                excluded_keys.update(['resource_id', 'content_description'])
+
+        elem_dict = {key: value for key, value in self.elem_dict.items() if key not in excluded_keys}
 
-        if len(children) > 0:
-            elem_dict['children'] = children
+        if include_children and len(self.children) > 0:
+            children = [child.to_dict(include_id=include_id, excluded_widget_ids=excluded_widget_ids) for child in iter_rendered_widgets(self.children, excluded_widget_ids)]
+            if len(children) > 0:
+                elem_dict['children'] = children
 
         return elem_dict
 
-    @cached_property
+    @property
     def bounds(self):
         return self.elem_dict['bounds']
         
-    @cached_property
+    @property
     def text(self):
         return self.elem_dict.get('text', None)
 
-    @cached_property
+    @property
     def resource_id(self):
         return self.elem_dict.get('resource_id', None)
 
-    @cached_property
+    @property
     def content_description(self):
         return self.elem_dict.get('content_description', None)
 
-    @cached_property
+    @property
     def all_text(self):
+        if self._all_text is not None:
+            return self._all_text
+
         texts = []
         if self.text is not None and len(self.text.strip()) > 0:
             if len(self.text) > 50:
@@ -480,14 +736,21 @@ class Widget:
         for child in self.children:
             texts.extend(child.all_text)
         
+        self._all_text = texts
         return texts
 
-    @cached_property
+    @property
     def state(self):
-        return self.elem_dict.get('state', [])
+        return self.elem_dict.get('state', EMPTY_LIST)
 
-    @cached_property
+    @property
     def signature(self):
+        """
+        Structural hash of the widget subtree (fixed-size, computed bottom-up when the widget is built)
+        """
+        return self._signature
+
+    def signature_ingredients(self):
         immutable_props = ['content_description', 'resource_id']
         if 'set_text' not in self.possible_action_types:
             immutable_props.append('text')
@@ -496,17 +759,43 @@ class Widget:
         for prop in immutable_props:
             if prop in self.elem_dict and self.elem_dict[prop] is not None and len(self.elem_dict[prop].strip()) > 0:
                 ingredients.append(self.elem_dict[prop])
-        
-        # also use concatenated children's signature
-        ingredients.extend([child.signature for child in self.children])
 
-        if len(ingredients) == 0:
+        return ingredients
+
+    def compute_signature(self):
+        ingredients = self.signature_ingredients()
+        if len(ingredients) == 0 and len(self.children) == 0:
             # non-describable widget...
             ingredients = [str(self.elem_dict['bounds'])]
 
-        ingredients.insert(0, self.widget_type)
+        hasher = hashlib.blake2b(self.widget_type.encode('utf-8'), digest_size=SIGNATURE_DIGEST_SIZE)
+        for ingredient in ingredients:
+            hasher.update(SIGNATURE_SEPARATOR + ingredient.encode('utf-8'))
+
+        # children are already hashed, so the cost per widget does not depend on the subtree size
+        for child in self.children:
+            hasher.update(SIGNATURE_CHILD_SEPARATOR + child.signature.encode('ascii'))
+
+        return hasher.hexdigest()
+
+    @property
+    def label(self):
+        """
+        Short human-readable name of the widget (signatures are opaque hashes)
+        e.g., 'Button "Add note"', 'ImageButton #fab_add', 'LinearLayout [0,210][1080,420]'
+        """
+        for prop, template in [('text', '"{}"'), ('content_description', '"{}"'), ('resource_id', '#{}')]:
+            value = self.elem_dict.get(prop)
+            if value is not None and len(value.strip()) > 0:
+                if len(value) > MAX_LABEL_LENGTH:
+                    value = value[:MAX_LABEL_LENGTH] + '[...]'
+                return f'{self.widget_type} {template.format(value)}'
+
+        if len(self.all_text) > 0:
+            return f'{self.widget_type} "{self.all_text[0]}"'
 
-        return '-'.join(ingredients)
+        (left, top), (right, bottom) = self.elem_dict['bounds']
+        return f'{self.widget_type} [{left},{top}][{right},{bottom}]'
 
     def __repr__(self):
         return self.dump()
@@ -514,7 +803,7 @@ class Widget:
     def __str__(self):
         return self.stringify()
 
-    def dump(self, indent=2):
+    def dump(self, indent=2, excluded_widget_ids=None):
         """
         Stringify the widget including its children
         {
@@ -540,7 +829,7 @@ class Widget:
             ]
         }
         """
-        return json.dumps(self.to_dict(), indent=indent, ensure_ascii=False)
+        return json.dumps(self.to_dict(excluded_widget_ids=excluded_widget_ids), indent=indent, ensure_ascii=False)
 
     def stringify(self, include_children_text=True):
         """
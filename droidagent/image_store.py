@@ -0,0 +1,216 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from .artifact_writer import artifact_writer
+
+IMAGE_DIR = 'images'
+BLOB_DIR = 'blobs'
+MANIFEST_FILE = 'manifest.jsonl'
+AVERAGE_HASH_SIZE = 8 # the image is reduced to 8x8 grayscale pixels -> 64-bit hash
+
+KIND_SCREEN = 'screen'
+KIND_VIEW = 'view'
+
+
+def get_file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_average_hash(file_path):
+    """
+    Perceptual hash: bit i is set if pixel i of the reduced grayscale image is brighter than the mean
+    (robust to small changes such as the status bar clock or a blinking cursor)
+    """
+    with Image.open(file_path) as image:
+        pixels = list(image.convert('L').resize((AVERAGE_HASH_SIZE, AVERAGE_HASH_SIZE)).getdata())
+    mean = sum(pixels) / len(pixels)
+    return sum(1 << i for i, pixel in enumerate(pixels) if pixel > mean)
+
+
+def get_hamming_distance(hash1, hash2):
+    return bin(hash1 ^ hash2).count('1')
+
+
+class ImageStore:
+    """
+    Content-addressed store of the screenshots and view crops of a run (<output_dir>/images): every image is kept on disk once
+    - every distinct image is kept as blobs/<sha256[:2]>/<sha256>.png
+    - a screenshot is moved into the store (a duplicate is deleted) once DroidBot has written it to states/screen_<tag>.png:
+      DroidBot rewrites this file when a later state gets the same (one-second) tag, which then creates a new file instead of going through a blob
+    - a view crop stays in views/ as a hard link to its blob (a duplicate crop is replaced by a link): crops are written once per view_str and never rewritten
+    - with `near_duplicate_distance`, an image whose average hash is within this Hamming distance of a stored image is collapsed into it (lossy, requires Pillow)
+    - manifest.jsonl maps the state and event tags to the blobs (see ImageStoreReader)
+    Images are added on the background pipeline, after DroidBot has written them.
+    """
+    def __init__(self, root_dir, near_duplicate_distance=None):
+        self.root_dir = root_dir
+        self.manifest_file = os.path.join(root_dir, MANIFEST_FILE)
+        self.near_duplicate_distance = near_duplicate_distance
+        self.logger = logging.getLogger('agent')
+        if near_duplicate_distance is not None and Image is None:
+            self.logger.warning('Pillow is not installed: near-duplicate images are not collapsed')
+            self.near_duplicate_distance = None
+
+        self.blob_paths = {} # sha256 -> blob path
+        self.average_hashes = {} # sha256 -> average hash (with near-duplicate collapse)
+        self.stored_paths = {} # original file path -> blob path (the file may have been moved or rewritten since: see `is_stored`)
+
+        self.added_count = 0
+        self.exact_duplicate_count = 0
+        self.near_duplicate_count = 0
+        self.stored_bytes = 0 # size of the blobs
+        self.saved_bytes = 0 # size of the deleted or linked duplicates
+
+    def get_blob_path(self, digest):
+        return os.path.join(self.root_dir, BLOB_DIR, digest[:2], f'{digest}.png')
+
+    def find_near_duplicate(self, average_hash):
+        best_digest, best_distance = None, self.near_duplicate_distance + 1
+        for digest, stored_hash in self.average_hashes.items():
+            distance = get_hamming_distance(average_hash, stored_hash)
+            if distance < best_distance:
+                best_digest, best_distance = digest, distance
+        return best_digest
+
+    def replace_with_link(self, file_path, source_path):
+        temp_path = f'{file_path}.link'
+        try:
+            os.link(source_path, temp_path)
+            os.replace(temp_path, file_path)
+        except OSError:
+            return False
+        return True
+
+    def is_stored(self, file_path):
+        # the file is still the image it was stored as (a moved screenshot has been deleted or rewritten since)
+        blob_path = self.stored_paths.get(file_path)
+        if blob_path is None or not os.path.exists(file_path):
+            return False
+        return os.path.samefile(file_path, blob_path)
+
+    def store(self, file_path, move=False):
+        """
+        :param move: bool, whether to move the file into the store (and delete it if it is a duplicate) instead of linking it to its blob
+        :return: (str, str), the blob path and the kind of duplicate ('exact', 'near' or None for a new image)
+        """
+        digest = get_file_digest(file_path)
+        file_size = os.path.getsize(file_path)
+        if digest in self.blob_paths:
+            duplicate, blob_path = 'exact', self.blob_paths[digest]
+        else:
+            duplicate, blob_path = None, None
+            average_hash = None
+            if self.near_duplicate_distance is not None:
+                average_hash = get_average_hash(file_path)
+                near_digest = self.find_near_duplicate(average_hash)
+                if near_digest is not None:
+                    duplicate, blob_path = 'near', self.blob_paths[near_digest]
+
+            if blob_path is None:
+                blob_path = self.get_blob_path(digest)
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                if move:
+                    shutil.move(file_path, blob_path)
+                elif not self.replace_with_link(blob_path, file_path):
+                    shutil.copyfile(file_path, blob_path) # no hard links on this file system
+                self.blob_paths[digest] = blob_path
+                self.stored_bytes += file_size
+                if average_hash is not None:
+                    self.average_hashes[digest] = average_hash
+
+        if duplicate is not None:
+            if move:
+                os.remove(file_path)
+                self.saved_bytes += file_size
+            elif self.replace_with_link(file_path, blob_path):
+                self.saved_bytes += file_size
+            if duplicate == 'exact':
+                self.exact_duplicate_count += 1
+            else:
+                self.near_duplicate_count += 1
+
+        self.stored_paths[file_path] = blob_path
+        return blob_path, duplicate
+
+    def add(self, file_path, kind, **keys):
+        """
+        :param kind: str, KIND_SCREEN (moved into the store) or KIND_VIEW (linked to its blob)
+        :param keys: the tags of the image recorded in the manifest (e.g., tag and state_str of a screen, event tag and view_str of a view crop)
+        :return: str, the blob path (None if the file does not exist)
+        """
+        duplicate = None
+        if self.is_stored(file_path):
+            blob_path = self.stored_paths[file_path]
+        elif os.path.exists(file_path): # a new file, or a path rewritten with another image since it was stored
+            blob_path, duplicate = self.store(file_path, move=(kind == KIND_SCREEN))
+            self.added_count += 1
+        else:
+            return None
+
+        entry = dict(keys, kind=kind, path=os.path.relpath(file_path, self.root_dir), blob=os.path.relpath(blob_path, self.root_dir), duplicate=duplicate)
+        artifact_writer.write(self.manifest_file, json.dumps(entry) + '\n', append=True)
+        return blob_path
+
+    def describe_stats(self):
+        return f'Image store: {self.added_count} images, {len(self.blob_paths)} blobs of {self.stored_bytes / 1e6:.1f} MB ({self.exact_duplicate_count} exact and {self.near_duplicate_count} near duplicates, {self.saved_bytes / 1e6:.1f} MB saved)'
+
+
+class ImageStoreReader:
+    """
+    Read the image manifest of a previous run, instead of globbing and parsing the state files
+    """
+    def __init__(self, result_dir):
+        self.root_dir = os.path.join(result_dir, IMAGE_DIR)
+        self.entries = []
+        manifest_file = os.path.join(self.root_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_file):
+            with open(manifest_file, 'r') as f:
+                self.entries = [json.loads(line) for line in f if len(line.strip()) > 0]
+
+    def exists(self):
+        return len(self.entries) > 0
+
+    def get_absolute_path(self, relative_path):
+        return os.path.abspath(os.path.join(self.root_dir, relative_path))
+
+    def get_screenshots(self):
+        """
+        :return: list of (tag, state_str, blob path) of the recorded screens, in recording order
+        """
+        screenshots = {}
+        for entry in self.entries:
+            if entry['kind'] == KIND_SCREEN: # two states can share a (one-second) tag
+                screenshots.setdefault((entry['tag'], entry.get('state_str')), (entry['tag'], entry.get('state_str'), self.get_absolute_path(entry['blob'])))
+        return list(screenshots.values())
+
+    def get_screenshot_path(self, state_str):
+        for _, screen_state_str, blob_path in self.get_screenshots():
+            if screen_state_str == state_str:
+                return blob_path
+        return None
+
+    def get_view_image_path(self, view_str):
+        for entry in self.entries:
+            if entry['kind'] == KIND_VIEW and entry.get('view_str') == view_str:
+                return self.get_absolute_path(entry['blob'])
+        return None
+
+    def get_stats(self):
+        blobs = set(entry['blob'] for entry in self.entries)
+        return {
+            'image_count': len(set(entry['path'] for entry in self.entries)),
+            'blob_count': len(blobs),
+            'blob_bytes': sum(os.path.getsize(self.get_absolute_path(blob)) for blob in blobs if os.path.exists(self.get_absolute_path(blob))),
+        }
@@ -0,0 +1,180 @@
+import os
+import time
+import secrets
+import threading
+from multiprocessing.managers import BaseManager
+
+DEFAULT_ADDRESS = ('127.0.0.1', 0) # any free port on the loopback interface
+AUTHKEY_ENV = 'DROIDAGENT_KNOWLEDGE_AUTHKEY' # the server unpickles what clients send: only processes given the key may connect
+
+
+def generate_authkey():
+    return secrets.token_hex(32)
+
+
+def get_authkey():
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if authkey is None:
+        raise ValueError(f'No authentication key for the knowledge service: set {AUTHKEY_ENV} (e.g., to the key of the fleet that started the service)')
+    return authkey.encode('utf-8')
+
+
+def parse_address(address):
+    """
+    :param address: str, "host:port"
+    """
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class KnowledgeService:
+    """
+    Knowledge shared by agents exploring the same app (thread-safe; in-process, or served on a loopback socket by `start_knowledge_server`)
+    - `WIDGET` and `TASK` knowledge entries form a grow-only set keyed by (agent, entry ID): merging is a union, so publishing is idempotent and order-independent
+    - widget role summaries are last-writer-wins registers keyed by (page, widget signature), ordered by (timestamp, agent)
+    - subscribers poll with a cursor (the number of records they have already seen) and receive every record published by the other agents since
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = [] # append-only log of knowledge entries
+        self.entry_keys = set()
+        self.summaries = {} # (page, widget) -> summary record
+        self.summary_log = [] # append-only log of accepted summary records
+
+    def publish_entries(self, entries):
+        """
+        :param entries: list of dict, knowledge entries with 'agent', 'entry_id', 'document' and 'metadata'
+        :return: int, the number of entries that were not known yet
+        """
+        added_count = 0
+        with self.lock:
+            for entry in entries:
+                entry_key = (entry['agent'], entry['entry_id'])
+                if entry_key in self.entry_keys:
+                    continue
+                self.entry_keys.add(entry_key)
+                self.entries.append(entry)
+                added_count += 1
+        return added_count
+
+    def fetch_entries(self, cursor=0, exclude_agent=None):
+        """
+        :return: (list of dict, int), the entries published after the cursor (except those of `exclude_agent`) and the next cursor
+        """
+        with self.lock:
+            entries = [entry for entry in self.entries[cursor:] if entry['agent'] != exclude_agent]
+            return entries, len(self.entries)
+
+    def publish_summary(self, summary):
+        """
+        :param summary: dict, widget role summary with 'agent', 'page', 'widget', 'label', 'summary' and 'timestamp'
+        :return: bool, whether the summary is the latest one of the widget
+        """
+        key = (summary['page'], summary['widget'])
+        with self.lock:
+            current_summary = self.summaries.get(key)
+            if current_summary is not None and (current_summary['timestamp'], current_summary['agent']) >= (summary['timestamp'], summary['agent']):
+                return False
+            self.summaries[key] = summary
+            self.summary_log.append(summary)
+            return True
+
+    def fetch_summaries(self, cursor=0, exclude_agent=None):
+        """
+        :return: (list of dict, int), the summaries accepted after the cursor (except those of `exclude_agent`) and the next cursor
+        """
+        with self.lock:
+            summaries = [summary for summary in self.summary_log[cursor:] if summary['agent'] != exclude_agent]
+            return summaries, len(self.summary_log)
+
+    def get_stats(self):
+        with self.lock:
+            agent_entry_counts = {}
+            for entry in self.entries:
+                agent_entry_counts[entry['agent']] = agent_entry_counts.get(entry['agent'], 0) + 1
+            return {
+                'entry_count': len(self.entries),
+                'summary_count': len(self.summaries),
+                'agent_entry_counts': agent_entry_counts,
+            }
+
+
+class KnowledgeClientManager(BaseManager):
+    pass
+
+KnowledgeClientManager.register('get_knowledge_service')
+
+
+def start_knowledge_server(service=None, address=DEFAULT_ADDRESS, authkey=None):
+    """
+    Serve a knowledge service on a socket from a background thread of the current process
+    :param authkey: bytes, key the clients must present (read from the environment if not given)
+    :return: (KnowledgeService, (str, int)), the served service and the address of the server
+    """
+    if service is None:
+        service = KnowledgeService()
+
+    class KnowledgeServerManager(BaseManager):
+        pass
+    KnowledgeServerManager.register('get_knowledge_service', callable=lambda: service)
+
+    server = KnowledgeServerManager(address=address, authkey=authkey or get_authkey()).get_server()
+    threading.Thread(target=server.serve_forever, name='knowledge-service', daemon=True).start()
+    return service, server.address
+
+
+def connect_knowledge_service(address, authkey=None):
+    """
+    :param address: (str, int) or str ("host:port"), address of a server started by `start_knowledge_server`
+    :return: proxy of the remote KnowledgeService (same methods)
+    """
+    if isinstance(address, str):
+        address = parse_address(address)
+    manager = KnowledgeClientManager(address=address, authkey=authkey or get_authkey())
+    manager.connect()
+    return manager.get_knowledge_service()
+
+
+class SharedKnowledgeClient:
+    """
+    Per-agent view of a knowledge service: publishes the agent's own knowledge and pulls the knowledge of the others
+    """
+    def __init__(self, service, agent_id):
+        self.service = service
+        self.agent_id = agent_id
+        self.entry_cursor = 0
+        self.summary_cursor = 0
+        self.summary_versions = {} # (page, widget) -> (timestamp, agent) of the latest summary known to the agent
+
+    def publish_entry(self, entry_id, document, metadata):
+        self.service.publish_entries([{'agent': self.agent_id, 'entry_id': entry_id, 'document': document, 'metadata': metadata}])
+
+    def publish_summary(self, page_name, widget_signature, label, summary):
+        timestamp = time.time()
+        self.summary_versions[(page_name, widget_signature)] = (timestamp, self.agent_id)
+        self.service.publish_summary({
+            'agent': self.agent_id,
+            'page': page_name,
+            'widget': widget_signature,
+            'label': label,
+            'summary': summary,
+            'timestamp': timestamp,
+        })
+
+    def pull_entries(self):
+        entries, self.entry_cursor = self.service.fetch_entries(self.entry_cursor, exclude_agent=self.agent_id)
+        return entries
+
+    def pull_summaries(self):
+        """
+        :return: list of dict, the summaries of the other agents that are newer than the ones known to the agent (last writer wins)
+        """
+        summaries, self.summary_cursor = self.service.fetch_summaries(self.summary_cursor, exclude_agent=self.agent_id)
+        newer_summaries = []
+        for summary in summaries:
+            key, version = (summary['page'], summary['widget']), (summary['timestamp'], summary['agent'])
+            if key in self.summary_versions and self.summary_versions[key] >= version:
+                continue
+            self.summary_versions[key] = version
+            newer_summaries.append(summary)
+        return newer_summaries
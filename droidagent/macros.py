@@ -0,0 +1,169 @@
+from .action import Action
+from .utils import remove_quotes
+
+MACRO_EVENT_TYPES = ['touch', 'long_touch', 'set_text', 'scroll', 'key']
+MIN_MACRO_LENGTH = 2
+MAX_MACRO_LENGTH = 6
+MIN_MACRO_SUPPORT = 2 # number of successful tasks in which the action sequence was performed
+MAX_MACRO_FAILURES = 2 # a macro that stopped midway this many times is not offered anymore
+MAX_OFFERED_MACROS = 5
+
+
+def get_macro_step(action, page):
+    """
+    :return: dict, replayable step of a macro (None if the action cannot be replayed as part of a macro)
+    """
+    if not isinstance(action, Action) or action.event_type not in MACRO_EVENT_TYPES:
+        return None
+    if action.event_type != 'key' and (action.target_widget is None or action.target_widget.signature is None):
+        return None
+
+    return {
+        'page': page,
+        'event_type': action.event_type,
+        'widget_signature': action.target_widget.signature if action.target_widget is not None else None,
+        'widget_label': str(action.target_widget) if action.target_widget is not None else None,
+        'text': action.text,
+        'direction': action.direction,
+        'name': action.name,
+    }
+
+
+def get_step_key(step):
+    return (step['page'], step['event_type'], step['widget_signature'], step['text'], step['direction'], step['name'])
+
+
+def describe_step(step):
+    if step['event_type'] == 'key':
+        return f'press {step["name"]}'
+    if step['event_type'] == 'set_text':
+        return f'fill {step["widget_label"]} with "{step["text"]}"'
+    if step['event_type'] == 'scroll':
+        return f'scroll {step["direction"].lower()} on {step["widget_label"]}'
+    return f'{step["event_type"].replace("_", " ")} on {step["widget_label"]}'
+
+
+class Macro:
+    def __init__(self, macro_id, steps, support):
+        self.macro_id = macro_id
+        self.steps = steps
+        self.support = support
+        self.use_count = 0
+        self.failure_count = 0
+
+    @property
+    def precondition_page(self):
+        return self.steps[0]['page']
+
+    def is_applicable(self, gui_state):
+        """
+        The macro can start on the given GUI state: same page, and the target widget of the first step is on the screen
+        """
+        if gui_state.activity != self.precondition_page or self.failure_count >= MAX_MACRO_FAILURES:
+            return False
+        first_step = self.steps[0]
+        return first_step['widget_signature'] is None or gui_state.get_widget_by_signature(first_step['widget_signature']) is not None
+
+    def describe(self):
+        return remove_quotes(' -> '.join(describe_step(step) for step in self.steps))
+
+    def to_dict(self):
+        return {
+            'precondition_page': self.precondition_page,
+            'description': self.describe(),
+            'support': self.support,
+            'use_count': self.use_count,
+            'failure_count': self.failure_count,
+        }
+
+
+class MacroLibrary:
+    """
+    Action sequences that were repeated in several successful tasks (e.g., logging in, opening the drawer, creating a deck)
+    They are offered to the planner and actor as single actions, so that the LLM does not re-plan them step by step.
+    A macro is identified by its steps (page, action and structural signature of the target widget), and its precondition is the page of its first step.
+    """
+    def __init__(self):
+        self.successful_runs = [] # per successful task: list of runs of consecutive replayable steps
+        self.macros = {} # tuple of step keys -> Macro
+        self.macro_ids = {} # macro ID -> Macro
+
+    def observe_task(self, working_memory, task_result):
+        """
+        :param working_memory: list of (description, record type, timestamp, page), the execution history of the task
+        :return: int, the number of new macros
+        """
+        if task_result != 'SUCCESS':
+            return 0
+
+        runs = [[]]
+        for description, record_type, _, page in working_memory:
+            if record_type != 'ACTION':
+                continue
+            step = get_macro_step(description, page)
+            if step is None:
+                runs.append([]) # the sequence is interrupted by an action that cannot be replayed
+            else:
+                runs[-1].append(step)
+        self.successful_runs.append([run for run in runs if len(run) >= MIN_MACRO_LENGTH])
+
+        return self.mine()
+
+    def mine(self):
+        support = {}
+        steps_by_key = {}
+        for runs in self.successful_runs:
+            keys_in_task = set()
+            for run in runs:
+                step_keys = [get_step_key(step) for step in run]
+                for length in range(MIN_MACRO_LENGTH, MAX_MACRO_LENGTH + 1):
+                    for start in range(len(run) - length + 1):
+                        key = tuple(step_keys[start:start + length])
+                        keys_in_task.add(key)
+                        steps_by_key.setdefault(key, run[start:start + length])
+            for key in keys_in_task:
+                support[key] = support.get(key, 0) + 1
+
+        frequent_keys = [key for key, count in support.items() if count >= MIN_MACRO_SUPPORT]
+        # keep the longest sequences: drop a sequence contained in a longer one that is as frequent
+        frequent_keys.sort(key=len, reverse=True)
+        maximal_keys = []
+        for key in frequent_keys:
+            if not any(support[longer_key] >= support[key] and self.contains(longer_key, key) for longer_key in maximal_keys):
+                maximal_keys.append(key)
+
+        new_macro_count = 0
+        for key in maximal_keys:
+            if key in self.macros:
+                self.macros[key].support = support[key]
+                continue
+            macro = Macro(f'M{len(self.macros) + 1}', steps_by_key[key], support[key])
+            self.macros[key] = macro
+            self.macro_ids[macro.macro_id] = macro
+            new_macro_count += 1
+
+        return new_macro_count
+
+    @staticmethod
+    def contains(sequence, subsequence):
+        return any(sequence[i:i + len(subsequence)] == subsequence for i in range(len(sequence) - len(subsequence) + 1))
+
+    def get_macro(self, macro_id):
+        return self.macro_ids.get(macro_id)
+
+    def get_applicable_macros(self, gui_state, limit=MAX_OFFERED_MACROS):
+        """
+        :return: list of Macro that can start on the given GUI state, the longest and most frequent first
+        """
+        applicable_macros = [macro for macro in self.macros.values() if macro.is_applicable(gui_state)]
+        applicable_macros.sort(key=lambda macro: (-len(macro.steps), -macro.support))
+        return applicable_macros[:limit]
+
+    def record_result(self, macro_id, completed):
+        macro = self.macro_ids[macro_id]
+        macro.use_count += 1
+        if not completed:
+            macro.failure_count += 1
+
+    def to_dict(self):
+        return {macro.macro_id: macro.to_dict() for macro in self.macros.values()}
@@ -1,13 +1,18 @@
 from .config import agent_config
-from .utils import add_period, remove_period
+from .utils import add_period, remove_period, dumps_json
 from .action import *
+from .page_template import PageTemplateStore
+from .abstract_state import AbstractStateRegistry
+from .knowledge_service import SharedKnowledgeClient
+from .navigation import NavigationIndex
+from .macros import MacroLibrary
 from .prompts.summarize_widget_knowledge import prompt_summarized_widget_knowledge
 from collections import defaultdict
 import chromadb
+import uuid
 import time
 import os
 import re
-import json
 
 
 PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -16,8 +21,113 @@ PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 chroma_client = chromadb.Client()
 # TODO: split into different memory classes
 
+MAX_BUFFERED_WRITES = 32
+MAX_UNEXPLORED_STATES = 5
+
+
+def match_where_filter(metadata, where):
+    """
+    Evaluate a (subset of) Chroma `where` filter against a metadata dict
+    Supports `$and`, `$or`, `$eq` and plain equality, which are the only operators used in this module.
+    """
+    if where is None:
+        return True
+
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(match_where_filter(metadata, sub_where) for sub_where in condition):
+                return False
+        elif key == '$or':
+            if not any(match_where_filter(metadata, sub_where) for sub_where in condition):
+                return False
+        elif isinstance(condition, dict):
+            if '$eq' not in condition:
+                raise NotImplementedError(f'Unsupported where operator for buffered entries: {condition}')
+            if metadata.get(key) != condition['$eq']:
+                return False
+        elif metadata.get(key) != condition:
+            return False
+
+    return True
+
+
+class BufferedCollection:
+    """
+    Write buffer in front of a Chroma collection
+    - `add` calls are queued and embedded in a single batch when the buffer is flushed
+    - `get` serves pending entries directly (no embedding is needed for a plain lookup)
+    - `query` and `upsert` flush the buffer first so that they always see previous writes
+    """
+    def __init__(self, collection, max_buffered_writes=MAX_BUFFERED_WRITES):
+        self.collection = collection
+        self.max_buffered_writes = max_buffered_writes
+        self.pending_documents = []
+        self.pending_metadatas = []
+        self.pending_ids = []
+
+    def add(self, documents, metadatas, ids):
+        self.pending_documents.extend(documents)
+        self.pending_metadatas.extend(metadatas)
+        self.pending_ids.extend(ids)
+
+        if len(self.pending_ids) >= self.max_buffered_writes:
+            self.flush()
+
+    def flush(self):
+        if len(self.pending_ids) == 0:
+            return
+
+        self.collection.add(
+            documents=self.pending_documents,
+            metadatas=self.pending_metadatas,
+            ids=self.pending_ids
+        )
+        self.pending_documents = []
+        self.pending_metadatas = []
+        self.pending_ids = []
+
+    def get(self, ids=None, where=None):
+        if ids is not None and len(self.pending_ids) > 0:
+            committed_ids = [entry_id for entry_id in ids if entry_id not in self.pending_ids]
+        else:
+            committed_ids = ids
+
+        entries = {'ids': [], 'metadatas': [], 'documents': []}
+        if committed_ids is None or len(committed_ids) > 0:
+            committed_entries = self.collection.get(ids=committed_ids, where=where)
+            entries['ids'].extend(committed_entries['ids'])
+            entries['metadatas'].extend(committed_entries['metadatas'])
+            entries['documents'].extend(committed_entries['documents'])
+
+        for entry_id, metadata, document in zip(self.pending_ids, self.pending_metadatas, self.pending_documents):
+            if ids is not None and entry_id not in ids:
+                continue
+            if not match_where_filter(metadata, where):
+                continue
+            entries['ids'].append(entry_id)
+            entries['metadatas'].append(metadata)
+            entries['documents'].append(document)
+
+        return entries
+
+    def query(self, **kwargs):
+        self.flush()
+        return self.collection.query(**kwargs)
+
+    def upsert(self, **kwargs):
+        self.flush()
+        return self.collection.upsert(**kwargs)
+
+    def update(self, **kwargs):
+        self.flush()
+        return self.collection.update(**kwargs)
+
+
 class Memory:
-    def __init__(self, name):
+    def __init__(self, name, knowledge_service=None):
+        """
+        :param knowledge_service: KnowledgeService (or a proxy of a served one), shares the knowledge with the other agents exploring the same app
+        """
         try:
             chroma_client.delete_collection(name=name)
         except ValueError:
@@ -29,12 +139,14 @@ class Memory:
             pass
 
         # permanent memory
-        self.memory = chroma_client.create_collection(name=name)
+        self.memory = BufferedCollection(chroma_client.create_collection(name=name))
         self.memory_entry_id = 0
         self.visited_activities = defaultdict(lambda: 0)
+        self.abstract_states = AbstractStateRegistry()
         self.exp_data = {
             'app_activities': agent_config.app_activities,
             'visited_activities': self.visited_activities,
+            'visited_abstract_states': self.abstract_states.visit_counts,
             'task_results': {},
         }
         
@@ -56,20 +168,68 @@ class Memory:
 
         # spatial memory
         self.knowledge_map = {} # page name -> knowledge of all widget in that page
-        self.knowledge = chroma_client.create_collection(name=f'{name}_knowledge')
+        self.widget_observation_counts = defaultdict(lambda: 0) # (page name, widget signature) -> number of recorded observations
+        self.page_templates = PageTemplateStore()
+        self.navigation = NavigationIndex() # filled with the UTG transitions by the device manager
+        self.macros = MacroLibrary()
+        self.knowledge = BufferedCollection(chroma_client.create_collection(name=f'{name}_knowledge'))
         self.knowledge_entry_id = 0
-
-    def add_knowledge(self, state, type, page='', widget='', action='', task='', observation='', reflection=''):
+        self.name = name
+        # the name is drawn from the seeded random generator: runs with the same seed would get the same name
+        self.agent_id = f'{name}-{uuid.uuid4().hex[:8]}'
+        self.shared_knowledge = SharedKnowledgeClient(knowledge_service, agent_id=self.agent_id) if knowledge_service is not None else None
+
+    def add_knowledge(self, state, type, page='', widget='', widget_label='', action='', task='', observation='', reflection='', abstract_state='', agent=None):
+        """
+        :param agent: str, the agent that produced the knowledge (None for this agent, in which case it is also published to the shared knowledge service)
+        """
         timestamp=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
         self.knowledge_entry_id += 1
+        metadata = {"type": type, "timestamp": timestamp, "page": page, "widget": widget, "widget_label": widget_label, "action": action, "task": task, "observation": observation, "reflection": reflection, "abstract_state": abstract_state, "agent": agent or self.agent_id}
         
         self.knowledge.add(
             documents=[state.strip()],
-            metadatas=[{"type": type, "timestamp": timestamp, "page": page, "widget": widget, "action": action, "task": task, "observation": observation, "reflection": reflection}],
+            metadatas=[metadata],
             ids=[str(self.knowledge_entry_id)]
         )
+        if agent is None and self.shared_knowledge is not None:
+            self.shared_knowledge.publish_entry(str(self.knowledge_entry_id), state.strip(), dict(metadata))
         return str(self.knowledge_entry_id)
 
+    def sync_shared_knowledge(self):
+        """
+        Merge the knowledge entries and widget role summaries published by the other agents since the last sync
+        :return: int, the number of merged entries
+        """
+        if self.shared_knowledge is None:
+            return 0
+
+        entries = self.shared_knowledge.pull_entries()
+        for entry in entries:
+            metadata = entry['metadata']
+            # abstract state IDs are local to each agent
+            self.add_knowledge(entry['document'], metadata['type'], page=metadata['page'], widget=metadata['widget'], widget_label=metadata['widget_label'], action=metadata['action'], task=metadata['task'], observation=metadata['observation'], reflection=metadata['reflection'], agent=entry['agent'])
+            if metadata['type'] == 'WIDGET':
+                self.widget_observation_counts[(metadata['page'], metadata['widget'])] += 1
+
+        for summary in self.shared_knowledge.pull_summaries():
+            if summary['page'] not in self.knowledge_map:
+                self.knowledge_map[summary['page']] = {}
+            if summary['widget'] not in self.knowledge_map[summary['page']]:
+                self.knowledge_map[summary['page']][summary['widget']] = {
+                    'label': summary['label'],
+                    'action_count': defaultdict(lambda: 0),
+                    'recent_role_inference': None
+                }
+            self.knowledge_map[summary['page']][summary['widget']]['recent_role_inference'] = summary['summary']
+
+        return len(entries)
+
+    def flush(self):
+        # embed and store all buffered entries (called at phase boundaries)
+        self.memory.flush()
+        self.knowledge.flush()
+
     def get_widget_knowledge(self, page_name, widget_signature):
         if page_name not in self.knowledge_map:
             return None
@@ -98,6 +258,7 @@ class Memory:
             self.knowledge_map[page_name] = {}
         if widget_signature not in self.knowledge_map[page_name]:
             self.knowledge_map[page_name][widget_signature] = {
+                'label': widget.label,
                 'action_count': defaultdict(lambda: 0),
                 'recent_role_inference': None
             }
@@ -113,7 +274,20 @@ class Memory:
             self.performed_action_types_for_task[(page_name, widget_signature)][event_type] = 0
         self.performed_action_types_for_task[(page_name, widget_signature)][event_type] += 1
 
-        self.add_knowledge(state, 'WIDGET', page=page_name, widget=widget_signature, action=performed_action.action_type_signature, observation=observation, task=task)
+        gui_state = self.find_gui_state(state)
+        abstract_state = ''
+        if gui_state is not None:
+            self.abstract_states.record_action(gui_state, widget)
+            abstract_state = gui_state.abstract_state_id
+
+        self.add_knowledge(state, 'WIDGET', page=page_name, widget=widget_signature, widget_label=widget.label, action=performed_action.action_type_signature, observation=observation, task=task, abstract_state=abstract_state)
+        self.widget_observation_counts[(page_name, widget_signature)] += 1
+
+    def get_widget_observation_count(self, page_name, widget_signature):
+        """
+        Number of observations recorded for a widget; the inferred role of the widget can only change when it grows
+        """
+        return self.widget_observation_counts.get((page_name, widget_signature), 0)
 
 
     def update_widget_knowledge_with_none_observation(self, state, page_name, widget, performed_action, task):
@@ -124,6 +298,7 @@ class Memory:
             self.knowledge_map[page_name] = {}
         if widget_signature not in self.knowledge_map[page_name]:
             self.knowledge_map[page_name][widget_signature] = {
+                'label': widget.label,
                 'action_count': defaultdict(lambda: 0),
                 'recent_role_inference': None
             }
@@ -139,6 +314,10 @@ class Memory:
             self.performed_action_types_for_task[(page_name, widget_signature)][event_type] = 0
         self.performed_action_types_for_task[(page_name, widget_signature)][event_type] += 1
 
+        gui_state = self.find_gui_state(state)
+        if gui_state is not None:
+            self.abstract_states.record_action(gui_state, widget)
+
 
     def update_widget_knowledge_summary(self, page_name, widget, summary):
         widget_signature = widget.signature
@@ -148,14 +327,18 @@ class Memory:
             self.knowledge_map[page_name] = {}
         if widget_signature not in self.knowledge_map[page_name]:
             self.knowledge_map[page_name][widget_signature] = {
+                'label': widget.label,
                 'action_count': defaultdict(lambda: 0),
                 'recent_role_inference': None
             }
         
         self.knowledge_map[page_name][widget_signature]['recent_role_inference'] = summary
+        if self.shared_knowledge is not None:
+            self.shared_knowledge.publish_summary(page_name, widget_signature, widget.label, summary)
 
     def retrieve_task_knowledge_by_state(self, N=5):
         # TODO: prioritize recent task knowledge
+        self.sync_shared_knowledge()
         query = self.current_gui_state.signature
 
         relevant_entries = self.knowledge.query(
@@ -174,6 +357,7 @@ class Memory:
 
     
     def retrieve_widget_knowledge_by_state(self, page_name, widget, N=5, prompt_recorder=None):
+        self.sync_shared_knowledge()
         query = self.current_gui_state.signature
         widget_signature = widget.signature
 
@@ -232,6 +416,7 @@ class Memory:
         
         task_knowledge = []
         widget_knowledge = defaultdict(lambda: defaultdict(list))
+        widget_labels = {}
 
         for memory_id, metadata, state in zip(raw_entries['ids'], raw_entries['metadatas'], raw_entries['documents']):
             prop_to_show = 'reflection'
@@ -244,6 +429,7 @@ class Memory:
             if prop_to_show == 'observation':
                 action_type = metadata['action']
                 widget_knowledge[metadata['page']][metadata['widget']].append((int(memory_id), (action_type, knowledge)))
+                widget_labels[metadata['widget']] = metadata.get('widget_label', '')
             else:
                 task_knowledge.append((int(memory_id), (metadata['task'], knowledge)))
 
@@ -253,6 +439,7 @@ class Memory:
             for widget_signature, entries in widgets.items():
                 entries.sort(key=lambda x: x[0])
                 widget_knowledge_with_summary[page_name][widget_signature] = {
+                    'label': widget_labels.get(widget_signature, ''),
                     'summary': None,
                     'entries': [entry[1] for entry in entries],
                 }
@@ -263,6 +450,7 @@ class Memory:
                     widget_knowledge_with_summary[page_name][widget_signature]['summary'] = self.knowledge_map[page_name][widget_signature]
                 else:
                     widget_knowledge_with_summary[page_name][widget_signature] = {
+                        'label': self.knowledge_map[page_name][widget_signature].get('label', ''),
                         'summary': self.knowledge_map[page_name][widget_signature],
                     }
 
@@ -271,7 +459,11 @@ class Memory:
 
         return task_knowledge, widget_knowledge_with_summary
             
-    def save_snapshot(self, output_dir):
+    def capture_snapshot(self):
+        """
+        Serialize the memory (on the caller's thread, so that the snapshot is consistent even if it is written in the background)
+        :return: dict, file name -> bytes
+        """
         working_memory_record = []
         for desc, record_type, timestamp, page in self.working_memory:
             working_memory_record.append({
@@ -290,23 +482,29 @@ class Memory:
             'all_activities': agent_config.app_activities,
             'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()),
             'current_activity_coverage': len(self.visited_activities) / len(agent_config.app_activities),
+            'abstract_states': self.abstract_states.to_dict(),
+            'macros': self.macros.to_dict(),
             'working_memory': working_memory_record,
         }
 
-        with open(os.path.join(output_dir, 'scratch.json'), 'w') as f:
-            json.dump(scratch, f, indent=2)
+        task_knowledge, widget_knowledge = self.collect_knowledge()
 
-        with open(os.path.join(output_dir, 'long_term_memory.txt'), 'w') as f:
-            long_term_memory_str = self.__str__()
-            f.write(long_term_memory_str)
+        return {
+            'scratch.json': dumps_json(scratch),
+            'long_term_memory.txt': self.__str__().encode('utf-8'),
+            'task_knowledge.json': dumps_json(task_knowledge),
+            'widget_knowledge.json': dumps_json(widget_knowledge),
+        }
 
-        task_knowledge, widget_knowledge = self.collect_knowledge()
+    @staticmethod
+    def write_snapshot(snapshot, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        for file_name, content in snapshot.items():
+            with open(os.path.join(output_dir, file_name), 'wb') as f:
+                f.write(content)
 
-        with open(os.path.join(output_dir, 'task_knowledge.json'), 'w') as f:
-            json.dump(task_knowledge, f, indent=2)
-        
-        with open(os.path.join(output_dir, 'widget_knowledge.json'), 'w') as f:
-            json.dump(widget_knowledge, f, indent=2)
+    def save_snapshot(self, output_dir):
+        self.write_snapshot(self.capture_snapshot(), output_dir)
 
     def describe_current_plan(self):
         assert self.current_plan is not None
@@ -331,9 +529,37 @@ class Memory:
             entries = self.memory.get()
             return self.__stringify(entries, show_timestamps=True, show_type=False, max_len=100)
     
+    def describe_unexplored_states(self, limit=MAX_UNEXPLORED_STATES):
+        """
+        Describe the abstract states (screens) with interactable widgets never tried yet, for the planner
+        """
+        unexplored_states = self.abstract_states.get_unexplored_states(limit=limit)
+        if len(unexplored_states) == 0:
+            return 'none'
+        return '; '.join(f'{state.describe()}: {state.untried_widget_count} untried widgets' for state in unexplored_states)
+
+    def get_reachable_pages(self):
+        """
+        :return: list of str, the pages of the app that can be reached from the current GUI state through a known route
+        """
+        reachable_pages = self.navigation.get_reachable_pages(self.current_gui_state.state_str, self.current_gui_state.activity)
+        return sorted(page for page in reachable_pages if page in agent_config.app_activities)
+
+    def find_gui_state(self, state_signature):
+        """
+        :return: GUIState, the current or previous GUI state with the given signature (None if neither matches)
+        """
+        for gui_state in [self.current_gui_state, self.previous_gui_state]:
+            if gui_state is not None and gui_state.signature == state_signature:
+                return gui_state
+        return None
+
     def set_current_gui_state(self, gui_state):
         self.previous_gui_state = self.current_gui_state
         self.current_gui_state = gui_state
+        self.page_templates.observe(gui_state)
+        self.abstract_states.observe(gui_state)
+        self.sync_shared_knowledge()
 
     def add_visited_activity(self, activity):
         if activity in agent_config.app_activities: # internal page
@@ -12,6 +12,8 @@ MAX_TOKENS = 500
 MAX_RETRY = 1000
 TEMPERATURE = 0.6
 
+llm_backend = None # callable with the signature of get_next_assistant_message that replaces the OpenAI API (e.g., the fake LLM of scripts/simulator.py)
+
 class APIUsageManager:
     usage = {}
     response_time = {}
@@ -56,7 +58,14 @@ def zip_messages(system_message, user_messages, assistant_messages):
         "conversation": conversation
     }
 
+def set_llm_backend(backend):
+    global llm_backend
+    llm_backend = backend
+
 def get_next_assistant_message(system_message, user_messages, assistant_messages=[], functions=[], model="gpt-3.5-turbo-16k-0613", max_tokens=MAX_TOKENS, function_call_option=None):
+    if llm_backend is not None:
+        return llm_backend(system_message, user_messages, assistant_messages, functions=functions, model=model, max_tokens=max_tokens, function_call_option=function_call_option)
+
     # If model is gpt-3.5-turbo-16k-0613 but the tokens in the prompt are less than 4000 tokens, use gpt-3.5-turbo-0613 instead
     if model == "gpt-3.5-turbo-16k-0613" and len(stringify_prompt(zip_messages(system_message, user_messages, assistant_messages))) < 8000: # approximately 4000 tokens
         model = "gpt-3.5-turbo-0613"
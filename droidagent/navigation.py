@@ -0,0 +1,103 @@
+from collections import defaultdict, deque
+
+MAX_ROUTE_LENGTH = 10 # events
+
+
+class NavigationHop:
+    def __init__(self, event, target_state, target_page):
+        self.event = event
+        self.target_state = target_state # None for a page-level hop
+        self.target_page = target_page
+
+
+def find_shortest_path(edges, source, is_target, max_length):
+    """
+    BFS over `edges` (node -> event key -> (event, next node))
+    :return: list of (event, node), the events to send and the node expected after each of them (None if no target is reachable)
+    """
+    parents = {source: None}
+    queue = deque([(source, 0)])
+    while len(queue) > 0:
+        node, length = queue.popleft()
+        if node != source and is_target(node):
+            path = []
+            while parents[node] is not None:
+                previous_node, event = parents[node]
+                path.append((event, node))
+                node = previous_node
+            return list(reversed(path))
+
+        if length >= max_length:
+            continue
+        for event, next_node in edges.get(node, {}).values():
+            if next_node not in parents:
+                parents[next_node] = (node, event)
+                queue.append((next_node, length + 1))
+
+    return None
+
+
+def get_path_lengths(edges, source, max_length):
+    lengths = {source: 0}
+    queue = deque([source])
+    while len(queue) > 0:
+        node = queue.popleft()
+        if lengths[node] >= max_length:
+            continue
+        for _, next_node in edges.get(node, {}).values():
+            if next_node not in lengths:
+                lengths[next_node] = lengths[node] + 1
+                queue.append(next_node)
+    return lengths
+
+
+class NavigationIndex:
+    """
+    Index of the transitions recorded in the UTG, to reach a known page by replaying events instead of asking the LLM at every hop
+    - state-level edges: (source state, event) -> target state
+    - page-level edges: (source page, event) -> target page, used when the current state is not a known source (e.g., the same page with different content);
+      the event can only be replayed if its target view is on the screen
+    Routes are the shortest paths in number of events, and should be verified hop by hop by the caller.
+    """
+    def __init__(self):
+        self.state_edges = defaultdict(dict) # source state_str -> event_str -> (event, target state_str)
+        self.page_edges = defaultdict(dict) # source page -> event_str -> (event, target page)
+        self.state_pages = {} # state_str -> page name
+
+    def add_transition(self, event, event_str, source_state, source_page, target_state, target_page):
+        self.state_pages[source_state] = source_page
+        self.state_pages[target_state] = target_page
+        if source_state != target_state:
+            self.state_edges[source_state][event_str] = (event, target_state)
+        if source_page != target_page:
+            self.page_edges[source_page][event_str] = (event, target_page)
+
+    def find_route(self, source_state, source_page, target_page, max_length=MAX_ROUTE_LENGTH):
+        """
+        :return: list of NavigationHop, the shortest known route from the source state to the target page (None if there is no known route)
+        """
+        path = find_shortest_path(self.state_edges, source_state, lambda state: self.state_pages.get(state) == target_page, max_length)
+        if path is not None:
+            return [NavigationHop(event, state, self.state_pages[state]) for event, state in path]
+
+        path = find_shortest_path(self.page_edges, source_page, lambda page: page == target_page, max_length)
+        if path is not None:
+            return [NavigationHop(event, None, page) for event, page in path]
+
+        return None
+
+    def get_reachable_pages(self, source_state, source_page, max_length=MAX_ROUTE_LENGTH):
+        """
+        :return: dict, page name -> number of events of the shortest known route from the source state
+        """
+        reachable_pages = {}
+        for state, length in get_path_lengths(self.state_edges, source_state, max_length).items():
+            page = self.state_pages.get(state)
+            if page is not None and length < reachable_pages.get(page, max_length + 1):
+                reachable_pages[page] = length
+        for page, length in get_path_lengths(self.page_edges, source_page, max_length).items():
+            if length < reachable_pages.get(page, max_length + 1):
+                reachable_pages[page] = length
+
+        reachable_pages.pop(source_page, None)
+        return reachable_pages
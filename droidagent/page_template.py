@@ -0,0 +1,63 @@
+from collections import defaultdict
+
+MIN_TEMPLATE_VISITS = 3 # number of visits of a page before its template is used
+TEMPLATE_STABILITY = 0.8 # fraction of the visits of a page in which a widget must appear to be part of the template
+
+
+class PageTemplateStore:
+    """
+    Learns the stable widget skeleton of each page (toolbars, navigation drawers, tabs, ...) from the visited GUI states
+    A screen can then be described as "template + dynamic part", so that a conversation only needs to receive the template once.
+    Only widgets whose (structural) signature is unique in the screen and that are not in a scrollable container (whose content is dynamic by nature)
+    are considered, so that list rows are never split.
+    """
+    def __init__(self):
+        self.visit_counts = defaultdict(lambda: 0) # page name -> number of observed visits
+        self.signature_counts = defaultdict(lambda: defaultdict(lambda: 0)) # page name -> widget signature -> number of visits with the widget
+        self.template_names = {}
+
+    def observe(self, gui_state):
+        page_name = gui_state.activity
+        self.visit_counts[page_name] += 1
+        for widget_signature, widgets in gui_state.signature2widgets.items():
+            if len(widgets) == 1:
+                self.signature_counts[page_name][widget_signature] += 1
+
+    def get_template_name(self, page_name):
+        if page_name not in self.template_names:
+            self.template_names[page_name] = f'P{len(self.template_names) + 1}'
+        return self.template_names[page_name]
+
+    def is_stable(self, page_name, widget_signature):
+        return self.signature_counts[page_name].get(widget_signature, 0) >= TEMPLATE_STABILITY * self.visit_counts[page_name]
+
+    def get_template_widgets(self, gui_state):
+        """
+        :return: list of Widget, the top-most widgets of the given GUI state that belong to the template of its page (their subtrees are stable as a whole)
+        """
+        page_name = gui_state.activity
+        if self.visit_counts[page_name] < MIN_TEMPLATE_VISITS:
+            return []
+
+        template_widgets = []
+        def collect_template_widgets(widgets):
+            for widget in widgets:
+                if 'scroll' in widget.possible_action_types:
+                    continue
+                if len(gui_state.signature2widgets[widget.signature]) == 1 and self.is_stable(page_name, widget.signature):
+                    template_widgets.append(widget)
+                else:
+                    collect_template_widgets(widget.children)
+
+        collect_template_widgets(gui_state.root_widgets)
+        return template_widgets
+
+    def get_template(self, gui_state):
+        """
+        :return: (str, list of Widget), name of the page template and the widgets of the GUI state it covers, (None, []) if the page has no template yet
+        """
+        template_widgets = self.get_template_widgets(gui_state)
+        if len(template_widgets) == 0:
+            return None, []
+
+        return self.get_template_name(gui_state.activity), template_widgets
@@ -0,0 +1,49 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class BackgroundPipeline:
+    """
+    Single-worker FIFO executor for the work that the next LLM call does not depend on (UTG updates, view image crops, event records)
+    - tasks run one at a time in submission order (e.g., UTG transitions are added in the order of the events)
+    - memory is never mutated in the background: callers capture what they need on the main thread and submit plain data
+    - a failed task is logged and its error is re-raised on the main thread by the next `submit` or `barrier`
+    """
+    def __init__(self, name='background-pipeline'):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.pending_tasks = []
+        self.error = None
+        self.logger = logging.getLogger('agent')
+
+    def submit(self, func, *args, **kwargs):
+        self.raise_error()
+        self.pending_tasks = [task for task in self.pending_tasks if not task.done()]
+        task = self.executor.submit(self.run_task, func, args, kwargs)
+        self.pending_tasks.append(task)
+        return task
+
+    def run_task(self, func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            self.logger.exception(f'Background task {getattr(func, "__name__", func)} failed')
+            if self.error is None:
+                self.error = e
+            raise
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def barrier(self):
+        """
+        Wait until all submitted tasks are done (e.g., before reading the UTG on the main thread)
+        """
+        wait(self.pending_tasks)
+        self.pending_tasks = []
+        self.raise_error()
+
+    def close(self):
+        self.barrier()
+        self.executor.shutdown()
@@ -9,7 +9,13 @@ def initialize_possible_actions(memory):
     possible_action_functions = {}
     function_map = {}
     current_context.set_widgets(memory.current_gui_state.actiontype2widgets)
+    current_context.set_reachable_pages(memory.get_reachable_pages())
+    current_context.set_macros(memory.macros.get_applicable_macros(memory.current_gui_state))
     function_creators = [create_touch_action_definition, create_set_text_action_definition, create_scroll_action_definition, create_long_touch_action_definition, create_go_back_action_definition, create_end_task_definition, create_wait_definition]
+    if len(current_context.get_reachable_pages()) > 0:
+        function_creators.append(create_navigate_action_definition)
+    if len(current_context.get_macro_ids()) > 0:
+        function_creators.append(create_run_macro_definition)
 
     for function_creator in function_creators:
         function_def, func = function_creator()
@@ -20,6 +26,8 @@ def initialize_possible_actions(memory):
 
 def prompt_action(memory, prompt_recorder=None):
     possible_action_functions, function_map = initialize_possible_actions(memory)
+    navigate_action_type = '- Navigate to a previously visited page through a known route\n' if 'navigate' in possible_action_functions else ''
+    macro_action_type = '- Perform a sequence of actions repeated in previous tasks in one go\n' if 'run_macro' in possible_action_functions else ''
 
     system_message = f'''
 You are a helpful assistant to guide a user named {agent_config.persona_name} to select an appropriate GUI action to accomplish a task on an Android mobile application named {agent_config.app_name}.
@@ -33,7 +41,7 @@ The profile of {agent_config.persona_name} is as follows:
 - Long touch on a long-clickable widget
 - Fill in an editable widget
 - Navigate back by pressing the back button
-or end the task if the task is already completed.
+{navigate_action_type}{macro_action_type}or end the task if the task is already completed.
 '''.strip()
 
     user_messages, assistant_messages = memory.make_thread_from_working_memory()
@@ -94,10 +94,39 @@ Following types of actions can be performed:
     return action
 
 
+def describe_current_page(memory, full_prompt):
+    """
+    Describe the current page as its page template (only if not described yet in the conversation) + the rest of the page
+    """
+    gui_state = memory.current_gui_state
+    page_template, template_widgets = memory.page_templates.get_template(gui_state)
+    if page_template is None:
+        return f'''Current page:
+```json
+{gui_state.describe_screen_w_memory(memory, include_widget_knowledge=False)}
+```'''
+
+    template_description = ''
+    page_template_text = gui_state.describe_page_template(page_template, template_widgets)
+    if full_prompt['page_templates'].get(page_template) != page_template_text:
+        full_prompt['page_templates'][page_template] = page_template_text
+        template_description = f'''Page template {page_template} (static widgets of the page; when a page refers to template {page_template}, these widgets are also on the page, and `template_widget_IDs` gives their actual widget IDs):
+```json
+{page_template_text}
+```
+'''
+
+    return f'''{template_description}Current page (the widgets of page template {page_template} are omitted):
+```json
+{gui_state.describe_screen_w_memory(memory, include_widget_knowledge=False, page_template=page_template, template_widgets=template_widgets)}
+```'''
+
+
 def prompt_next_action(memory, error_message=None, full_prompt=None, contain_feedback=True):
     possible_action_functions, function_map = initialize_possible_actions(memory)
 
     if error_message is None:
+        current_page_description = describe_current_page(memory, full_prompt)
         if contain_feedback:
             action_function_query = 'Good. we successfully did the above action. '
         else:
@@ -105,12 +134,9 @@ def prompt_next_action(memory, error_message=None, full_prompt=None, contain_fee
         action_function_query += f'''
 What GUI action is required next? Select one action that is the most effective to test the app.
 
-We have tested following pages with the visit count: {remove_quotes(json.dumps(memory.visited_activities))}
+We have tested following pages with the visit count: {dumps_unquoted(memory.visited_activities)}
 
-Current page:
-```json
-{memory.current_gui_state.describe_screen_w_memory(memory, include_widget_knowledge=False)}
-```
+{current_page_description}
 Note that `num_prev_actions` for each widget means the number of times the widget was tested.
 
 Following types of actions can be performed:
@@ -13,6 +13,8 @@ def prompt_new_task(memory, prompt_recorder=None):
     # TODO: refer to spatial memory - what is the current page? what are the widgets in the current page?
     # TODO: refer to temporal memory - what are the memorable tasks so far?
     unvisited_pages = list(set(agent_config.app_activities) - set(memory.visited_activities.keys()))
+    navigate_action_type = '\n- Navigate to a previously visited page through a known route' if len(memory.get_reachable_pages()) > 0 else ''
+    macro_action_type = '\n- Perform a sequence of actions repeated in previous tasks in one go' if len(memory.macros.get_applicable_macros(memory.current_gui_state)) > 0 else ''
 
     system_message = f'''
 You are a helpful task planner for using an Android mobile application named {agent_config.app_name}. You are planning for a person named "{agent_config.persona_name}" with the following profile:
@@ -21,9 +23,10 @@ You are a helpful task planner for using an Android mobile application named {ag
 {agent_config.persona_name}'s ultimate goal is to {agent_config.ultimate_goal}. 
 
 - {agent_config.app_name} app has following pages: {remove_quotes(str(agent_config.app_activities))} (Note that the pages are listed in random order)
-- Currently, {agent_config.persona_name} has visited the following pages with the following number of times: {remove_quotes(json.dumps(memory.visited_activities))}
-- Currently, {agent_config.persona_name} is on the {memory.current_gui_state.activity} page.
+- Currently, {agent_config.persona_name} has visited the following pages with the following number of times: {dumps_unquoted(memory.visited_activities)}
+- Currently, {agent_config.persona_name} is on the {memory.current_gui_state.activity} page (screen {memory.current_gui_state.abstract_state_id}).
 - Pages never visited yet: {remove_quotes(str(unvisited_pages))} 
+- Screens with widgets never tried yet (screen ID on page (texts on the screen)): {remove_quotes(memory.describe_unexplored_states())}
 
 {agent_config.persona_name} is not familiar with the app and does not fully know how to navigate to each page and what {agent_config.persona_name} can do on each page.
 To effectively explore the app for their goal, {agent_config.persona_name} needs a new task that aligns with the following desirable properties:
@@ -60,7 +63,7 @@ Note that `num_prev_actions` means the number of times the widget has been inter
 - Touch on a clickable widget
 - Long touch on a long-clickable widget
 - Fill in an editable widget
-- Navigate back by pressing the back button
+- Navigate back by pressing the back button{navigate_action_type}{macro_action_type}
 
 I am going to provide a template for your output to reason about your next task step by step. Fill out the <...> parts in the template with your own words. Do not include anything else in your answer except the text to fill out the template. Preserve the formatting and overall template.
 
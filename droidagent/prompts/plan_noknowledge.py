@@ -30,9 +30,10 @@ You are a helpful task planner for using an Android mobile application named {ag
 {agent_config.persona_name}'s ultimate goal is to {agent_config.ultimate_goal}. 
 
 - {agent_config.app_name} app has following pages: {remove_quotes(str(agent_config.app_activities))} (Note that the pages are listed in random order)
-- Currently, {agent_config.persona_name} has visited the following pages with the following number of times: {remove_quotes(json.dumps(memory.visited_activities))}
-- Currently, {agent_config.persona_name} is on the {memory.current_gui_state.activity} page.
+- Currently, {agent_config.persona_name} has visited the following pages with the following number of times: {dumps_unquoted(memory.visited_activities)}
+- Currently, {agent_config.persona_name} is on the {memory.current_gui_state.activity} page (screen {memory.current_gui_state.abstract_state_id}).
 - Pages never visited yet: {remove_quotes(str(unvisited_pages))} 
+- Screens with widgets never tried yet (screen ID on page (texts on the screen)): {remove_quotes(memory.describe_unexplored_states())}
 
 {agent_config.persona_name} is not familiar with the app and does not fully know how to navigate to each page and what {agent_config.persona_name} can do on each page.
 To effectively explore the app for their goal, {agent_config.persona_name} needs a new task that aligns with the following desirable properties:
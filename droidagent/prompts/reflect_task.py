@@ -13,7 +13,7 @@ def reflect_task(memory, prompt_recorder=None):
 
 {agent_config.persona_name} is performing tasks on the app to {agent_config.ultimate_goal}. {agent_config.persona_name} is not familiar with the app and does not fully know what the app can do. {agent_config.persona_name} is trying to learn the app's functionalities by performing realistic tasks on the app.
     - The app has following pages: {remove_quotes(str(agent_config.app_activities))}
-    - Currently, {agent_config.persona_name} has visited the following pages with the following number of times: {remove_quotes(json.dumps(memory.visited_activities))}
+    - Currently, {agent_config.persona_name} has visited the following pages with the following number of times: {dumps_unquoted(memory.visited_activities)}
     - Currently, {agent_config.persona_name} is on the {memory.current_gui_state.activity} page.
 
 Currently, {agent_config.persona_name} has performed actions to accomplish the following task: {task}
@@ -33,7 +33,7 @@ Full task execution history:
 
 Widgets in the current page (page name: {memory.current_gui_state.activity}):
 ===
-{memory.current_gui_state.describe_widgets_NL(length_limit=8000)}
+{memory.current_gui_state.describe_widgets_NL(token_budget=4000)}
 ===
 
 Guideline for the task reflection based on the task result:
@@ -1,6 +1,7 @@
 from ..config import agent_config
 from ..model import get_next_assistant_message, zip_messages
-import difflib
+from ..gui_state import CONTEXT_LENGTH_LIMIT
+from ..state_diff import compute_state_diff
 
 MAX_RETRY = 1
 
@@ -28,13 +29,10 @@ def summarize_state_change(memory, prompt_recorder=None):
     new_state = memory.current_gui_state
     previous_action = memory.previous_action
 
-    diff_str = ''
-    for line in difflib.unified_diff(old_state.describe_widgets_NL().splitlines(), new_state.describe_widgets_NL().splitlines(), fromfile=f'Previous ({old_state.activity})', tofile=f'Current ({new_state.activity})', lineterm=''):
-        if line.startswith('@@'):
-            continue
-        diff_str += line + '\n'
-
-    diff_str = diff_str.strip()
+    state_diff = compute_state_diff(old_state, new_state)
+    diff_str = state_diff.render(fromfile=f'Previous ({old_state.activity})', tofile=f'Current ({new_state.activity})').strip()
+    if len(diff_str) > CONTEXT_LENGTH_LIMIT:
+        diff_str = diff_str[:CONTEXT_LENGTH_LIMIT] + '[...truncated...]'
 
     if len(diff_str) == 0:
         if len(new_state.lost_messages) > 0:
@@ -0,0 +1,237 @@
+from collections import defaultdict
+
+CHARS_PER_TOKEN = 2 # rough estimate for screen descriptions (same ratio as the model selection in model.py: 8000 characters ~ 4000 tokens)
+SCREEN_TOKEN_BUDGET = 7500
+SCREEN_INDENT = 1 # spaces per nesting level of a screen description (the nesting stays readable, leading whitespace halved compared to 2)
+REPEATED_ITEMS_TO_KEEP = 2 # number of items of a repeated list shown in full
+MIN_REPEATED_ITEMS = 3
+COLUMN_SEPARATOR = ' | '
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def is_interactable(widget):
+    return len(widget.possible_action_types) > 0
+
+
+def has_description(widget):
+    return widget.text is not None or widget.content_description is not None or widget.resource_id is not None
+
+
+def iter_rendered_widgets(widgets, excluded_widget_ids):
+    """
+    Widgets to render in place of the given ones: excluded widgets are replaced by their (rendered) children
+    """
+    for widget in widgets:
+        if excluded_widget_ids is not None and id(widget) in excluded_widget_ids:
+            yield from iter_rendered_widgets(widget.children, excluded_widget_ids)
+        else:
+            yield widget
+
+
+def iter_subtree(widget):
+    yield widget
+    for child in widget.children:
+        yield from iter_subtree(child)
+
+
+def get_widget_shape(widget):
+    """
+    Structure of a widget subtree regardless of its texts (list items built from the same layout share it)
+    """
+    return (widget.widget_type, widget.resource_id, tuple(get_widget_shape(child) for child in widget.children))
+
+
+def flatten_node(node, path=()):
+    """
+    :return: generator of (path, value) for every property of a rendered widget (dict) and its descendants
+    """
+    for key, value in node.items():
+        if key == 'children':
+            for index, child in enumerate(value):
+                yield from flatten_node(child, path + (key, index))
+        else:
+            yield path + (key,), value
+
+
+def build_node_from_paths(paths_and_values):
+    node = {}
+    for path, value in paths_and_values:
+        current = node
+        for step, next_step in zip(path[:-1], path[1:]):
+            if isinstance(step, int):
+                continue
+            if isinstance(next_step, int):
+                children = current.setdefault(step, [])
+                while len(children) <= next_step:
+                    children.append({})
+                current = children[next_step]
+            else:
+                current = current.setdefault(step, {})
+        current[path[-1]] = value
+    return node
+
+
+def format_column_value(value):
+    if isinstance(value, list):
+        return ', '.join(str(v) for v in value)
+    return str(value)
+
+
+def collapse_run(items):
+    """
+    Render a run of structurally identical widgets as a template (values varying across the items replaced by <column> placeholders)
+    and one row of column values per item
+    """
+    flattened_items = [list(flatten_node(item)) for item in items]
+    paths = [path for path, _ in flattened_items[0]]
+
+    template_entries = []
+    columns = []
+    column_counts = defaultdict(int)
+    varying_indices = []
+    for index, path in enumerate(paths):
+        values = [flattened_item[index][1] for flattened_item in flattened_items]
+        if all(value == values[0] for value in values[1:]):
+            template_entries.append((path, values[0]))
+            continue
+
+        key = path[-1]
+        column_counts[key] += 1
+        column = key if column_counts[key] == 1 else f'{key}_{column_counts[key]}'
+        columns.append(column)
+        varying_indices.append(index)
+        template_entries.append((path, f'<{column}>'))
+
+    return {
+        'repeated_widgets': len(items),
+        'template': build_node_from_paths(template_entries),
+        'columns': COLUMN_SEPARATOR.join(columns),
+        'rows': [COLUMN_SEPARATOR.join(format_column_value(flattened_item[index][1]) for index in varying_indices) for flattened_item in flattened_items],
+    }
+
+
+def collapse_repeated_siblings(node):
+    """
+    Collapse runs of consecutive siblings with the same rendered structure (list rows, grid cells, ...) in a rendered view hierarchy
+    The given node is not modified; every row of a collapsed run keeps its widget ID(s) in the row values.
+    """
+    if 'children' not in node:
+        return node
+
+    children = [collapse_repeated_siblings(child) for child in node['children']]
+    structures = [tuple(path for path, _ in flatten_node(child)) for child in children]
+
+    collapsed_children = []
+    run_start = 0
+    for index in range(1, len(children) + 1):
+        if index < len(children) and structures[index] == structures[run_start]:
+            continue
+        run = children[run_start:index]
+        if len(run) >= MIN_REPEATED_ITEMS:
+            collapsed_children.append(collapse_run(run))
+        else:
+            collapsed_children.extend(run)
+        run_start = index
+
+    new_node = dict(node)
+    new_node['children'] = collapsed_children
+    return new_node
+
+
+class ScreenPruner:
+    """
+    Prioritized pruning of a widget tree to fit a token budget
+    Widgets are dropped in stages; dropping a widget keeps its children in place, so interactable widgets (and their IDs) are never lost.
+    1. decorative widgets: non-interactable widgets without any text, content description or resource ID (images, layout wrappers)
+    2. repeated list items: beyond the first few items of a list, only the interactable widgets and one label per item are kept
+    3. non-interactable subtrees, deepest first
+    The labels of interactable widgets (their direct text-only children) are kept as well, except for the extra labels of repeated list items.
+    """
+    def __init__(self, root_widgets):
+        self.root_widgets = root_widgets
+        self.depths = {}
+        self.has_interactable_descendant = {}
+        self.parents = {}
+
+        for root_widget in root_widgets:
+            self.index_subtree(root_widget, None, 0)
+
+    def index_subtree(self, widget, parent, depth):
+        self.depths[id(widget)] = depth
+        self.parents[id(widget)] = parent
+        has_interactable_descendant = False
+        for child in widget.children:
+            self.index_subtree(child, widget, depth + 1)
+            has_interactable_descendant = has_interactable_descendant or is_interactable(child) or self.has_interactable_descendant[id(child)]
+        self.has_interactable_descendant[id(widget)] = has_interactable_descendant
+
+    def iter_widgets(self, widgets=None):
+        for widget in (self.root_widgets if widgets is None else widgets):
+            yield widget
+            yield from self.iter_widgets(widget.children)
+
+    def is_label(self, widget):
+        parent = self.parents[id(widget)]
+        return parent is not None and is_interactable(parent) and len(widget.children) == 0 and widget.text is not None
+
+    def get_decorative_widgets(self):
+        return [w for w in self.iter_widgets() if not is_interactable(w) and not has_description(w)]
+
+    def get_repeated_item_widgets(self):
+        pruned_widgets = []
+        for widget in self.iter_widgets():
+            items_by_shape = defaultdict(list)
+            for child in widget.children:
+                items_by_shape[get_widget_shape(child)].append(child)
+
+            for items in items_by_shape.values():
+                if len(items) < MIN_REPEATED_ITEMS:
+                    continue
+                for item in items[REPEATED_ITEMS_TO_KEEP:]:
+                    item_label_kept = False
+                    for w in self.iter_widgets([item]):
+                        if is_interactable(w):
+                            continue
+                        if not item_label_kept and w.text is not None:
+                            item_label_kept = True
+                            continue
+                        pruned_widgets.append(w)
+
+        return pruned_widgets
+
+    def get_deep_subtree_stages(self):
+        stages = defaultdict(list)
+        for w in self.iter_widgets():
+            if is_interactable(w) or self.has_interactable_descendant[id(w)] or self.is_label(w):
+                continue
+            stages[self.depths[id(w)]].append(w)
+
+        return [stages[depth] for depth in sorted(stages.keys(), reverse=True)]
+
+    def get_stages(self):
+        return [self.get_decorative_widgets(), self.get_repeated_item_widgets()] + self.get_deep_subtree_stages()
+
+    def render_within_budget(self, render, token_budget):
+        """
+        :param render: function, set of excluded widget ids -> str
+        :param token_budget: int, maximum (estimated) number of tokens of the rendered text, None for no limit
+        :return: (str, int), the rendered text and the number of pruned widgets
+        """
+        excluded_widget_ids = set()
+        rendered = render(excluded_widget_ids)
+        if token_budget is None or estimate_tokens(rendered) <= token_budget:
+            return rendered, 0
+
+        for stage in self.get_stages():
+            stage_widget_ids = set(id(w) for w in stage) - excluded_widget_ids
+            if len(stage_widget_ids) == 0:
+                continue
+            excluded_widget_ids.update(stage_widget_ids)
+            rendered = render(excluded_widget_ids)
+            if estimate_tokens(rendered) <= token_budget:
+                break
+
+        return rendered, len(excluded_widget_ids)
@@ -0,0 +1,394 @@
+from collections import defaultdict, deque, Counter
+from bisect import bisect_left
+
+APPEARED = 'appeared'
+DISAPPEARED = 'disappeared'
+MOVED = 'moved'
+TEXT_CHANGED = 'text_changed'
+STATE_CHANGED = 'state_changed'
+
+DIFF_CONTEXT_LINES = 3
+NO_STATE = [] # same default as `Widget.state`
+
+# properties shown in the natural language description of a widget (see `Widget.stringify`) that can differ between matched widgets
+# (widget type, resource ID and content description are part of every matching key)
+DESCRIBED_PROPERTIES = ['text', 'state', 'is_password', 'possible_action_types']
+
+
+class WidgetEdit:
+    """
+    Typed edit between two GUI states
+    - APPEARED: only `new_widget` is set
+    - DISAPPEARED: only `old_widget` is set
+    - MOVED / TEXT_CHANGED / STATE_CHANGED: both widgets are set
+    """
+    def __init__(self, edit_type, old_widget=None, new_widget=None):
+        self.edit_type = edit_type
+        self.old_widget = old_widget
+        self.new_widget = new_widget
+
+    @property
+    def widget(self):
+        return self.new_widget if self.new_widget is not None else self.old_widget
+
+    def __repr__(self):
+        if self.edit_type == TEXT_CHANGED:
+            return f'{self.edit_type}: {self.old_widget.label} -> "{self.new_widget.text}"'
+        if self.edit_type == STATE_CHANGED:
+            return f'{self.edit_type}: {self.widget.label} {list(self.old_widget.state)} -> {list(self.new_widget.state)}'
+        return f'{self.edit_type}: {self.widget.label}'
+
+
+class StateDiff:
+    """
+    Result of `compute_state_diff`: widget matching between two GUI states and the typed edits
+    """
+    def __init__(self, old_state, new_state, old_partners, new_partners, stable):
+        self.old_state = old_state
+        self.new_state = new_state
+        self.old_partners = old_partners # old widget index -> matched new widget index (or None)
+        self.new_partners = new_partners # new widget index -> matched old widget index (or None)
+        self.stable = stable # new widget index -> whether the matched widget kept its relative order
+        self.edits = []
+
+        old_widgets = old_state.widgets
+        new_widgets = new_state.widgets
+
+        for j, new_widget in enumerate(new_widgets):
+            i = new_partners[j]
+            if i is None:
+                self.edits.append(WidgetEdit(APPEARED, new_widget=new_widget))
+                continue
+
+            old_widget = old_widgets[i]
+            if not stable[j]:
+                self.edits.append(WidgetEdit(MOVED, old_widget, new_widget))
+            old_elem, new_elem = old_widget.elem_dict, new_widget.elem_dict
+            if old_elem is new_elem: # widget shared by both states (cached GUI state)
+                continue
+            if old_elem.get('state', NO_STATE) != new_elem.get('state', NO_STATE):
+                self.edits.append(WidgetEdit(STATE_CHANGED, old_widget, new_widget))
+            if old_elem.get('text') != new_elem.get('text'):
+                self.edits.append(WidgetEdit(TEXT_CHANGED, old_widget, new_widget))
+
+        for i, old_widget in enumerate(old_widgets):
+            if old_partners[i] is None:
+                self.edits.append(WidgetEdit(DISAPPEARED, old_widget=old_widget))
+
+    def get_edits(self, edit_type):
+        return [edit for edit in self.edits if edit.edit_type == edit_type]
+
+    def is_empty(self):
+        return len(self.edits) == 0
+
+    def iter_line_ops(self):
+        """
+        Edit script over the widget lists of both states in the order of a line-based diff
+        :return: generator of (tag, old_widget, new_widget), tag in {' ', '-', '+'}
+        """
+        old_widgets = self.old_state.widgets
+        new_widgets = self.new_state.widgets
+
+        i = 0
+        for j, new_widget in enumerate(new_widgets):
+            partner = self.new_partners[j]
+            if partner is None or not self.stable[j]:
+                yield ('+', None, new_widget)
+                continue
+
+            # old widgets before the anchor are either removed or moved elsewhere
+            while i < partner:
+                if self.old_partners[i] is None or not self.stable[self.old_partners[i]]:
+                    yield ('-', old_widgets[i], None)
+                i += 1
+            i = partner + 1
+
+            old_widget = old_widgets[partner]
+            if list(map(old_widget.elem_dict.get, DESCRIBED_PROPERTIES)) != list(map(new_widget.elem_dict.get, DESCRIBED_PROPERTIES)):
+                yield ('-', old_widget, None)
+                yield ('+', None, new_widget)
+            else:
+                yield (' ', old_widget, new_widget)
+
+        while i < len(old_widgets):
+            if self.old_partners[i] is None or not self.stable[self.old_partners[i]]:
+                yield ('-', old_widgets[i], None)
+            i += 1
+
+    def render(self, fromfile='', tofile='', describe=None, context=DIFF_CONTEXT_LINES):
+        """
+        Render the diff in the unified diff format (without hunk headers) over one line per widget
+        :param describe: function, Widget -> str (default: natural language description of the widget without children text)
+        """
+        if describe is None:
+            describe = lambda w: w.stringify(include_children_text=False)
+
+        ops = list(self.iter_line_ops())
+        # an op is shown if it is a change or within `context` lines of one
+        shown = [False] * len(ops)
+        last_shown = -1
+        for k, (tag, _, _) in enumerate(ops):
+            if tag == ' ':
+                continue
+            for c in range(max(last_shown + 1, k - context), min(len(ops), k + context + 1)):
+                shown[c] = True
+            last_shown = max(last_shown, min(len(ops), k + context + 1) - 1)
+        if last_shown < 0:
+            return ''
+
+        lines = [f'--- {fromfile}', f'+++ {tofile}']
+        for (tag, old_widget, new_widget), is_shown in zip(ops, shown):
+            if is_shown:
+                lines.append(tag + describe(old_widget if tag == '-' else new_widget))
+
+        return '\n'.join(lines)
+
+
+def own_properties_key(w):
+    # same properties as the signature, without the children (the text of text fields is editable)
+    text = None if 'set_text' in w.possible_action_types else w.text
+    return (w.widget_type, w.resource_id, w.content_description, text)
+
+
+def identifier_key(w):
+    if w.resource_id is None and w.content_description is None:
+        return None
+    return (w.widget_type, w.resource_id, w.content_description)
+
+
+SIBLING_KEY_FUNCS = [
+    lambda position, w: w.signature,
+    lambda position, w: own_properties_key(w),
+    lambda position, w: identifier_key(w),
+    lambda position, w: (w.widget_type, w.resource_id, w.content_description, position), # same slot under the parent (e.g., a label whose text changed)
+]
+
+GLOBAL_KEY_FUNCS = [
+    lambda position, w: w.signature,
+    lambda position, w: own_properties_key(w),
+    lambda position, w: identifier_key(w),
+]
+
+
+class WidgetMatcher:
+    """
+    Widget matching between two GUI states (see `compute_state_diff`)
+    """
+    def __init__(self, old_state, new_state):
+        self.old_widgets = old_state.widgets
+        self.new_widgets = new_state.widgets
+        self.old_root_widgets = old_state.root_widgets
+        self.new_root_widgets = new_state.root_widgets
+        self.old_indices = {id(w): index for index, w in enumerate(self.old_widgets)}
+        self.new_indices = {id(w): index for index, w in enumerate(self.new_widgets)}
+        self.old_partners = [None] * len(self.old_widgets)
+        self.new_partners = [None] * len(self.new_widgets)
+        # widget objects may be shared by both states (cached GUI states), so matched widgets are tracked per side
+        self.old_matched_ids = set()
+        self.new_matched_ids = set()
+        self.new_subtree_matched_ids = set() # new widgets paired together with their whole subtree (their children need no alignment)
+
+    def pair(self, old_widget, new_widget):
+        i, j = self.old_indices[id(old_widget)], self.new_indices[id(new_widget)]
+        self.old_partners[i] = j
+        self.new_partners[j] = i
+        self.old_matched_ids.add(id(old_widget))
+        self.new_matched_ids.add(id(new_widget))
+
+    def pair_subtrees(self, old_widget, new_widget):
+        # identical signatures imply identical subtree structures (`pair` inlined: whole screens are paired this way)
+        # descendants already paired by an earlier phase keep their partners (re-pairing only one side would leave the other side's partner stale)
+        old_indices, new_indices = self.old_indices, self.new_indices
+        old_partners, new_partners = self.old_partners, self.new_partners
+        old_matched_ids, new_matched_ids, new_subtree_matched_ids = self.old_matched_ids, self.new_matched_ids, self.new_subtree_matched_ids
+        subtree_pairs = [(old_widget, new_widget)]
+        while len(subtree_pairs) > 0:
+            old_w, new_w = subtree_pairs.pop()
+            old_id, new_id = id(old_w), id(new_w)
+            if old_id not in old_matched_ids and new_id not in new_matched_ids:
+                i, j = old_indices[old_id], new_indices[new_id]
+                old_partners[i] = j
+                new_partners[j] = i
+                old_matched_ids.add(old_id)
+                new_matched_ids.add(new_id)
+                new_subtree_matched_ids.add(new_id)
+            if len(new_w.children) > 0:
+                subtree_pairs.extend(zip(old_w.children, new_w.children))
+
+    def is_matched(self, widget, is_old):
+        if is_old:
+            return id(widget) in self.old_matched_ids
+        return id(widget) in self.new_matched_ids
+
+    def match_unique_subtrees(self):
+        """
+        Pair subtrees whose signature occurs exactly once in each state (unambiguous anchors, as in patience diff)
+        """
+        old_signatures = [w.signature for w in self.old_widgets]
+        new_signatures = [w.signature for w in self.new_widgets]
+        old_counts = Counter(old_signatures)
+        new_counts = Counter(new_signatures)
+
+        unique_old_widgets = {signature: w for signature, w in zip(old_signatures, self.old_widgets) if old_counts[signature] == 1}
+        old_matched_ids = self.old_matched_ids
+        for j in reversed(range(len(self.new_widgets))): # widgets are listed in post-order: ancestors first
+            signature = new_signatures[j]
+            if self.new_partners[j] is not None or new_counts[signature] != 1:
+                continue
+            old_widget = unique_old_widgets.get(signature)
+            if old_widget is not None and id(old_widget) not in old_matched_ids:
+                self.pair_subtrees(old_widget, self.new_widgets[j])
+
+    def match_in_order(self, old_candidates, new_candidates, key_funcs):
+        """
+        Pair still unmatched widgets with equal keys, k-th occurrence with k-th occurrence (None keys never match)
+        """
+        # the matched sets are read directly: this loop runs for every sibling list that did not line up
+        old_matched_ids = self.old_matched_ids
+        new_matched_ids = self.new_matched_ids
+        old_unmatched = [(position, w) for position, w in enumerate(old_candidates) if id(w) not in old_matched_ids]
+        new_unmatched = [(position, w) for position, w in enumerate(new_candidates) if id(w) not in new_matched_ids]
+
+        for key_func in key_funcs:
+            if len(old_unmatched) == 0 or len(new_unmatched) == 0:
+                return
+
+            candidates = defaultdict(deque)
+            for position, w in old_unmatched:
+                key = key_func(position, w)
+                if key is not None:
+                    candidates[key].append(w)
+            if len(candidates) == 0:
+                continue
+
+            paired = False
+            for position, w in new_unmatched:
+                if id(w) in new_matched_ids: # descendant of a subtree paired in this loop
+                    continue
+                key = key_func(position, w)
+                if key is None:
+                    continue
+                queue = candidates.get(key)
+                while queue and id(queue[0]) in old_matched_ids:
+                    queue.popleft()
+                if not queue:
+                    continue
+
+                old_widget = queue.popleft()
+                if old_widget.signature == w.signature:
+                    self.pair_subtrees(old_widget, w)
+                else:
+                    self.pair(old_widget, w)
+                paired = True
+
+            if paired:
+                old_unmatched = [(position, w) for position, w in old_unmatched if id(w) not in old_matched_ids]
+                new_unmatched = [(position, w) for position, w in new_unmatched if id(w) not in new_matched_ids]
+
+    def match_siblings(self, old_children, new_children):
+        """
+        Align the children of a matched widget pair: position by position if the sibling lists still line up, by keys otherwise
+        """
+        if len(old_children) == len(new_children):
+            aligned_pairs = []
+            for old_widget, new_widget in zip(old_children, new_children):
+                old_matched = self.is_matched(old_widget, is_old=True)
+                new_matched = self.is_matched(new_widget, is_old=False)
+                if old_matched or new_matched:
+                    if not (old_matched and new_matched and self.old_partners[self.old_indices[id(old_widget)]] == self.new_indices[id(new_widget)]):
+                        break
+                elif identifier_key(old_widget) != identifier_key(new_widget) or old_widget.widget_type != new_widget.widget_type:
+                    break
+                else:
+                    aligned_pairs.append((old_widget, new_widget))
+            else:
+                for old_widget, new_widget in aligned_pairs:
+                    if old_widget.signature == new_widget.signature:
+                        self.pair_subtrees(old_widget, new_widget)
+                    else:
+                        self.pair(old_widget, new_widget)
+                return
+
+        self.match_in_order(old_children, new_children, SIBLING_KEY_FUNCS)
+
+    def match_children(self):
+        """
+        Align the children of matched widgets, top-down
+        """
+        self.match_siblings(self.old_root_widgets, self.new_root_widgets)
+        for j in reversed(range(len(self.new_widgets))):
+            i = self.new_partners[j]
+            new_widget = self.new_widgets[j]
+            if i is not None and len(new_widget.children) > 0 and id(new_widget) not in self.new_subtree_matched_ids:
+                self.match_siblings(self.old_widgets[i].children, new_widget.children)
+
+    def is_complete(self):
+        # no widget left to pair on one of the sides
+        return len(self.old_matched_ids) == len(self.old_widgets) or len(self.new_matched_ids) == len(self.new_widgets)
+
+    def match(self):
+        self.match_unique_subtrees()
+        if not self.is_complete():
+            self.match_children()
+        if not self.is_complete():
+            # widgets moved across containers (top-down: widgets are listed in post-order, ancestors are paired before their descendants)
+            self.match_in_order(self.old_widgets[::-1], self.new_widgets[::-1], GLOBAL_KEY_FUNCS)
+
+        return self.old_partners, self.new_partners
+
+
+def longest_increasing_subsequence(values):
+    """
+    :param values: list of (position, value) with distinct values
+    :return: set of positions of a longest strictly increasing subsequence of the values (O(n log n))
+    """
+    if all(values[k][1] < values[k + 1][1] for k in range(len(values) - 1)):
+        # nothing moved (the common case)
+        return set(position for position, _ in values)
+
+    tails = [] # smallest tail value of an increasing subsequence of each length
+    tail_positions = []
+    predecessors = {}
+    for position, value in values:
+        length = bisect_left(tails, value)
+        if length == len(tails):
+            tails.append(value)
+            tail_positions.append(position)
+        else:
+            tails[length] = value
+            tail_positions[length] = position
+        predecessors[position] = tail_positions[length - 1] if length > 0 else None
+
+    lis_positions = set()
+    position = tail_positions[-1] if len(tail_positions) > 0 else None
+    while position is not None:
+        lis_positions.add(position)
+        position = predecessors[position]
+
+    return lis_positions
+
+
+def compute_state_diff(old_state, new_state):
+    """
+    Signature-keyed diff of two GUI states
+    Widgets are matched in phases, each pairing the widgets left unmatched by the previous one:
+    1. subtrees whose signature is unique in both states
+    2. top-down, the children of matched widgets by signature, own properties (e.g., a container whose children changed),
+       resource ID/content description (e.g., a label whose text changed), and finally position
+    3. globally, the remaining widgets by signature, own properties, and resource ID/content description
+    Identical subtrees that break the relative order of the other matched widgets (outside the longest increasing subsequence)
+    are reported as moved. Every phase is linear in the number of widgets, the order check is O(n log n).
+    """
+    old_partners, new_partners = WidgetMatcher(old_state, new_state).match()
+
+    matched = [(j, i) for j, i in enumerate(new_partners) if i is not None]
+    stable_positions = longest_increasing_subsequence(matched)
+    stable = [j in stable_positions for j in range(len(new_partners))]
+
+    # a moved widget is only reported for identical subtrees; other out-of-order pairs are unrelated widgets
+    for j, i in matched:
+        if not stable[j] and old_state.widgets[i].signature != new_state.widgets[j].signature:
+            old_partners[i] = None
+            new_partners[j] = None
+
+    return StateDiff(old_state, new_state, old_partners, new_partners, stable)
@@ -1,3 +1,10 @@
+import re
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 def add_period(text):
     if text.endswith('.'):
@@ -11,6 +18,87 @@ def remove_quotes(text):
     text = text.replace('\\', '')
     return text
 
+SPECIAL_CHARACTERS = re.compile(r'["\'\\\x00-\x1f]')
+
+def unquote_string(text):
+    """
+    Same as remove_quotes(json.dumps(text)) for a single string
+    """
+    if SPECIAL_CHARACTERS.search(text) is None:
+        return text # fast path: nothing to escape or remove
+    return remove_quotes(json.dumps(text, ensure_ascii=False))
+
+def unquote_scalar(value):
+    if isinstance(value, str):
+        return unquote_string(value)
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, float):
+        return json.dumps(value)
+    return str(value)
+
+def __dump_unquoted(obj, parts, newline, indent_unit):
+    if isinstance(obj, (dict, list, tuple)):
+        if len(obj) == 0:
+            parts.append('{}' if isinstance(obj, dict) else '[]')
+            return
+        opening, closing = ('{', '}') if isinstance(obj, dict) else ('[', ']')
+        if newline is None: # single line
+            inner_newline, separator = None, ', '
+            parts.append(opening)
+        else:
+            inner_newline = newline + indent_unit
+            separator = ',' + inner_newline
+            parts.append(opening + inner_newline)
+
+        if isinstance(obj, dict):
+            for i, (key, value) in enumerate(obj.items()):
+                if i > 0:
+                    parts.append(separator)
+                parts.append(unquote_scalar(key) + ': ')
+                __dump_unquoted(value, parts, inner_newline, indent_unit)
+        else:
+            for i, value in enumerate(obj):
+                if i > 0:
+                    parts.append(separator)
+                __dump_unquoted(value, parts, inner_newline, indent_unit)
+
+        parts.append(closing if newline is None else newline + closing)
+    else:
+        parts.append(unquote_scalar(obj))
+
+def dumps_unquoted(obj, indent=None):
+    """
+    Single-pass equivalent of remove_quotes(json.dumps(obj, indent=indent, ensure_ascii=False)):
+    strings are emitted without quotes (newlines as [NEWLINE]) as the structure is walked, without building the quoted JSON first
+    :param indent: int, number of spaces per nesting level, None for a single line
+    """
+    parts = []
+    if indent is None:
+        __dump_unquoted(obj, parts, None, None)
+    else:
+        __dump_unquoted(obj, parts, '\n', ' ' * indent)
+    return ''.join(parts)
+
+def dumps_json(obj, indent=2):
+    """
+    Serialize a JSON artifact; uses orjson when it is installed (much faster on large experiment logs)
+    :param indent: int, 2 or None with orjson (other values fall back to the standard json module)
+    :return: bytes, UTF-8 encoded JSON
+    """
+    if orjson is not None and indent in (2, None):
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent == 2 else 0)
+        try:
+            return orjson.dumps(obj, option=option)
+        except TypeError: # e.g., integers beyond 64 bits
+            pass
+
+    return json.dumps(obj, indent=indent).encode('utf-8')
+
 def remove_period(text):
     if text.endswith('.'):
         return text[:-1]
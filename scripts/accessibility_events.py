@@ -0,0 +1,71 @@
+import time
+import atexit
+import threading
+import subprocess
+from collections import deque
+
+MAX_BUFFERED_EVENTS = 2000
+RESTART_DELAY = 1 # seconds before restarting the listener after `uiautomator events` exited (e.g., adb disconnection)
+
+
+class AccessibilityEventListener:
+    """
+    One long-lived `uiautomator events` process per device, read by a background thread
+    Event lines are kept in a bounded, timestamped ring buffer that can be queried by time window,
+    so no event is missed between actions and no process is spawned per action.
+    The process is restarted automatically whenever it exits.
+    """
+    def __init__(self, adb_cmd_prefix, max_buffered_events=MAX_BUFFERED_EVENTS):
+        self.args = list(adb_cmd_prefix) + ['shell', 'uiautomator', 'events']
+        self.events = deque(maxlen=max_buffered_events) # (timestamp, line)
+        self.lock = threading.Lock()
+        self.process = None
+        self.thread = None
+        self.running = False
+        self.restart_count = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='accessibility-event-listener', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.running = False
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=RESTART_DELAY)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def run(self):
+        while self.running:
+            try:
+                self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, errors='replace')
+                for line in self.process.stdout:
+                    with self.lock:
+                        self.events.append((time.time(), line.rstrip('\n')))
+                self.process.wait()
+            except OSError as e:
+                print(f'Failed to start the accessibility event listener: {e}')
+
+            if self.running:
+                self.restart_count += 1
+                time.sleep(RESTART_DELAY)
+
+    def get_events(self, since, until=None):
+        """
+        :param since: float, start of the time window (time.time())
+        :param until: float, end of the time window (now if None)
+        :return: list of str, event lines received in the time window, in order
+        """
+        with self.lock:
+            return [line for timestamp, line in self.events if timestamp >= since and (until is None or timestamp <= until)]
+
+    def get_event_log(self, since, until=None):
+        # same format as the output of `uiautomator events` (see DeviceManager.parse_event_log)
+        return '\n'.join(self.get_events(since, until))
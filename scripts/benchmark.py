@@ -0,0 +1,138 @@
+import gc
+import time
+import json
+import difflib
+import argparse
+import statistics
+import tracemalloc
+
+from droidagent.gui_state import GUIState
+from droidagent.state_diff import compute_state_diff
+from droidagent.screen_renderer import SCREEN_INDENT, estimate_tokens, collapse_repeated_siblings
+from droidagent.utils import remove_quotes, dumps_unquoted
+
+from recorded_states import load_recorded_states
+
+
+def measure(func, repeat, setup=None):
+    """
+    :param setup: function returning the arguments of `func`, called (untimed) before each repetition
+    """
+    elapsed_times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start_time = time.perf_counter()
+        func(*args)
+        elapsed_times.append(time.perf_counter() - start_time)
+    return statistics.median(elapsed_times)
+
+
+def report(name, elapsed_times):
+    print(f'{name}: mean {statistics.mean(elapsed_times) * 1000:.2f} ms, median {statistics.median(elapsed_times) * 1000:.2f} ms, max {max(elapsed_times) * 1000:.2f} ms (n={len(elapsed_times)})')
+
+
+def benchmark_gui_state(states, repeat):
+    """
+    Per-state processing time: view tree minimization + widget construction + rendering
+    """
+    construct_times = []
+    render_times = []
+    for state in states:
+        construct_times.append(measure(lambda: GUIState().from_droidbot_state(state), repeat))
+        gui_state = GUIState().from_droidbot_state(state)
+        render_times.append(measure(lambda: [widget.to_dict() for widget in gui_state.root_widgets], repeat))
+
+    report('GUIState construction', construct_times)
+    report('Widget rendering', render_times)
+
+
+def benchmark_memory(states, repeat):
+    """
+    Resident size of retained GUI states (as kept alive by the working memory and the GUI state cache)
+    """
+    retained_sizes = []
+    for state in states:
+        gc.collect()
+        tracemalloc.start()
+        retained_gui_state = GUIState().from_droidbot_state(state, use_cache=False)
+        retained_gui_state.signature # computed for every state during a run
+        gc.collect()
+        retained_size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        retained_sizes.append(retained_size)
+        del retained_gui_state
+
+    print(f'Retained size per GUI state: mean {statistics.mean(retained_sizes) / 1024:.1f} KiB, max {max(retained_sizes) / 1024:.1f} KiB (n={len(retained_sizes)})')
+
+
+def benchmark_diff(states, repeat):
+    """
+    State change description of consecutive states: line-based difflib vs. signature-keyed tree diff
+    Both run on freshly parsed GUI states, so memoized descriptions and signatures are not reused across repetitions
+    """
+    def difflib_diff(old_state, new_state):
+        return list(difflib.unified_diff(old_state.describe_widgets_NL().splitlines(), new_state.describe_widgets_NL().splitlines(), lineterm=''))
+
+    def tree_diff(old_state, new_state):
+        return compute_state_diff(old_state, new_state).render()
+
+    difflib_times = []
+    tree_diff_times = []
+    for old_state, new_state in zip(states, states[1:]):
+        parse_states = lambda: (GUIState().from_droidbot_state(old_state, use_cache=False), GUIState().from_droidbot_state(new_state, use_cache=False))
+        difflib_times.append(measure(difflib_diff, repeat, setup=parse_states))
+        tree_diff_times.append(measure(tree_diff, repeat, setup=parse_states))
+
+    report('difflib (widget descriptions + unified diff)', difflib_times)
+    report('Tree diff (typed edits + rendering)', tree_diff_times)
+
+
+def benchmark_render(states, repeat):
+    """
+    Serialization of screen descriptions: json.dumps(indent=2) + remove_quotes vs. single-pass unquoted serializer
+    """
+    view_hierarchies = []
+    for state in states:
+        gui_state = GUIState().from_droidbot_state(state, use_cache=False)
+        view_hierarchies.append(collapse_repeated_siblings({
+            'page_name': gui_state.activity,
+            'children': [widget.to_dict() for widget in gui_state.root_widgets],
+        }))
+
+    json_times = []
+    unquoted_times = []
+    json_tokens = []
+    unquoted_tokens = []
+    for view_hierarchy in view_hierarchies:
+        json_times.append(measure(lambda: remove_quotes(json.dumps(view_hierarchy, indent=2, ensure_ascii=False)), repeat))
+        unquoted_times.append(measure(lambda: dumps_unquoted(view_hierarchy, indent=SCREEN_INDENT), repeat))
+        json_tokens.append(estimate_tokens(remove_quotes(json.dumps(view_hierarchy, indent=2, ensure_ascii=False))))
+        unquoted_tokens.append(estimate_tokens(dumps_unquoted(view_hierarchy, indent=SCREEN_INDENT)))
+
+    report('json.dumps(indent=2) + remove_quotes', json_times)
+    report(f'Single-pass unquoted serializer (indent={SCREEN_INDENT})', unquoted_times)
+    print(f'Estimated tokens per screen: {statistics.mean(json_tokens):.0f} -> {statistics.mean(unquoted_tokens):.0f} (mean)')
+
+
+BENCHMARKS = {
+    'gui_state': benchmark_gui_state,
+    'memory': benchmark_memory,
+    'diff': benchmark_diff,
+    'render': benchmark_render,
+}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark GUI state processing on recorded view trees')
+    parser.add_argument('benchmark', choices=list(BENCHMARKS.keys()), help='name of the benchmark to run')
+    parser.add_argument('--result_dir', type=str, required=True, help='output directory of a previous run (containing `states/`)')
+    parser.add_argument('--num_states', type=int, default=100, help='maximum number of recorded states to use')
+    parser.add_argument('--repeat', type=int, default=5, help='number of repetitions per state')
+    args = parser.parse_args()
+
+    states = load_recorded_states(args.result_dir, limit=args.num_states)
+    if len(states) == 0:
+        raise FileNotFoundError(f'No recorded states in {args.result_dir}/states')
+
+    print(f'Loaded {len(states)} recorded states from {args.result_dir}')
+    BENCHMARKS[args.benchmark](states, args.repeat)
@@ -1,21 +1,27 @@
 from droidbot.utg import UTG
+from droidbot.device_state import DeviceState
 from droidbot.input_event import IntentEvent, KeyEvent
 
 from utg import copy_utg_rendering_resources
+from accessibility_events import AccessibilityEventListener
+from droidagent.pipeline import BackgroundPipeline
+from droidagent.artifact_writer import artifact_writer
+from droidagent.image_store import ImageStore, IMAGE_DIR, KIND_SCREEN, KIND_VIEW
+from droidagent.utils import GUIStateManager
 
 import time
-import json
 from datetime import datetime
 import os
-import subprocess
 import re
 
-POST_EVENT_WAIT = 1
-MAX_NUM_STEPS_OUTSIDE = 5
-MAX_BACKTRACK = 10
-MAX_RESTART = 5
-
-num_steps_outside = 0
+POST_EVENT_WAIT = 1 # fixed wait for explicit "wait" actions (and the reference for the time saved by settle detection)
+SETTLE_POLL_INTERVAL = 0.2
+SETTLE_STABLE_WINDOW = 0.4
+SETTLE_TIMEOUT = 5
+STATE_TIERS = ['probe', 'hierarchy', 'full']
+VOLATILE_TEXT_PATTERN = re.compile(r'\d+')
+FULL_STATE_QUERY_COUNT = 5 # get_current_state: views, top activity, activity stack, background services, screenshot
+UI_PROBE_COMMAND = 'dumpsys activity top; dumpsys window windows | grep mCurrentFocus'
 
 class ExternalAction:
     def __init__(self, description, events):
@@ -29,18 +35,182 @@ class ExternalAction:
         return self.description
 
 
+def parse_ui_probe(probe_output):
+    """
+    :param probe_output: str, output of `dumpsys activity top` (one block per resumed activity, the last one is on top),
+        followed by the focused window line of `dumpsys window`
+    :return: (str, int), the top activity and a fingerprint of its view hierarchy and of the focused window
+    The view lines only have the classes, flags, bounds and IDs of the views of the activity window: dialogs, popups and the keyboard
+    are other windows, only seen through the focused window (and texts are not seen at all, see `get_views_fingerprint`).
+    """
+    foreground_activity = None
+    focused_window = None
+    hierarchy_lines = []
+    hierarchy_indent = None
+    for line in probe_output.splitlines():
+        content = line.strip()
+        indent = len(line) - len(line.lstrip())
+        if hierarchy_indent is not None and indent > hierarchy_indent and len(content) > 0:
+            hierarchy_lines.append(content)
+            continue
+        hierarchy_indent = None
+        if content.startswith('ACTIVITY '):
+            foreground_activity = content.split()[1]
+            hierarchy_lines = []
+        elif content == 'View Hierarchy:':
+            hierarchy_indent = indent
+        elif content.startswith('mCurrentFocus='):
+            focused_window = content.split('=', 1)[1]
+    return foreground_activity, hash((focused_window, tuple(hierarchy_lines)))
+
+
+def probe_ui(device):
+    """
+    Probe tier of the UI: the top activity and a fingerprint of its view hierarchy and focused window in a single round trip
+    (instead of the top activity + the view list from the accessibility service)
+    """
+    return parse_ui_probe(device.adb.shell(UI_PROBE_COMMAND) or '')
+
+
+def mask_volatile_text(text):
+    # clocks, timers and progress counters keep changing on a settled screen: only the non-numeric part of a text is compared
+    if text is None:
+        return None
+    return VOLATILE_TEXT_PATTERN.sub('#', text)
+
+
+def get_views_fingerprint(views):
+    """
+    Fingerprint of the view list from the accessibility service: unlike the UI probe, it has the texts and the content of
+    the focused window (dialogs) and of Compose views (digits in texts are masked)
+    """
+    return hash(tuple((view.get('class'), view.get('resource_id'), mask_volatile_text(view.get('text')), str(view.get('bounds'))) for view in views))
+
+
+def get_activity_depth(activity_stack, package_name):
+    # same as DeviceState.get_app_activity_depth
+    for depth, activity_str in enumerate(activity_stack or []):
+        if package_name in activity_str:
+            return depth
+    return -1
+
+
+class UISettleDetector:
+    """
+    Wait until the UI is settled after an event: the UI probe (one device query) is polled at short intervals
+    until it has not changed for `stable_window` seconds, then the view list is polled until it is the same twice in a row
+    (or `timeout` seconds have passed). The last view list is reused by the next state fetch.
+    """
+    def __init__(self, device, poll_interval=SETTLE_POLL_INTERVAL, stable_window=SETTLE_STABLE_WINDOW, timeout=SETTLE_TIMEOUT, clock=time.monotonic, sleep=time.sleep):
+        self.device = device
+        self.poll_interval = poll_interval
+        self.stable_window = stable_window
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+
+        self.wait_count = 0
+        self.timeout_count = 0
+        self.total_wait_time = 0
+        self.poll_count = 0 # one device query each (UI probes and view lists)
+        self.settled_ui = None # (top activity, view list) of the last polls if the UI settled, until taken by the next state fetch
+
+    def poll(self):
+        """
+        :return: (str, int), the top activity and the fingerprint of its view hierarchy
+        """
+        self.poll_count += 1
+        return probe_ui(self.device)
+
+    def poll_views(self):
+        self.poll_count += 1
+        return self.device.get_views() or []
+
+    def wait(self, initial_probe=None):
+        """
+        :param initial_probe: (str, int), a poll made right after the event (e.g., when reading the intermediate screen)
+        :return: float, the time waited in seconds
+        """
+        start_time = self.clock()
+        last_probe = initial_probe if initial_probe is not None else self.poll()
+        stable_since = self.clock()
+        last_views_fingerprint = None
+        self.settled_ui = None
+
+        while True:
+            if self.clock() - stable_since >= self.stable_window:
+                # the probe does not see texts nor the content of Compose views: confirmed with the view list
+                views = self.poll_views()
+                views_fingerprint = get_views_fingerprint(views)
+                if views_fingerprint == last_views_fingerprint:
+                    self.settled_ui = (last_probe[0], views)
+                    break
+                last_views_fingerprint = views_fingerprint
+
+            if self.clock() - start_time >= self.timeout:
+                self.timeout_count += 1
+                break
+
+            self.sleep(self.poll_interval)
+            if last_views_fingerprint is None:
+                probe = self.poll()
+                if probe != last_probe:
+                    last_probe = probe
+                    stable_since = self.clock()
+
+        wait_time = self.clock() - start_time
+        self.wait_count += 1
+        self.total_wait_time += wait_time
+        return wait_time
+
+    def take_settled_ui(self):
+        """
+        :return: (str, list of dict), the top activity and the view list of the settled UI (None, None if it did not settle)
+        """
+        settled_ui, self.settled_ui = self.settled_ui, None
+        return settled_ui if settled_ui is not None else (None, None)
+
+    @property
+    def time_saved(self):
+        # compared to the fixed POST_EVENT_WAIT sleep after every event (negative if the UI was slower to settle)
+        return self.wait_count * POST_EVENT_WAIT - self.total_wait_time
+
+    def describe_stats(self):
+        if self.wait_count == 0:
+            return 'UI settle detection: no events yet'
+        return f'UI settle detection: {self.wait_count} events, mean wait {self.total_wait_time / self.wait_count:.2f}s, {self.timeout_count} timeouts, {self.time_saved / self.wait_count:.2f}s saved per event ({self.time_saved:.1f}s in total)'
+
+
 class DeviceManager:
     """
     - Send to the GUI event to the device
     - Update UTG
     """
-    def __init__(self, device, app, output_dir):
+    def __init__(self, device, app, output_dir, pipeline=None, navigation_index=None, image_store=None, event_listener=None):
+        """
+        :param pipeline: BackgroundPipeline, shared with the agent (a dedicated one is created if not given)
+        :param navigation_index: NavigationIndex, filled with the transitions added to the UTG (the agent's `memory.navigation`)
+        :param image_store: ImageStore, deduplicated storage of the screenshots and view crops (exact duplicates only if not given)
+        :param event_listener: source of the accessibility event log (an AccessibilityEventListener on the device if not given)
+        """
         self.device = device
         self.app = app
         self.last_event = None
         self.pre_event_state = None
-        self.current_state = device.get_current_state() # might be loading state (need to be updated)
-
+        self.fetch_counts = {tier: 0 for tier in STATE_TIERS} # number of state acquisitions per tier
+        self.query_count = 0 # device round trips for state acquisition (the polls of the settle detector are counted by the detector)
+        self.reused_query_count = 0 # round trips saved by reusing the top activity and view list polled by the settle detector
+        self.event_count = 0
+        self.is_partial_state = False
+        self.settle_detector = UISettleDetector(device)
+        self.fetch_device_state() # might be loading state (need to be updated)
+        self.event_listener = event_listener if event_listener is not None else AccessibilityEventListener(device.adb.cmd_prefix)
+        self.event_listener.start()
+        self.pipeline = pipeline if pipeline is not None else BackgroundPipeline()
+        self.navigation_index = navigation_index
+
+        self.image_store = image_store if image_store is not None else ImageStore(os.path.join(output_dir, IMAGE_DIR))
+        self.states_dir = os.path.join(output_dir, 'states') # screenshots written by DroidBot when a state is added to the UTG
         self.views_dir = os.path.join(output_dir, 'views')
         self.events_dir = os.path.join(output_dir, 'events')
         os.makedirs(self.views_dir, exist_ok=True)
@@ -50,10 +220,135 @@ class DeviceManager:
         self.utg = UTG(device, app, random_input=False)
         copy_utg_rendering_resources(output_dir)
 
-    def fetch_device_state(self):
-        self.current_state = self.device.get_current_state()
+    def record_event(self, event, pre_event_state, post_event_state, view_dicts, event_dict):
+        # runs on the background pipeline (in the order of the events)
+        for view_dict in view_dicts:
+            view_image_path = os.path.join(self.views_dir, f'view_{view_dict["view_str"]}.png')
+            if not self.image_store.is_stored(view_image_path): # same view_str, same crop
+                pre_event_state.save_view_img(view_dict=view_dict, output_dir=self.views_dir)
+            self.image_store.add(view_image_path, KIND_VIEW, tag=event_dict['tag'], view_str=view_dict['view_str'])
 
-    def get_app_activity_depth(self):
+        if event is not None:
+            self.utg.add_transition(event, pre_event_state, post_event_state)
+            for state in [pre_event_state, post_event_state]:
+                screenshot_path = os.path.join(self.states_dir, f'screen_{state.tag}.png')
+                if state.screenshot_path != screenshot_path:
+                    continue # not a new UTG node: DroidBot has not written its screenshot (or it is already stored)
+                # the screenshot is moved into the image store: the view crops and the UTG node of the state use the blob from now on
+                blob_path = self.image_store.add(screenshot_path, KIND_SCREEN, tag=state.tag, state_str=state.state_str)
+                if blob_path is not None:
+                    state.screenshot_path = blob_path
+
+        artifact_writer.write_json(event_dict, os.path.join(self.events_dir, f'event_{event_dict["tag"]}.json'), compressible=True)
+
+    def index_transition(self, event, event_str, source_state, target_state):
+        # on the main thread (unlike the UTG update), so that the route is known from the next step on
+        if self.navigation_index is None or isinstance(event, IntentEvent):
+            return # app restarts are not replayed as navigation hops
+        if source_state.get_app_activity_depth(self.app) != 0 or target_state.get_app_activity_depth(self.app) != 0:
+            return # routes only go through the pages of the app
+        self.navigation_index.add_transition(event, event_str, source_state.state_str, GUIStateManager.fix_activity_name(source_state.foreground_activity),
+                                             target_state.state_str, GUIStateManager.fix_activity_name(target_state.foreground_activity))
+
+    def probe_foreground(self):
+        """
+        Cheapest tier: the foreground activity only (e.g., is the app still on the screen?)
+        :return: str, the top activity name
+        """
+        self.fetch_counts['probe'] += 1
+        self.query_count += 1
+        return self.device.get_top_activity_name()
+
+    def probe_activity_stack(self):
+        self.fetch_counts['probe'] += 1
+        self.query_count += 1
+        return self.device.get_current_activity_stack()
+
+    def fetch_views(self, foreground_activity=None, views=None):
+        """
+        :param foreground_activity: str, the top activity if already known from a UI probe
+        :param views: list of dict, the view list if already polled by the settle detector
+        :return: (str, list of dict), the foreground activity and the view list
+        """
+        if foreground_activity is None:
+            self.query_count += 1
+            foreground_activity = self.device.get_top_activity_name()
+        else:
+            self.reused_query_count += 1
+        if views is None:
+            self.query_count += 1
+            views = self.device.get_views() or []
+        else:
+            self.reused_query_count += 1
+        return foreground_activity, views
+
+    def fetch_hierarchy(self, foreground_activity=None, with_activity_stack=True, views=None):
+        """
+        Hierarchy tier: the view hierarchy (and activity stack) without screenshot and background services
+        Enough to read the screen (loading check, temporary messages), but not to be added to the UTG.
+        :param foreground_activity: str, the top activity if already known from a UI probe
+        :param with_activity_stack: bool, whether to query the activity stack (not needed to only read the widgets)
+        :param views: list of dict, the view list if already polled by the settle detector
+        :return: DeviceState
+        """
+        self.fetch_counts['hierarchy'] += 1
+        foreground_activity, views = self.fetch_views(foreground_activity, views)
+        activity_stack = []
+        if with_activity_stack:
+            self.query_count += 1
+            activity_stack = self.device.get_current_activity_stack()
+        return DeviceState(self.device, views=views, foreground_activity=foreground_activity, activity_stack=activity_stack, background_services=[])
+
+    def fetch_device_state(self, tier='full'):
+        """
+        Update the current state (the top activity and view list polled by the settle detector right before are reused)
+        :param tier: str, 'full' (with screenshot) or 'hierarchy' (e.g., while waiting for a loading screen)
+        """
+        settled_activity, settled_views = self.settle_detector.take_settled_ui()
+        if tier == 'hierarchy':
+            self.current_state = self.fetch_hierarchy(settled_activity, views=settled_views)
+            self.is_partial_state = True
+            return
+
+        self.fetch_counts['full'] += 1
+        if settled_activity is None:
+            self.query_count += FULL_STATE_QUERY_COUNT
+            self.current_state = self.device.get_current_state()
+        else:
+            foreground_activity, views = self.fetch_views(settled_activity, settled_views)
+            self.query_count += FULL_STATE_QUERY_COUNT - 2
+            self.current_state = DeviceState(self.device, views=views, foreground_activity=foreground_activity, activity_stack=self.device.get_current_activity_stack(),
+                                             background_services=self.device.get_service_names(), screenshot_path=self.device.take_screenshot())
+        self.is_partial_state = False
+
+    def ensure_full_state(self):
+        # a state without screenshot is completed before being shown to the agent or added to the UTG
+        if self.is_partial_state:
+            self.fetch_device_state()
+
+    def describe_stats(self):
+        query_count = self.query_count + self.settle_detector.poll_count
+        fetch_stats = ', '.join(f'{count} {tier}' for tier, count in self.fetch_counts.items())
+        if self.event_count == 0:
+            return f'Device state acquisition: {fetch_stats}, {query_count} device queries'
+        return f'Device state acquisition: {fetch_stats}, {query_count} device queries ({query_count / self.event_count:.1f} per event, {self.reused_query_count} saved by reusing the polled activities and views)'
+
+    def close(self):
+        self.event_listener.stop()
+        self.pipeline.barrier()
+        # DroidBot only writes utg.js when adding a transition: rewrite it so that the states of the last one also point to their moved screenshots
+        self.utg._UTG__output_utg()
+        artifact_writer.flush()
+
+    def wait_until_settled(self):
+        return self.settle_detector.wait()
+
+    def get_app_activity_depth(self, probe=False):
+        """
+        :param probe: bool, query the activity stack of the device instead of using the current state
+        """
+        if probe:
+            return get_activity_depth(self.probe_activity_stack(), self.app.get_package_name())
         return self.current_state.get_app_activity_depth(self.app)
 
     def add_new_utg_edge(self):
@@ -61,7 +356,8 @@ class DeviceManager:
             return
         if self.pre_event_state is None:
             return
-        self.utg.add_transition(self.last_event, self.pre_event_state, self.current_state)
+        self.pipeline.submit(self.utg.add_transition, self.last_event, self.pre_event_state, self.current_state)
+        self.index_transition(self.last_event, self.last_event.get_event_str(self.pre_event_state), self.pre_event_state, self.current_state)
 
     @staticmethod
     def parse_event_log(output):
@@ -86,42 +382,42 @@ class DeviceManager:
         if capture_intermediate_state:
             assert agent is not None, 'Agent should be provided when capture_intermediate_state is True'
 
-        args = [] + self.device.adb.cmd_prefix + ['shell', 'uiautomator', 'events']
-        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        event_start_time = time.time()
 
         if event is None:   # "wait" event
             capture_intermediate_state = False
         else:
+            self.ensure_full_state()
             self.device.send_event(event)
+            self.event_count += 1
 
             self.last_event = event
             self.pre_event_state = self.current_state
 
+        initial_probe = None
         if capture_intermediate_state:
-            agent.capture_temporary_message(self.device.get_current_state())
-
-        process.terminate()
-        stdout, stderr = process.communicate()
+            # the screen right after the event (e.g., snackbars): its probe is also the first poll of the settle detector
+            initial_probe = self.settle_detector.poll()
+            agent.capture_temporary_message(self.fetch_hierarchy(initial_probe[0], with_activity_stack=False))
 
-        time.sleep(POST_EVENT_WAIT)
+        if event is None:
+            time.sleep(POST_EVENT_WAIT)
+            settle_time = POST_EVENT_WAIT
+        else:
+            settle_time = self.settle_detector.wait(initial_probe=initial_probe)
 
         if capture_intermediate_state:
-            toast_messages = self.parse_event_log(stdout.decode('utf-8'))
+            toast_messages = self.parse_event_log(self.event_listener.get_event_log(since=event_start_time))
             agent.capture_toast_message(toast_messages)
         
         self.fetch_device_state()
         
+        view_dicts = []
         view_image_dir = None
-
-        if event is not None:
-            views = event.get_views()
-            if views:
-                for view_dict in views:
-                    if self.pre_event_state is not None:
-                        self.pre_event_state.save_view_img(view_dict=view_dict, output_dir=self.views_dir)
-                        view_image_dir = view_file_path = "%s/view_%s.png" % (self.views_dir, view_dict['view_str'])
-        
-            self.utg.add_transition(event, self.pre_event_state, self.current_state)
+        if event is not None and self.pre_event_state is not None:
+            view_dicts = event.get_views() or []
+            for view_dict in view_dicts:
+                view_image_dir = "%s/view_%s.png" % (self.views_dir, view_dict['view_str'])
 
         timestamp = datetime.now().strftime("%Y-%m-%d_%H%M%S")
         event_dict = {
@@ -131,121 +427,13 @@ class DeviceManager:
             'stop_state': self.current_state.state_str if self.current_state is not None else None,
             'event_str': event.get_event_str(self.pre_event_state) if event is not None else "wait",
             'task': agent.memory.task if agent is not None else None,
-            'view_image_dir': view_image_dir
+            'view_image_dir': view_image_dir,
+            'settle_time': round(settle_time, 3)
         }
-        with open(os.path.join(self.events_dir, f'event_{timestamp}.json'), 'w') as f:
-            json.dump(event_dict, f, indent=2)
 
-        return event_dict
-        
-
-def recover_activity_stack(device_manager, agent, events=[]):
-    global num_steps_outside
-
-    if device_manager.get_app_activity_depth() == 0:
-        num_steps_outside = 0
-        return
-    
-    # App is not in the activity stack (e.g., mistakenly closed the app)
-    if device_manager.get_app_activity_depth() < 0 or 'leakcanary.internal.activity' in device_manager.current_state.foreground_activity: 
-        start_app_intent = device_manager.app.get_start_intent()
-        reopen_event = IntentEvent(intent=start_app_intent)
-
-        event_dict = device_manager.send_event_to_device(reopen_event)
-        events.append(event_dict)
-
-        if device_manager.get_app_activity_depth() == 0:
-            agent.memory.append_to_working_memory(ExternalAction(f'Open the app again because the previous action led to closing the app', events), 'ACTION')
-            agent.clear_temporary_message()
-            num_steps_outside = 0
-            return
+        # view crops, UTG update and event record do not affect the next step: done in the background while the next LLM call is in flight
+        self.pipeline.submit(self.record_event, event, self.pre_event_state, self.current_state, view_dicts, dict(event_dict))
+        if event is not None and self.pre_event_state is not None:
+            self.index_transition(event, event_dict['event_str'], self.pre_event_state, self.current_state)
 
-    # App is not in the foreground (e.g., file manager app, permission setting screen)
-    elif device_manager.get_app_activity_depth() > 0:
-        num_steps_outside += 1
-        if num_steps_outside <= MAX_NUM_STEPS_OUTSIDE:
-            agent.clear_temporary_message()
-            return 
-
-        back_button_times = 0
-        for _ in range(MAX_BACKTRACK):
-            if device_manager.get_app_activity_depth() == 0:
-                break
-            
-            go_back_event = KeyEvent(name='BACK')
-            event_dict = device_manager.send_event_to_device(go_back_event)
-            events.append(event_dict)
-
-            back_button_times += 1
-
-        if device_manager.get_app_activity_depth() == 0:
-            if back_button_times > 1:
-                agent.memory.append_to_working_memory(ExternalAction(f'Press the back button {back_button_times} times because you stayed on the pages not belonging to the target app for too long', events), 'ACTION')
-            else:
-                agent.memory.append_to_working_memory(ExternalAction(f'Press the back button because you stayed on the pages not belonging to the target app for too long', events), 'ACTION')
-            
-            agent.clear_temporary_message()
-            num_steps_outside = 0
-            return
-
-    # Try reopen
-    start_app_intent = device_manager.app.get_start_intent()
-    reopen_event = IntentEvent(intent=start_app_intent)
-    event_dict = device_manager.send_event_to_device(reopen_event)
-    events.append(event_dict)
-
-    if device_manager.get_app_activity_depth() == 0:
-        agent.memory.append_to_working_memory(ExternalAction(f'Open the app again because you stayed on the pages not belonging to the target app for too long', events), 'ACTION')
-        agent.clear_temporary_message()
-        num_steps_outside = 0
-        return
-
-    
-    # Try backtrack and reopen
-    back_button_times = 0
-    for _ in range(MAX_BACKTRACK):
-        if device_manager.get_app_activity_depth() == 0:
-            break
-        
-        go_back_event = KeyEvent(name='BACK')
-        event_dict = device_manager.send_event_to_device(go_back_event)
-        events.append(event_dict)
-
-        back_button_times += 1
-
-    start_app_intent = device_manager.app.get_start_intent()
-    reopen_event = IntentEvent(intent=start_app_intent)
-    event_dict = device_manager.send_event_to_device(reopen_event)
-    events.append(event_dict)
-
-    if device_manager.get_app_activity_depth() == 0:
-        agent.memory.append_to_working_memory(ExternalAction(f'Open the app again because you stayed on the pages not belonging to the target app for too long', events), 'ACTION')
-        agent.clear_temporary_message()
-        num_steps_outside = 0
-        return
-    
-    # If the app is still not in the foreground, restart the app
-    if device_manager.get_app_activity_depth() != 0:
-        for _ in range(MAX_RESTART):
-            if device_manager.get_app_activity_depth() == 0:
-                break
-        
-            stop_app_intent = device_manager.app.get_stop_intent()
-            stop_event = IntentEvent(intent=stop_app_intent)
-            event_dict = device_manager.send_event_to_device(stop_event)
-            events.append(event_dict)
-            
-            start_app_intent = device_manager.app.get_start_intent()
-            restart_event = IntentEvent(intent=start_app_intent)
-            event_dict = device_manager.send_event_to_device(restart_event)
-            events.append(event_dict)
-
-        if device_manager.get_app_activity_depth() == 0:
-            agent.memory.append_to_working_memory(ExternalAction(f'Restart the app because you stayed on the pages not belonging to the target app for too long', events), 'ACTION')
-            agent.clear_temporary_message()
-            num_steps_outside = 0
-            return
-
-    # Fail-safe: just infinitely try again until the app goes back to the foreground
-    recover_activity_stack(device_manager, agent, events)
-    return
\ No newline at end of file
+        return event_dict
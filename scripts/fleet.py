@@ -0,0 +1,257 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import threading
+import subprocess
+
+from droidagent.utils import dumps_json
+from droidagent.knowledge_service import start_knowledge_server, generate_authkey, AUTHKEY_ENV
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MAX_ATTEMPTS = 3 # per run, each retry on another device when possible
+MAX_DEVICE_FAILURES = 3 # consecutive failed runs before a device is retired from the pool
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+
+class FleetRun:
+    """
+    One cell of the app × persona × seed matrix
+    """
+    def __init__(self, app, profile_id, seed):
+        self.app = app
+        self.profile_id = profile_id
+        self.seed = seed
+        self.status = STATUS_PENDING
+        self.attempts = [] # dicts: device serial, output dir, return code, start/end time
+        self.failed_serials = set()
+
+    @property
+    def run_id(self):
+        return f'{self.app}-{self.profile_id}-seed{self.seed}'
+
+    def to_dict(self):
+        return {
+            'app': self.app,
+            'profile_id': self.profile_id,
+            'seed': self.seed,
+            'status': self.status,
+            'attempts': self.attempts,
+        }
+
+
+class AgentProcessLauncher:
+    """
+    Runs run_droidagent.py in a subprocess (the agent configuration is process-global, so concurrent runs need separate processes)
+    """
+    def __init__(self, is_emulator=False, run_timeout=None, extra_args=(), knowledge_service_addresses=None, knowledge_service_authkey=None):
+        """
+        :param knowledge_service_addresses: dict, app name -> address (host, port) of the knowledge service shared by the runs on the app
+        :param knowledge_service_authkey: str, authentication key of the knowledge services (passed to the agent processes in their environment)
+        """
+        self.is_emulator = is_emulator
+        self.run_timeout = run_timeout
+        self.extra_args = list(extra_args)
+        self.knowledge_service_addresses = knowledge_service_addresses or {}
+        self.knowledge_service_authkey = knowledge_service_authkey
+
+    def __call__(self, run, device_serial, output_dir):
+        """
+        :return: int, return code of the agent process
+        """
+        args = [sys.executable, os.path.join(SCRIPT_DIR, 'run_droidagent.py'), '--app', run.app, '--profile_id', run.profile_id,
+                '--seed', str(run.seed), '--device_serial', device_serial, '--output_dir', output_dir] + self.extra_args
+        if self.is_emulator:
+            args.append('--is_emulator')
+        env = dict(os.environ)
+        if run.app in self.knowledge_service_addresses:
+            host, port = self.knowledge_service_addresses[run.app]
+            args.extend(['--knowledge_service', f'{host}:{port}'])
+            env[AUTHKEY_ENV] = self.knowledge_service_authkey
+
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, 'droidagent.log'), 'w') as log_file:
+            try:
+                return subprocess.run(args, cwd=SCRIPT_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT, timeout=self.run_timeout).returncode
+            except subprocess.TimeoutExpired:
+                print(f'[{device_serial}] {run.run_id} did not finish in {self.run_timeout} seconds')
+                return -1
+
+
+class FleetOrchestrator:
+    """
+    Runs a matrix of experiments concurrently, one worker per device serial
+    - a worker leases the next pending run, preferring runs that have not failed on its device yet
+    - a failed run is retried (up to `max_attempts`) in a fresh output directory, on another device when one is available
+    - a device that fails `MAX_DEVICE_FAILURES` runs in a row is retired from the pool
+    - the state of every run and device is written to <result_root>/progress.json after each change
+    :param launcher: callable (run, device_serial, output_dir) -> return code, e.g., AgentProcessLauncher or a launcher running a fake device
+    :param knowledge_services: dict, app name -> KnowledgeService shared by the runs on the app (their statistics are added to the progress file)
+    """
+    def __init__(self, runs, device_serials, launcher, result_root, max_attempts=MAX_ATTEMPTS, knowledge_services=None):
+        self.runs = list(runs)
+        self.pending_runs = list(self.runs)
+        self.running_count = 0
+        self.device_serials = list(device_serials)
+        self.active_serials = set(device_serials)
+        self.device_leases = {serial: None for serial in device_serials} # serial -> run ID
+        self.device_failures = {serial: 0 for serial in device_serials}
+        self.launcher = launcher
+        self.result_root = result_root
+        self.max_attempts = max_attempts
+        self.knowledge_services = knowledge_services or {}
+        self.start_time = None
+        self.condition = threading.Condition()
+
+    def get_output_dir(self, run):
+        return os.path.join(self.result_root, run.app, f'agent_run_{run.profile_id}_seed{run.seed}_attempt{len(run.attempts) + 1}')
+
+    def is_eligible(self, run, device_serial):
+        return device_serial not in run.failed_serials or self.active_serials <= run.failed_serials
+
+    def lease_run(self, device_serial):
+        # called with the condition held
+        while device_serial in self.active_serials:
+            if len(self.pending_runs) == 0 and self.running_count == 0:
+                return None
+            for run in self.pending_runs:
+                if self.is_eligible(run, device_serial):
+                    self.pending_runs.remove(run)
+                    self.running_count += 1
+                    self.device_leases[device_serial] = run.run_id
+                    run.status = STATUS_RUNNING
+                    return run
+            self.condition.wait()
+        return None
+
+    def release_run(self, run, device_serial, succeeded):
+        # called with the condition held
+        self.running_count -= 1
+        self.device_leases[device_serial] = None
+        if succeeded:
+            run.status = STATUS_SUCCEEDED
+            self.device_failures[device_serial] = 0
+        else:
+            run.failed_serials.add(device_serial)
+            run.status = STATUS_FAILED if len(run.attempts) >= self.max_attempts else STATUS_PENDING
+            if run.status == STATUS_PENDING:
+                self.pending_runs.append(run)
+            self.device_failures[device_serial] += 1
+            if self.device_failures[device_serial] >= MAX_DEVICE_FAILURES:
+                print(f'[{device_serial}] {MAX_DEVICE_FAILURES} consecutive failures, retiring the device')
+                self.active_serials.discard(device_serial)
+        self.condition.notify_all()
+
+    def device_worker(self, device_serial):
+        while True:
+            with self.condition:
+                run = self.lease_run(device_serial)
+                if run is None:
+                    return
+                attempt = {'device_serial': device_serial, 'output_dir': self.get_output_dir(run), 'start_time': time.strftime('%Y-%m-%d %H:%M:%S'), 'return_code': None}
+                run.attempts.append(attempt)
+                self.write_progress()
+
+            print(f'[{device_serial}] Running {run.run_id} (attempt {len(run.attempts)})')
+            try:
+                return_code = self.launcher(run, device_serial, attempt['output_dir'])
+            except Exception as e:
+                print(f'[{device_serial}] Failed to launch {run.run_id}: {e}')
+                return_code = None
+
+            with self.condition:
+                attempt['return_code'] = return_code
+                attempt['end_time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+                self.release_run(run, device_serial, succeeded=(return_code == 0))
+                self.write_progress()
+            print(f'[{device_serial}] {run.run_id}: {run.status}')
+
+    def run(self):
+        self.start_time = time.time()
+        os.makedirs(self.result_root, exist_ok=True)
+        workers = [threading.Thread(target=self.device_worker, args=(serial,), name=f'fleet-{serial}') for serial in self.device_serials]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        with self.condition:
+            for run in self.pending_runs: # all devices retired
+                run.status = STATUS_FAILED
+            self.pending_runs = []
+            self.write_progress()
+
+        return self.runs
+
+    def get_progress(self):
+        status_counts = {status: 0 for status in [STATUS_PENDING, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_FAILED]}
+        for run in self.runs:
+            status_counts[run.status] += 1
+
+        progress = {
+            'elapsed_time': round(time.time() - self.start_time, 1),
+            'total_runs': len(self.runs),
+            'status_counts': status_counts,
+            'devices': {serial: {
+                'active': serial in self.active_serials,
+                'current_run': self.device_leases[serial],
+                'consecutive_failures': self.device_failures[serial],
+            } for serial in self.device_serials},
+            'runs': {run.run_id: run.to_dict() for run in self.runs},
+        }
+        if len(self.knowledge_services) > 0:
+            progress['shared_knowledge'] = {app: service.get_stats() for app, service in self.knowledge_services.items()}
+        return progress
+
+    def write_progress(self):
+        # written to a temporary file first so that readers never see a partial file
+        progress_file = os.path.join(self.result_root, 'progress.json')
+        with open(f'{progress_file}.tmp', 'wb') as f:
+            f.write(dumps_json(self.get_progress()))
+        os.replace(f'{progress_file}.tmp', progress_file)
+
+
+def build_matrix(apps, profile_ids, seeds):
+    return [FleetRun(app, profile_id, seed) for app, profile_id, seed in itertools.product(apps, profile_ids, seeds)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run DroidAgent on a matrix of apps × personas × seeds over a pool of devices')
+    parser.add_argument('--apps', nargs='+', help='names of the apps to be tested', required=True)
+    parser.add_argument('--profile_ids', nargs='+', help='names of the persona profiles to be used', default=['jade'])
+    parser.add_argument('--seeds', nargs='+', type=int, help='random seeds (one run per seed)', default=[0])
+    parser.add_argument('--device_serials', nargs='+', help='serials of the devices in the pool', default=['emulator-5554'])
+    parser.add_argument('--result_root', type=str, help='path to the root output directory', default=None)
+    parser.add_argument('--max_attempts', type=int, help='maximum number of attempts per run', default=MAX_ATTEMPTS)
+    parser.add_argument('--run_timeout', type=int, help='timeout of a single run in seconds', default=None)
+    parser.add_argument('--is_emulator', action='store_true', help='whether the devices are emulators or not', default=False)
+    parser.add_argument('--share_knowledge', action='store_true', help='whether the concurrent runs share their knowledge of the app or not', default=False)
+    args = parser.parse_args()
+
+    result_root = args.result_root or os.path.join(SCRIPT_DIR, f'../evaluation/fleet_{time.strftime("%Y%m%d%H%M%S")}')
+    runs = build_matrix(args.apps, args.profile_ids, args.seeds)
+    print(f'{len(runs)} runs on {len(args.device_serials)} devices, progress: {os.path.abspath(os.path.join(result_root, "progress.json"))}')
+
+    knowledge_services, knowledge_service_addresses = {}, {}
+    knowledge_service_authkey = generate_authkey() # new for every fleet, never on the command line
+    if args.share_knowledge:
+        for app in args.apps: # one service per app: widget signatures and task reflections are app-specific
+            knowledge_services[app], knowledge_service_addresses[app] = start_knowledge_server(authkey=knowledge_service_authkey.encode('utf-8'))
+
+    launcher = AgentProcessLauncher(is_emulator=args.is_emulator, run_timeout=args.run_timeout, knowledge_service_addresses=knowledge_service_addresses,
+                                    knowledge_service_authkey=knowledge_service_authkey)
+    orchestrator = FleetOrchestrator(runs, args.device_serials, launcher, result_root, max_attempts=args.max_attempts, knowledge_services=knowledge_services)
+    orchestrator.run()
+
+    failed_runs = [run.run_id for run in runs if run.status != STATUS_SUCCEEDED]
+    print(f'Finished: {len(runs) - len(failed_runs)} / {len(runs)} runs succeeded')
+    if len(failed_runs) > 0:
+        print('Failed runs:', ', '.join(failed_runs))
+        sys.exit(1)
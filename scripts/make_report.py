@@ -9,6 +9,8 @@ import argparse
 import pandas as pd
 from datetime import datetime
 
+from droidagent.image_store import ImageStoreReader
+
 def get_screenshot_by_timestamp(timestamp, screenshot_with_timestamp):
     prev_screenshot = None 
     next_screenshot = None
@@ -42,12 +44,26 @@ if __name__ == '__main__':
         result_path = os.path.join('..', 'evaluation', 'data', target_project)
 
     state_str_to_screenshot_path = {}
-    for state_file in glob.glob(os.path.join(result_path, 'states', '*.json')):
-        with open(state_file, 'r') as f:
-            state_data = json.load(f)
-            state_str = state_data['state_str']
-            screenshot_path = 'file://' + str(os.path.abspath(os.path.join(result_path, 'states', f'screen_{state_data["tag"]}.png')))
-            state_str_to_screenshot_path[state_str] = screenshot_path
+    screenshot_with_timestamp = []
+    image_store_reader = ImageStoreReader(result_path)
+    if image_store_reader.exists():
+        # the image manifest replaces globbing the screenshots and parsing every state file (and points to the deduplicated images)
+        for tag, state_str, screenshot in image_store_reader.get_screenshots():
+            state_str_to_screenshot_path[state_str] = 'file://' + screenshot
+            screenshot_with_timestamp.append((screenshot, datetime.strptime(tag, '%Y-%m-%d_%H%M%S')))
+    else: # runs recorded before the image store
+        for state_file in glob.glob(os.path.join(result_path, 'states', '*.json')):
+            with open(state_file, 'r') as f:
+                state_data = json.load(f)
+                state_str = state_data['state_str']
+                screenshot_path = 'file://' + str(os.path.abspath(os.path.join(result_path, 'states', f'screen_{state_data["tag"]}.png')))
+                state_str_to_screenshot_path[state_str] = screenshot_path
+
+        for screenshot in glob.glob(os.path.join(result_path, 'states', '*.png')):
+            screenshot_file_name = os.path.basename(screenshot).split('.')[0].removeprefix('screen_')
+            timestamp_from_filename = datetime.strptime(screenshot_file_name, '%Y-%m-%d_%H%M%S')
+
+            screenshot_with_timestamp.append((screenshot, timestamp_from_filename))
 
     exp_data_file = os.path.join(result_path, 'exp_data.json')
 
@@ -58,16 +74,6 @@ if __name__ == '__main__':
 
     rows = []
 
-    screenshot_path = os.path.join(result_path, 'states')
-    screenshots = glob.glob(os.path.join(screenshot_path, '*.png'))
-    screenshot_with_timestamp = []
-
-    for screenshot in screenshots:
-        screenshot_file_name = os.path.basename(screenshot).split('.')[0].removeprefix('screen_')
-        timestamp_from_filename = datetime.strptime(screenshot_file_name, '%Y-%m-%d_%H%M%S') 
-
-        screenshot_with_timestamp.append((screenshot, timestamp_from_filename))
-
     start_timestamp = min(screenshot_with_timestamp, key=lambda x: x[1])[1]
     end_timestamp = max(screenshot_with_timestamp, key=lambda x: x[1])[1]
 
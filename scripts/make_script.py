@@ -9,6 +9,8 @@ import argparse
 import pandas as pd
 from datetime import datetime
 
+from droidagent.image_store import ImageStoreReader
+
 def get_widget_identifier(action_data):
     text = None
     content_desc = None
@@ -43,6 +45,57 @@ def get_widget_identifier(action_data):
     return selector_str + ')', None
 
 
+def get_action_code(action_data):
+    action_code = ''
+    selector_str, position = get_widget_identifier(action_data)
+
+    if action_data['action_type'] == 'touch':
+        if selector_str is None:
+            action_code += f'''d.click({position[0]}, {position[1]})'''
+        else:
+            action_code += f'''{selector_str}.click()'''
+    elif action_data['action_type'] == 'long_touch':
+        if selector_str is None:
+            action_code += f'''d.long_click({position[0]}, {position[1]})'''
+        else:
+            action_code += f'''{selector_str}.long_click()'''
+    elif action_data['action_type'] == 'set_text':
+        if selector_str is None:
+            action_code += f'''d.click({position[0]}, {position[1]})'''
+            action_code += '\n'
+            action_code += f'''d.send_keys("{action_data['text']}")'''
+        else:
+            action_code += f'''{selector_str}.set_text("{action_data['text'].replace('"', '')}")'''
+    elif action_data['action_type'] == 'scroll':
+        if selector_str is None:
+            if action_data['direction'] == 'UP':
+                action_code += f'''d.swipe({position[0]}, {position[1]}, {position[0]}, {position[1] + 100})'''
+            elif action_data['direction'] == 'DOWN':
+                action_code += f'''d.swipe({position[0]}, {position[1]}, {position[0]}, {position[1] - 100})'''
+            elif action_data['direction'] == 'LEFT':
+                action_code += f'''d.swipe({position[0]}, {position[1]}, {position[0] + 100}, {position[1]})'''
+            elif action_data['direction'] == 'RIGHT':
+                action_code += f'''d.swipe({position[0]}, {position[1]}, {position[0] - 100}, {position[1]})'''
+        else:
+            action_code += f'''{selector_str}.swipe({action_data['direction'].lower()})'''
+    elif action_data['action_type'] == 'key':
+        if action_data['name'] == 'BACK':
+            action_code += f'''d.press("back")'''
+
+    # case 2: wait action (wait until activity is launched, etc.)
+    elif action_data['action_type'] == 'wait':
+        action_code += f'''wait()'''
+    elif action_data['action_type'] in ['navigate', 'run_macro']:
+        # replay the events of the known route / the steps of the action sequence one by one
+        steps = action_data['navigation_hops'] if action_data['action_type'] == 'navigate' else action_data['macro_steps']
+        for i, step_data in enumerate(steps):
+            if i > 0:
+                action_code += f'''\nwait()\nwait_until_activity(d, "{step_data['page']}")\n'''
+            action_code += get_action_code(step_data)
+
+    return action_code
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Make GUI testing scripts from experiment data')
     parser.add_argument('--result_dir', type=str, help='Result directory')
@@ -55,12 +108,17 @@ if __name__ == '__main__':
     package_name = args.package_name
 
     state_str_to_screenshot_path = {}
-    for state_file in glob.glob(os.path.join(result_path, 'states', '*.json')):
-        with open(state_file, 'r') as f:
-            state_data = json.load(f)
-            state_str = state_data['state_str']
-            screenshot_path = 'file://' + str(os.path.abspath(os.path.join(result_path, 'states', f'screen_{state_data["tag"]}.png')))
-            state_str_to_screenshot_path[state_str] = screenshot_path
+    image_store_reader = ImageStoreReader(result_path)
+    if image_store_reader.exists(): # the screenshots are moved from states/ to the image store
+        for tag, state_str, screenshot in image_store_reader.get_screenshots():
+            state_str_to_screenshot_path[state_str] = 'file://' + screenshot
+    else: # runs recorded before the image store
+        for state_file in glob.glob(os.path.join(result_path, 'states', '*.json')):
+            with open(state_file, 'r') as f:
+                state_data = json.load(f)
+                state_str = state_data['state_str']
+                screenshot_path = 'file://' + str(os.path.abspath(os.path.join(result_path, 'states', f'screen_{state_data["tag"]}.png')))
+                state_str_to_screenshot_path[state_str] = screenshot_path
 
     exp_data_file = os.path.join(result_path, 'exp_data.json')
 
@@ -136,44 +194,7 @@ wait()
                 script_content += '\n'
                 # case 1: user action
                 if entry['action_data'] is not None:
-                    selector_str, position = get_widget_identifier(entry['action_data'])
-                        
-                    if entry['action_data']['action_type'] == 'touch':
-                        if selector_str is None:
-                            script_content += f'''d.click({position[0]}, {position[1]})'''
-                        else:
-                            script_content += f'''{selector_str}.click()'''
-                    elif entry['action_data']['action_type'] == 'long_touch':
-                        if selector_str is None:
-                            script_content += f'''d.long_click({position[0]}, {position[1]})'''
-                        else:
-                            script_content += f'''{selector_str}.long_click()'''
-                    elif entry['action_data']['action_type'] == 'set_text':
-                        if selector_str is None:
-                            script_content += f'''d.click({position[0]}, {position[1]})'''
-                            script_content += '\n'
-                            script_content += f'''d.send_keys("{entry['action_data']['text']}")'''
-                        else:
-                            script_content += f'''{selector_str}.set_text("{entry['action_data']['text'].replace('"', '')}")'''
-                    elif entry['action_data']['action_type'] == 'scroll':
-                        if selector_str is None:
-                            if entry['action_data']['direction'] == 'UP':
-                                script_content += f'''d.swipe({position[0]}, {position[1]}, {position[0]}, {position[1] + 100})'''
-                            elif entry['action_data']['direction'] == 'DOWN':
-                                script_content += f'''d.swipe({position[0]}, {position[1]}, {position[0]}, {position[1] - 100})'''
-                            elif entry['action_data']['direction'] == 'LEFT':
-                                script_content += f'''d.swipe({position[0]}, {position[1]}, {position[0] + 100}, {position[1]})'''
-                            elif entry['action_data']['direction'] == 'RIGHT':
-                                script_content += f'''d.swipe({position[0]}, {position[1]}, {position[0] - 100}, {position[1]})'''
-                        else:
-                            script_content += f'''{selector_str}.swipe({entry['action_data']['direction'].lower()})'''
-                    elif entry['action_data']['action_type'] == 'key':
-                        if entry['action_data']['name'] == 'BACK':
-                            script_content += f'''d.press("back")'''
-
-                    # case 2: wait action (wait until activity is launched, etc.)
-                    elif entry['action_data']['action_type'] == 'wait':
-                        script_content += f'''wait()'''
+                    script_content += get_action_code(entry['action_data'])
 
                 # case 3: recovery action (send open intent, press back multiple times, etc.)
                 else:
@@ -181,6 +202,8 @@ wait()
                         script_content += f'''d.app_start("{package_name}")'''
                     elif entry['description'].startswith('Press the back button'):
                         script_content += f'''go_back_until_inside_app(d)'''
+                    elif entry['description'].startswith('Restart the app'):
+                        script_content += f'''d.app_stop("{package_name}")\nd.app_start("{package_name}")'''
 
                 cleaned_description = entry['description'].replace('"', "'").replace('\n', ' ').encode('ascii', 'ignore').decode('ascii')
                 script_content += f'\nprint("{cleaned_description}: SUCCESS")\nwait()\n'
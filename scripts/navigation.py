@@ -0,0 +1,115 @@
+import copy
+
+from droidagent.action import Action
+from droidagent.gui_state import GUIState
+from droidagent.navigation import MAX_ROUTE_LENGTH
+from droidagent.utils import GUIStateManager
+
+
+def get_page_name(droidbot_state):
+    return GUIStateManager.fix_activity_name(droidbot_state.foreground_activity)
+
+
+def bind_event(event, droidbot_state):
+    """
+    Retarget a recorded event to the same view in the given state (its bounds may differ, e.g., after scrolling)
+    :return: InputEvent, the event to send (None if its view is not on the screen)
+    """
+    view = getattr(event, 'view', None)
+    if view is None:
+        return event
+
+    for candidate_view in droidbot_state.views:
+        if candidate_view.get('view_str') == view.get('view_str'):
+            bound_event = copy.copy(event)
+            bound_event.view = candidate_view
+            return bound_event
+
+    return None
+
+
+def get_event_record(event, page):
+    # same format as Action.get_reproducible_record (used by make_script.py)
+    view = getattr(event, 'view', None) or {}
+    return {
+        'page': page,
+        'action_type': event.event_type,
+        'text': getattr(event, 'text', None),
+        'direction': getattr(event, 'direction', None),
+        'name': getattr(event, 'name', None),
+        'target_widget_resource_id': view.get('resource_id'),
+        'target_widget_content_description': view.get('content_description'),
+        'target_widget_text': view.get('text'),
+        'target_widget_bounds': view.get('bounds'),
+    }
+
+
+def navigate(device_manager, agent, action, max_hops=MAX_ROUTE_LENGTH):
+    """
+    Follow the shortest known route to the target page of a navigate action, without any LLM call
+    The route is recomputed from the actual state after each hop; navigation stops (and the LLM takes over from the reached page)
+    as soon as a hop does not lead to its expected page or the view of the next event is not on the screen.
+    :return: list of dict, records of the sent events
+    """
+    navigation_index = agent.memory.navigation
+    event_records = []
+    hop_records = []
+    for _ in range(max_hops):
+        current_state = device_manager.current_state
+        current_page = get_page_name(current_state)
+        if current_page == action.target_page:
+            break
+
+        route = navigation_index.find_route(current_state.state_str, current_page, action.target_page)
+        if route is None:
+            break
+
+        hop = route[0]
+        event = bind_event(hop.event, current_state)
+        if event is None:
+            print(f'Navigation to {action.target_page} stopped on {current_page}: the next event is not applicable on the screen')
+            break
+
+        event_records.append(device_manager.send_event_to_device(event, capture_intermediate_state=True, agent=agent))
+        hop_records.append(get_event_record(event, current_page))
+
+        reached_page = get_page_name(device_manager.current_state)
+        if reached_page != hop.target_page:
+            print(f'Navigation to {action.target_page} diverged: expected {hop.target_page}, reached {reached_page}')
+            break
+
+    action.set_navigation_result(get_page_name(device_manager.current_state), hop_records)
+    return event_records
+
+
+def run_macro(device_manager, agent, action):
+    """
+    Perform the steps of a run_macro action without any LLM call
+    Before each step, the screen is verified to be on the page of the step and to contain its target widget (found by structural signature);
+    on a mismatch the macro stops there and the LLM takes over from the current screen.
+    :return: list of dict, records of the sent events
+    """
+    macro = action.macro
+    event_records = []
+    step_records = []
+    for step in macro.steps:
+        gui_state = GUIState().from_droidbot_state(device_manager.current_state)
+        if gui_state.activity != step['page']:
+            print(f'Macro {macro.macro_id} stopped: expected {step["page"]}, reached {gui_state.activity}')
+            break
+
+        target_widget = None
+        if step['widget_signature'] is not None:
+            target_widget = gui_state.get_widget_by_signature(step['widget_signature'])
+            if target_widget is None or step['event_type'] not in target_widget.possible_action_types:
+                print(f'Macro {macro.macro_id} stopped on {gui_state.activity}: the target widget of the next step is not on the screen')
+                break
+
+        step_action = Action().from_props(step['event_type'], text=step['text'], direction=step['direction'], name=step['name'], target_widget=target_widget)
+        for event in step_action.to_droidbot_event():
+            event_records.append(device_manager.send_event_to_device(event, capture_intermediate_state=True, agent=agent))
+        step_records.append(dict(step_action.get_reproducible_record(), page=step['page']))
+
+    agent.memory.macros.record_result(macro.macro_id, completed=(len(step_records) == len(macro.steps)))
+    action.set_macro_result(step_records)
+    return event_records
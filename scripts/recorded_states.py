@@ -0,0 +1,62 @@
+import os
+import glob
+import json
+
+from droidagent.image_store import ImageStoreReader
+
+
+def assemble_view_tree(views, view_id=0):
+    """
+    Rebuild the nested view tree from DroidBot's flat view list (same layout as DeviceState.view_tree)
+    """
+    view = dict(views[view_id])
+    view['children'] = [assemble_view_tree(views, child_id) for child_id in views[view_id].get('children', [])]
+    return view
+
+
+class RecordedState:
+    """
+    Stand-in for DroidBot's DeviceState, rebuilt from a recorded `states/*.json` file
+    """
+    def __init__(self, state_dict, state_file=None, stored_screenshot_path=None):
+        """
+        :param stored_screenshot_path: str, the screenshot in the image store of the run (moved out of `states/`)
+        """
+        self.state_file = state_file
+        self.stored_screenshot_path = stored_screenshot_path
+        self.tag = state_dict['tag']
+        self.state_str = state_dict['state_str']
+        self.foreground_activity = state_dict['foreground_activity']
+        self.activity_stack = state_dict['activity_stack']
+        self.width = state_dict.get('width')
+        self.height = state_dict.get('height')
+        self.views = state_dict['views']
+        self.view_tree = assemble_view_tree(self.views)
+
+    @property
+    def screenshot_path(self):
+        if self.stored_screenshot_path is not None:
+            return self.stored_screenshot_path
+        if self.state_file is None:
+            return None
+        return os.path.join(os.path.dirname(self.state_file), f'screen_{self.tag}.png')
+
+
+def load_recorded_states(result_dir, limit=None):
+    """
+    Load recorded DroidBot states of a previous run in chronological order
+    :param result_dir: str, output directory of a previous run (containing `states/`)
+    :param limit: int, maximum number of states to load
+    """
+    state_files = sorted(glob.glob(os.path.join(result_dir, 'states', '*.json')))
+    if limit is not None:
+        state_files = state_files[:limit]
+
+    stored_screenshot_paths = {(tag, state_str): blob_path for tag, state_str, blob_path in ImageStoreReader(result_dir).get_screenshots()}
+    states = []
+    for state_file in state_files:
+        with open(state_file, 'r') as f:
+            state_dict = json.load(f)
+        states.append(RecordedState(state_dict, state_file=state_file, stored_screenshot_path=stored_screenshot_paths.get((state_dict['tag'], state_dict['state_str']))))
+
+    return states
@@ -0,0 +1,249 @@
+from droidbot.input_event import IntentEvent, KeyEvent
+
+from device_manager import ExternalAction
+
+import time
+from datetime import datetime
+
+MAX_NUM_STEPS_OUTSIDE = 5 # steps tolerated on the pages of other apps (e.g., file picker, permission settings) before recovering
+MAX_BACK_PRESSES = 4 # per "back" attempt
+RECOVERY_TIME_BUDGET = 20 # seconds per recovery episode
+FOREGROUND_POLL_INTERVAL = 0.2
+FOREGROUND_STABLE_WINDOW = 0.6
+FOREGROUND_TIMEOUT = 3
+APP_START_TIMEOUT = 10 # a cold start can take several seconds before the first activity of the app is on the screen
+
+LEAKCANARY_ACTIVITY = 'leakcanary.internal.activity'
+
+# initial estimates of the duration of each strategy (seconds) until actual durations are observed
+PRIOR_COSTS = {
+    'back': 2,
+    'reopen': 3,
+    'back_reopen': 5,
+    'restart': 6,
+}
+
+
+class StrategyStats:
+    def __init__(self, prior_cost):
+        self.prior_cost = prior_cost
+        self.attempts = 0
+        self.successes = 0
+        self.total_time = 0
+
+    @property
+    def expected_cost(self):
+        """
+        Expected time to recover with the strategy: mean duration of an attempt / success rate (Laplace smoothed, with the prior as one pseudo-attempt)
+        """
+        mean_time = (self.total_time + self.prior_cost) / (self.attempts + 1)
+        success_rate = (self.successes + 1) / (self.attempts + 2)
+        return mean_time / success_rate
+
+
+class RecoveryEngine:
+    """
+    Bring the target app back to the foreground when an action left it (closed app, other app on the screen)
+    - strategies are tried in order of expected cost (observed duration / success rate), the strategy that last worked
+      for the same foreign package first
+    - the foreground app is probed between the events (top activity, then activity stack); the full state is fetched once at the end
+    - after an intent starting the app, the top activity is only taken as settled once it has changed (the app may take a while to start)
+    - an episode stops after `time_budget` seconds, successful or not (the next step tries again)
+    """
+    def __init__(self, device_manager, time_budget=RECOVERY_TIME_BUDGET, max_steps_outside=MAX_NUM_STEPS_OUTSIDE, clock=time.monotonic, sleep=time.sleep):
+        self.device_manager = device_manager
+        self.device = device_manager.device
+        self.app = device_manager.app
+        self.time_budget = time_budget
+        self.max_steps_outside = max_steps_outside
+        self.clock = clock
+        self.sleep = sleep
+
+        self.steps_outside = 0
+        self.episode_start_time = None
+        self.last_top_activity = None # last probed top activity
+        self.strategy_stats = {name: StrategyStats(cost) for name, cost in PRIOR_COSTS.items()}
+        self.preferred_strategies = {} # foreign package -> name of the strategy that last recovered from it
+
+        self.episode_count = 0
+        self.failed_episode_count = 0
+        self.total_episode_time = 0
+
+    def get_foreground_package(self):
+        top_activity = self.device_manager.current_state.foreground_activity
+        if top_activity is None:
+            return None
+        return top_activity.split('/')[0]
+
+    def is_app_activity(self, top_activity):
+        return top_activity is not None and top_activity.split('/')[0] == self.app.package_name and LEAKCANARY_ACTIVITY not in top_activity
+
+    def probe_foreground(self):
+        self.last_top_activity = self.device_manager.probe_foreground()
+        return self.last_top_activity
+
+    def wait_for_foreground(self, previous_activity=None, timeout=FOREGROUND_TIMEOUT):
+        """
+        Poll the top activity until the app is in the foreground or the top activity has not changed for a while
+        :param previous_activity: str, the top activity before the event: the stable window only starts once the top activity has changed
+        :return: bool, whether the app is in the foreground
+        """
+        start_time = self.clock()
+        last_activity = self.probe_foreground()
+        stable_since = start_time if previous_activity is None or last_activity != previous_activity else None
+        while not self.is_app_activity(last_activity):
+            if self.clock() - start_time >= timeout:
+                return False
+            if stable_since is not None and self.clock() - stable_since >= FOREGROUND_STABLE_WINDOW:
+                return False
+            self.sleep(FOREGROUND_POLL_INTERVAL)
+            top_activity = self.probe_foreground()
+            if top_activity != last_activity:
+                last_activity = top_activity
+                stable_since = self.clock()
+        return True
+
+    def send(self, event, sent_events, starts_app=False):
+        """
+        :param starts_app: bool, whether the event starts the app (waits for the top activity to change, up to APP_START_TIMEOUT seconds)
+        """
+        previous_activity = self.last_top_activity
+        self.device.send_event(event)
+        sent_events.append(event)
+        if starts_app:
+            return self.wait_for_foreground(previous_activity=previous_activity, timeout=APP_START_TIMEOUT)
+        return self.wait_for_foreground()
+
+    def press_back(self, sent_events, max_presses=MAX_BACK_PRESSES):
+        for _ in range(max_presses):
+            if self.send(KeyEvent(name='BACK'), sent_events):
+                return True
+            if self.clock() - self.episode_start_time >= self.time_budget:
+                break
+        return False
+
+    def reopen(self, sent_events):
+        return self.send(IntentEvent(intent=self.app.get_start_intent()), sent_events, starts_app=True)
+
+    def run_strategy(self, name, sent_events):
+        """
+        :return: bool, whether the app is in the foreground after the strategy
+        """
+        if name == 'back':
+            return self.press_back(sent_events)
+        if name == 'reopen':
+            return self.reopen(sent_events)
+        if name == 'back_reopen':
+            self.press_back(sent_events)
+            return self.reopen(sent_events)
+        if name == 'restart':
+            self.send(IntentEvent(intent=self.app.get_stop_intent()), sent_events)
+            return self.reopen(sent_events)
+        raise ValueError(f'Unknown recovery strategy: {name}')
+
+    def get_strategy_order(self, foreign_package, app_closed):
+        names = [name for name in self.strategy_stats if not (app_closed and name in ['back', 'back_reopen'])] # nothing of the app to go back to
+        names.sort(key=lambda name: self.strategy_stats[name].expected_cost)
+        preferred_strategy = self.preferred_strategies.get(foreign_package)
+        if preferred_strategy in names:
+            names.remove(preferred_strategy)
+            names.insert(0, preferred_strategy)
+        return names
+
+    def describe_recovery(self, strategy, app_closed, sent_events):
+        if app_closed and strategy == 'reopen':
+            return 'Open the app again because the previous action led to closing the app'
+        if strategy == 'back':
+            back_button_times = len(sent_events)
+            if back_button_times > 1:
+                return f'Press the back button {back_button_times} times because you stayed on the pages not belonging to the target app for too long'
+            return 'Press the back button because you stayed on the pages not belonging to the target app for too long'
+        if strategy == 'restart':
+            return 'Restart the app because you stayed on the pages not belonging to the target app for too long'
+        return 'Open the app again because you stayed on the pages not belonging to the target app for too long'
+
+    def record_events(self, sent_events, pre_event_state):
+        # the intermediate states are not fetched: every event is recorded from the state before the episode to the state after it
+        event_dicts = []
+        post_event_state = self.device_manager.current_state
+        for i, event in enumerate(sent_events):
+            event_dict = {
+                'tag': f'{datetime.now().strftime("%Y-%m-%d_%H%M%S")}_recovery{i}',
+                'event': event.to_dict(),
+                'start_state': pre_event_state.state_str,
+                'stop_state': post_event_state.state_str,
+                'event_str': event.get_event_str(pre_event_state),
+                'task': None,
+                'view_image_dir': None,
+                'settle_time': None,
+            }
+            event_dicts.append(event_dict)
+            is_last_event = i == len(sent_events) - 1
+            self.device_manager.pipeline.submit(self.device_manager.record_event, event if is_last_event else None, pre_event_state, post_event_state, [], dict(event_dict))
+        return event_dicts
+
+    def recover(self, agent):
+        """
+        :return: bool, whether the app is in the foreground (after recovery, if needed)
+        """
+        app_activity_depth = self.device_manager.get_app_activity_depth()
+        app_closed = app_activity_depth < 0 or LEAKCANARY_ACTIVITY in self.device_manager.current_state.foreground_activity
+        if app_activity_depth == 0 and not app_closed:
+            self.steps_outside = 0
+            return True
+
+        if not app_closed:
+            self.steps_outside += 1
+            if self.steps_outside <= self.max_steps_outside:
+                agent.clear_temporary_message()
+                return False
+
+        self.episode_start_time = self.clock()
+        pre_event_state = self.device_manager.current_state
+        self.last_top_activity = pre_event_state.foreground_activity
+        foreign_package = self.get_foreground_package()
+        sent_events = []
+        recovered_by = None
+        while recovered_by is None and self.clock() - self.episode_start_time < self.time_budget:
+            for name in self.get_strategy_order(foreign_package, app_closed):
+                if self.clock() - self.episode_start_time >= self.time_budget:
+                    break
+                strategy_start_time = self.clock()
+                strategy_events = []
+                in_foreground = self.run_strategy(name, strategy_events)
+                sent_events.extend(strategy_events)
+                if in_foreground: # confirmed on the activity stack (the top activity can be stale)
+                    in_foreground = self.device_manager.get_app_activity_depth(probe=True) == 0
+
+                stats = self.strategy_stats[name]
+                stats.attempts += 1
+                stats.total_time += self.clock() - strategy_start_time
+                if in_foreground:
+                    stats.successes += 1
+                    recovered_by = (name, strategy_events)
+                    break
+
+        self.device_manager.fetch_device_state()
+        episode_time = self.clock() - self.episode_start_time
+        self.episode_count += 1
+        self.total_episode_time += episode_time
+        if recovered_by is None:
+            self.failed_episode_count += 1
+            print(f'Could not bring the app back to the foreground in {episode_time:.1f}s ({len(sent_events)} events), retrying after the next step')
+        else:
+            self.preferred_strategies[foreign_package] = recovered_by[0]
+        event_dicts = self.record_events(sent_events, pre_event_state)
+
+        if recovered_by is not None:
+            strategy, strategy_events = recovered_by
+            agent.memory.append_to_working_memory(ExternalAction(self.describe_recovery(strategy, app_closed, strategy_events), event_dicts), 'ACTION')
+            agent.clear_temporary_message()
+            self.steps_outside = 0
+
+        return recovered_by is not None
+
+    def describe_stats(self):
+        if self.episode_count == 0:
+            return 'App recovery: no episodes yet'
+        strategy_stats = ', '.join(f'{name} {stats.successes}/{stats.attempts}' for name, stats in self.strategy_stats.items() if stats.attempts > 0)
+        return f'App recovery: {self.episode_count} episodes, {self.failed_episode_count} failed, mean {self.total_episode_time / self.episode_count:.1f}s per episode ({strategy_stats})'
@@ -1,5 +1,6 @@
 import time
 import os
+import random
 import shutil
 import json
 import argparse
@@ -13,8 +14,14 @@ from droidbot.app import App
 from droidbot.input_event import IntentEvent, KeyEvent
 
 from droidagent import TaskBasedAgent
-
-from device_manager import DeviceManager, recover_activity_stack, ExternalAction
+from droidagent.pipeline import BackgroundPipeline
+from droidagent.artifact_writer import artifact_writer
+from droidagent.knowledge_service import connect_knowledge_service
+from droidagent.image_store import ImageStore, IMAGE_DIR
+
+from device_manager import DeviceManager, ExternalAction
+from recovery import RecoveryEngine
+from navigation import navigate, run_macro
 from collections import defaultdict, OrderedDict
 from targets import initial_knowledge_map
 
@@ -22,7 +29,6 @@ from targets import initial_knowledge_map
 SCRIPT_DIR = os.path.dirname(__file__)
 PROFILE_DIR = os.path.join(SCRIPT_DIR, '..', 'resources/personas')
 
-POST_EVENT_WAIT = 1
 MAX_STEP = 8000
 
 
@@ -45,49 +51,44 @@ def load_profile(profile_id):
     return profile
 
 
-@timeout(7200)
-def main(device, app, persona, debug=False):
+def run_agent_loop(agent, device_manager, recovery_engine, max_steps=MAX_STEP, time_limit=7200):
+    """
+    Step the agent on the device until `max_steps` steps are taken
+    """
     start_time = time.time()
-    agent = TaskBasedAgent(output_dir, app=app, persona=persona, debug_mode=debug)
-    device_manager = DeviceManager(device, app, output_dir=output_dir)
-    agent.set_current_gui_state(device_manager.current_state)
-    is_loading_state = False
     need_state_update = False
 
-    max_loading_wait = 3
-    loading_wait_count = 0
-
-    while True:
-        if agent.step_count > MAX_STEP:
-            print(f'Maximum number of steps reached ({agent.step_count})')
-            device.uninstall_app(app)
-            device.disconnect()
-            device.tear_down()
-            exit(0)
+    max_loading_wait = 3 # seconds
+    loading_wait_time = 0
 
+    while agent.step_count <= max_steps:
         if agent.step_count % 10 == 0:
-            print(f'Time left: {round(((7200 - (time.time() - start_time)) / 60), 2)} min')
+            print(f'Time left: {round(((time_limit - (time.time() - start_time)) / 60), 2)} min')
+            print(device_manager.settle_detector.describe_stats())
+            print(device_manager.describe_stats())
+            print(device_manager.image_store.describe_stats())
+            print(artifact_writer.describe_stats())
+            print(recovery_engine.describe_stats())
 
         if agent.is_loading_state(device_manager.current_state):
-            loading_wait_count += 1
-
-            if loading_wait_count > max_loading_wait:
+            if loading_wait_time >= max_loading_wait:
                 print('Loading state persisted for too long. Pressing the back button to go back to the previous state...')
                 go_back_event = KeyEvent(name='BACK')
                 event_dict = device_manager.send_event_to_device(go_back_event)
                 agent.memory.append_to_working_memory(ExternalAction(f'{agent.persona_name} pressed the back button because there was no interactable widgets', [event_dict]), 'ACTION')
-                loading_wait_count = 0
+                loading_wait_time = 0
                 continue
                 
             else:
                 print('Loading state detected. Waiting for the app to be ready...')
-                time.sleep(POST_EVENT_WAIT)
-                device_manager.fetch_device_state()
+                loading_wait_time += device_manager.wait_until_settled()
+                device_manager.fetch_device_state(tier='hierarchy') # the screenshot is only taken once the loading is done
                 need_state_update = True
                 continue
 
         if need_state_update:   
             # seems that the loading is done and need to update the state captured right after the action to the recent state
+            device_manager.ensure_full_state()
             agent.set_current_gui_state(device_manager.current_state)
             device_manager.add_new_utg_edge()
             need_state_update = False
@@ -97,16 +98,39 @@ def main(device, app, persona, debug=False):
         
         if action is not None:
             event_records = []
-            events = action.to_droidbot_event()
-            for event in events:
+            if action.event_type == 'navigate': # known route: replayed hop by hop without LLM calls
+                event_records = navigate(device_manager, agent, action)
+            elif action.event_type == 'run_macro': # mined action sequence: verified and performed step by step without LLM calls
+                event_records = run_macro(device_manager, agent, action)
+            for event in action.to_droidbot_event():
                 event_dict = device_manager.send_event_to_device(event, capture_intermediate_state=True, agent=agent)
                 event_records.append(event_dict)
             
             action.add_event_records(event_records)
 
-            recover_activity_stack(device_manager, agent)
+            recovery_engine.recover(agent)
             agent.set_current_gui_state(device_manager.current_state)
 
+    print(f'Maximum number of steps reached ({agent.step_count})')
+
+
+@timeout(7200)
+def main(device, app, persona, debug=False, knowledge_service=None, image_near_duplicate_distance=None):
+    agent = TaskBasedAgent(output_dir, app=app, persona=persona, debug_mode=debug, knowledge_service=knowledge_service)
+    pipeline = BackgroundPipeline() # UTG updates and view crops overlap with the next LLM call
+    image_store = ImageStore(os.path.join(output_dir, IMAGE_DIR), near_duplicate_distance=image_near_duplicate_distance)
+    device_manager = DeviceManager(device, app, output_dir=output_dir, pipeline=pipeline, navigation_index=agent.memory.navigation, image_store=image_store)
+    recovery_engine = RecoveryEngine(device_manager)
+    agent.set_current_gui_state(device_manager.current_state)
+
+    run_agent_loop(agent, device_manager, recovery_engine)
+
+    device_manager.close()
+    device.uninstall_app(app)
+    device.disconnect()
+    device.tear_down()
+    exit(0)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Run a task-based exploration')
@@ -115,8 +139,17 @@ if __name__ == "__main__":
     parser.add_argument('--profile_id', type=str, help='name of the persona profile to be used', default='jade')
     parser.add_argument('--is_emulator', action='store_true', help='whether the device is an emulator or not', default=False)
     parser.add_argument('--debug', action='store_true', help='whether to run the agent in the debug mode or not', default=False)
+    parser.add_argument('--device_serial', type=str, help='serial of the device to be used', default='emulator-5554')
+    parser.add_argument('--seed', type=int, help='random seed of the run', default=None)
+    parser.add_argument('--knowledge_service', type=str, help='address (host:port) of a knowledge service shared with other agents', default=None)
+    parser.add_argument('--compress_artifacts', action='store_true', help='whether to gzip the prompts, event records and memory snapshots or not', default=False)
+    parser.add_argument('--image_near_duplicate_distance', type=int, help='collapse screenshots and view crops whose average hashes differ by at most this many bits (lossy, requires Pillow)', default=None)
     args = parser.parse_args()
     
+    artifact_writer.compress = args.compress_artifacts
+    if args.seed is not None:
+        random.seed(args.seed)
+
     timestamp = time.strftime("%Y%m%d%H%M%S")
 
     if args.debug:
@@ -128,7 +161,7 @@ if __name__ == "__main__":
     else:
         output_dir = args.output_dir
 
-    device = Device(device_serial='emulator-5554', output_dir=output_dir, grant_perm=True, is_emulator=args.is_emulator)
+    device = Device(device_serial=args.device_serial, output_dir=output_dir, grant_perm=True, is_emulator=args.is_emulator)
     device.set_up()
     device.connect()
 
@@ -153,6 +186,7 @@ if __name__ == "__main__":
             'app_name': app_name,
             'app_path': os.path.abspath(app_path),
             'device_serial': device.serial,
+            'seed': args.seed,
             'start_time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
         }, f, indent=4)
     
@@ -164,7 +198,8 @@ if __name__ == "__main__":
     time.sleep(10)
     
     try:
-        main(device, app, persona, debug=args.debug)
+        knowledge_service = connect_knowledge_service(args.knowledge_service) if args.knowledge_service is not None else None
+        main(device, app, persona, debug=args.debug, knowledge_service=knowledge_service, image_near_duplicate_distance=args.image_near_duplicate_distance)
     except (KeyboardInterrupt, TimeoutError) as e:
         print("Ending the exploration due to a user request or timeout.")
         print(e)
@@ -0,0 +1,473 @@
+import os
+import glob
+import gzip
+import json
+import time
+import random
+import shutil
+import hashlib
+import logging
+import argparse
+import tempfile
+from collections import OrderedDict
+
+os.environ.setdefault('OPENAI_API_KEY', 'offline-simulator') # the OpenAI client is created on import, but never called with a fake LLM backend
+
+from droidbot.device_state import DeviceState
+
+from droidagent import TaskBasedAgent
+from droidagent.model import set_llm_backend
+from droidagent.pipeline import BackgroundPipeline
+from droidagent.artifact_writer import artifact_writer
+from droidagent.image_store import ImageStore, IMAGE_DIR
+
+from device_manager import DeviceManager, UISettleDetector, UI_PROBE_COMMAND
+from recovery import RecoveryEngine
+from recorded_states import load_recorded_states
+from run_droidagent import run_agent_loop, load_profile
+from targets import initial_knowledge_map
+
+LAUNCHER_ACTIVITY = 'com.android.launcher3/.Launcher'
+LAUNCHER_STATE_STR = 'launcher'
+DEFAULT_SCREEN_SIZE = (1080, 1920)
+TEMPLATE_MARKER = '=== Below is the template for your answer ==='
+END_TASK_WEIGHT = 0.1 # probability of ending the task when the fake LLM selects an action
+
+
+def load_event_records(result_dir):
+    """
+    Load the event records (`events/event_*.json`, gzipped or not) of a previous run in chronological order
+    """
+    event_files = glob.glob(os.path.join(result_dir, 'events', 'event_*.json')) + glob.glob(os.path.join(result_dir, 'events', 'event_*.json.gz'))
+    event_records = []
+    for event_file in sorted(event_files):
+        opener = gzip.open if event_file.endswith('.gz') else open
+        with opener(event_file, 'rt') as f:
+            event_records.append(json.load(f))
+    return event_records
+
+
+def get_event_keys(event_dict):
+    """
+    :return: list of keys identifying the event on a state, the most specific first
+    (the view_str of the target widget, then its resource ID, class and text in case the view_str differs between runs)
+    """
+    event_type = event_dict.get('event_type')
+    if event_type == 'key':
+        return [('key', event_dict.get('name'))]
+    if event_type == 'intent':
+        return [('intent', event_dict.get('intent'))]
+
+    view = event_dict.get('view') or {}
+    return [
+        (event_type, view.get('view_str'), event_dict.get('direction')),
+        (event_type, view.get('resource_id'), view.get('class'), view.get('text') or view.get('content_description'), event_dict.get('direction')),
+    ]
+
+
+def get_full_activity_name(activity):
+    # 'com.example/.MainActivity' -> 'com.example.MainActivity'
+    package_name, activity_name = activity.split('/', 1) if '/' in activity else ('', activity)
+    if activity_name.startswith('.'):
+        activity_name = package_name + activity_name
+    return activity_name
+
+
+def make_launcher_state_dict(app_name, width, height):
+    # home screen with the icon of the app (a screen without interactable widgets would be taken as a loading screen)
+    def make_view(temp_id, parent, children, view_class, bounds, text=None, clickable=False):
+        return {
+            'temp_id': temp_id, 'parent': parent, 'children': children, 'class': view_class, 'package': LAUNCHER_ACTIVITY.split('/')[0],
+            'bounds': bounds, 'size': f'{bounds[1][0] - bounds[0][0]}*{bounds[1][1] - bounds[0][1]}', 'text': text, 'resource_id': None, 'content_description': text,
+            'visible': True, 'enabled': True, 'focused': False, 'selected': False, 'checked': False, 'checkable': False, 'is_password': False,
+            'clickable': clickable, 'long_clickable': False, 'scrollable': False, 'editable': False,
+        }
+    views = [
+        make_view(0, -1, [1], 'android.widget.FrameLayout', [[0, 0], [width, height]]),
+        make_view(1, 0, [], 'android.widget.TextView', [[0, 0], [width // 4, height // 8]], text=app_name, clickable=True),
+    ]
+    return {'tag': LAUNCHER_STATE_STR, 'state_str': LAUNCHER_STATE_STR, 'foreground_activity': LAUNCHER_ACTIVITY, 'activity_stack': [LAUNCHER_ACTIVITY],
+            'width': width, 'height': height, 'views': views}
+
+
+def render_activity_top(foreground_activity, views):
+    """
+    Output of `dumpsys activity top` for a screen (read by the UI probe of the settle detector): the activity and its view hierarchy
+    """
+    def render_view(view, depth):
+        (left, top), (right, bottom) = view.get('bounds') or [[0, 0], [0, 0]]
+        resource_id = f' {view["resource_id"]}' if view.get('resource_id') else ''
+        lines.append(f'{"  " * depth}{view.get("class")}{{{view["temp_id"]:x} V.E...... ........ {left},{top}-{right},{bottom}{resource_id}}}')
+        for child_id in view.get('children', []):
+            render_view(views[child_id], depth + 1)
+
+    lines = [f'TASK {foreground_activity.split("/")[0]} id=1', f'  ACTIVITY {foreground_activity} 1 pid=1', '    View Hierarchy:', f'      DecorView@1[{foreground_activity.split(".")[-1]}]']
+    for view in views:
+        if view.get('parent', -1) == -1:
+            render_view(view, 4)
+    return '\n'.join(lines)
+
+
+def render_window_focus(window_title, window_id=1):
+    # focused window line of `dumpsys window` (a dialog is another window, with the activity name as title)
+    return f'  mCurrentFocus=Window{{{window_id:x} u0 {window_title}}}'
+
+
+class SimulatedADB:
+    # the only shell command of a run is the UI probe
+    def __init__(self, device):
+        self.device = device
+
+    def shell(self, command):
+        if command != UI_PROBE_COMMAND:
+            raise NotImplementedError(f'Unsupported shell command on a simulated device: {command}')
+        foreground_activity = self.device.get_top_activity_name()
+        return render_activity_top(foreground_activity, self.device.get_views()) + '\n' + render_window_focus(foreground_activity)
+
+
+class SimulatedClock:
+    """
+    Virtual time for the settle detector and the recovery engine: sleeping advances the clock instantly
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now += duration
+
+
+class SimulatedEventListener:
+    # no accessibility events (toast messages) on a simulated device
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_event_log(self, since=None):
+        return ''
+
+
+class SimulatedApk:
+    def __init__(self, app_name):
+        self.app_name = app_name
+
+    def get_app_name(self):
+        return self.app_name
+
+
+class SimulatedApp:
+    """
+    Stand-in for DroidBot's App, with the package and activities observed in the recorded states
+    """
+    def __init__(self, package_name, app_name, activities, main_activity):
+        self.package_name = package_name
+        self.apk = SimulatedApk(app_name)
+        self.activities = activities
+        self.main_activity = main_activity
+
+    @classmethod
+    def from_result_dir(cls, result_dir, states):
+        app_name, package_name = None, None
+        if os.path.exists(os.path.join(result_dir, 'agent_config.json')):
+            with open(os.path.join(result_dir, 'agent_config.json'), 'r') as f:
+                saved_config = json.load(f)
+            app_name, package_name = saved_config.get('app_name'), saved_config.get('package_name')
+        if package_name is None: # the package of most recorded screens
+            packages = [state.foreground_activity.split('/')[0] for state in states if state.foreground_activity is not None]
+            package_name = max(set(packages), key=packages.count)
+
+        activities = []
+        for state in states:
+            for activity in [state.foreground_activity] + (state.activity_stack or []):
+                if activity is not None and activity.split('/')[0] == package_name and get_full_activity_name(activity) not in activities:
+                    activities.append(get_full_activity_name(activity))
+        main_activity = next((get_full_activity_name(state.foreground_activity) for state in states if state.foreground_activity is not None and state.foreground_activity.split('/')[0] == package_name), f'{package_name}.MainActivity')
+
+        return cls(package_name, app_name if app_name is not None else package_name, activities, main_activity)
+
+    def get_package_name(self):
+        return self.package_name
+
+    def get_main_activity(self):
+        return self.main_activity
+
+    def get_start_intent(self):
+        return f'am start {self.package_name}/{self.main_activity}'
+
+    def get_stop_intent(self):
+        return f'am force-stop {self.package_name}'
+
+
+class SimulatedDevice:
+    """
+    Stand-in for DroidBot's Device that replays a previous run: the screen is one of the recorded states, and an event moves it
+    along a recorded transition (UTG edge) of the current state
+    - UI events are matched by the view_str of the target widget (then its resource ID, class and text), key and intent events by name and intent
+    - among several recorded targets of the same event, one is drawn with the seeded random generator
+    - unrecorded events: BACK returns to the previous screen (the launcher if there is none), stopping the app shows the launcher,
+      starting it (or touching a widget of the launcher) shows the first recorded screen of the app, and anything else leaves the screen as it is
+    DroidBot's own state and UTG files are not written (`output_dir` is None); DeviceManager still writes its event records and view crops.
+    """
+    def __init__(self, states, event_records, app, seed=0):
+        self.serial = 'simulator'
+        self.output_dir = None
+        self.logger = logging.getLogger('simulator')
+        self.adb = SimulatedADB(self)
+        self.minicap = None
+        self.adapters = {self.minicap: False} # no minicap: screenshots are png files
+        self.rng = random.Random(seed)
+
+        self.state_dicts = {}
+        self.screenshot_paths = {}
+        for state in states:
+            if state.state_str in self.state_dicts:
+                continue
+            # views are kept serialized: DeviceState annotates the view dicts, every fetch gets its own copy
+            self.state_dicts[state.state_str] = (state.foreground_activity, state.activity_stack, json.dumps(state.views))
+            if os.path.exists(state.screenshot_path):
+                self.screenshot_paths[state.state_str] = state.screenshot_path
+
+        self.width, self.height = DEFAULT_SCREEN_SIZE
+        if len(states) > 0 and states[0].width is not None:
+            self.width, self.height = states[0].width, states[0].height
+        launcher_state_dict = make_launcher_state_dict(app.apk.get_app_name(), self.width, self.height)
+        self.state_dicts[LAUNCHER_STATE_STR] = (launcher_state_dict['foreground_activity'], launcher_state_dict['activity_stack'], json.dumps(launcher_state_dict['views']))
+
+        self.transitions = {} # (state_str, event key) -> list of target state_str (with repetitions: frequent targets are drawn more often)
+        for event_record in event_records:
+            if not isinstance(event_record.get('event'), dict):
+                continue # "wait"
+            source, target = event_record.get('start_state'), event_record.get('stop_state')
+            if source not in self.state_dicts or target not in self.state_dicts:
+                continue # the screens of the intermediate and loading states are not recorded
+            for event_key in get_event_keys(event_record['event']):
+                self.transitions.setdefault((source, event_key), []).append(target)
+
+        self.initial_state_str = next((state.state_str for state in states if state.foreground_activity is not None and state.foreground_activity.split('/')[0] == app.package_name), LAUNCHER_STATE_STR)
+        self.current_state_str = self.initial_state_str
+        self.history = [] # previous screens, for the unrecorded BACK events
+
+        self.event_count = 0
+        self.unknown_event_count = 0
+        self.trace = [self.current_state_str]
+
+    def get_current_state(self):
+        foreground_activity, activity_stack, views = self.state_dicts[self.current_state_str]
+        return DeviceState(self, views=json.loads(views), foreground_activity=foreground_activity, activity_stack=list(activity_stack),
+                           background_services=[], screenshot_path=self.take_screenshot())
+
+    def get_views(self):
+        return json.loads(self.state_dicts[self.current_state_str][2])
+
+    def get_top_activity_name(self):
+        return self.state_dicts[self.current_state_str][0]
+
+    def get_current_activity_stack(self):
+        return list(self.state_dicts[self.current_state_str][1])
+
+    def get_service_names(self):
+        return []
+
+    def take_screenshot(self):
+        return self.screenshot_paths.get(self.current_state_str)
+
+    def get_width(self, refresh=False):
+        return self.width
+
+    def get_height(self, refresh=False):
+        return self.height
+
+    def move_to(self, state_str):
+        if state_str != self.current_state_str:
+            self.history.append(self.current_state_str)
+            self.current_state_str = state_str
+
+    def send_event(self, event):
+        self.event_count += 1
+        event_dict = event.to_dict()
+        for event_key in get_event_keys(event_dict):
+            targets = self.transitions.get((self.current_state_str, event_key))
+            if targets:
+                self.move_to(self.rng.choice(targets))
+                self.trace.append(self.current_state_str)
+                return
+
+        self.unknown_event_count += 1
+        event_type = event_dict.get('event_type')
+        if event_type == 'key' and event_dict.get('name') == 'BACK':
+            self.current_state_str = self.history.pop() if len(self.history) > 0 else LAUNCHER_STATE_STR
+        elif event_type == 'intent' and 'force-stop' in event_dict.get('intent', ''):
+            self.move_to(LAUNCHER_STATE_STR)
+            self.history = []
+        elif (event_type == 'intent' and event_dict.get('intent', '').startswith('am start')) or (event_type == 'touch' and self.current_state_str == LAUNCHER_STATE_STR):
+            self.move_to(self.initial_state_str)
+            self.history = []
+        self.trace.append(self.current_state_str)
+
+    def get_trace_digest(self):
+        # identical for two runs with the same recording, seeds and number of steps
+        return hashlib.sha256('\n'.join(self.trace).encode()).hexdigest()[:16]
+
+
+class FakeLLM:
+    """
+    Offline replacement of `get_next_assistant_message` (see `droidagent.model.set_llm_backend`)
+    - function calls: one of the given functions with random valid arguments (never "wait", which sleeps in real time);
+      the task is ended with probability `end_task_weight`
+    - text answers: the answer template of the prompt is filled with fixed phrases (a random yes/no for the task success)
+    `latency` seconds are slept per call to emulate the API response time.
+    """
+    def __init__(self, seed=0, end_task_weight=END_TASK_WEIGHT, latency=0):
+        self.rng = random.Random(seed)
+        self.end_task_weight = end_task_weight
+        self.latency = latency
+        self.call_count = 0
+        self.function_call_count = 0
+        self.task_count = 0
+
+    def __call__(self, system_message, user_messages, assistant_messages, functions=[], model=None, max_tokens=None, function_call_option=None):
+        self.call_count += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if len(functions) > 0 and function_call_option != 'none':
+            function_call = self.call_function(functions)
+            if function_call is not None:
+                return function_call
+
+        last_message = user_messages[-1]
+        if not isinstance(last_message, str): # tool message, e.g., the follow-up question for the text input
+            last_message = '\n'.join(str(value) for value in json.loads(last_message['return_value']).values())
+        if TEMPLATE_MARKER not in last_message:
+            return 'The current screen looks as expected.'
+        return self.fill_template(last_message.split(TEMPLATE_MARKER)[1].split('===')[0])
+
+    def call_function(self, functions):
+        candidates = []
+        for function_def in functions:
+            function = function_def['function']
+            properties = function['parameters']['properties']
+            if function['name'] == 'wait' or any('enum' in prop and len(prop['enum']) == 0 for prop in properties.values()):
+                continue
+            candidates.append(function)
+        if len(candidates) == 0:
+            return None
+
+        end_task = next((function for function in candidates if function['name'] == 'end_task'), None)
+        if end_task is not None and (len(candidates) == 1 or self.rng.random() < self.end_task_weight):
+            function = end_task
+        else:
+            function = self.rng.choice([function for function in candidates if function['name'] != 'end_task'])
+
+        arguments = {}
+        for param_name, prop in function['parameters']['properties'].items():
+            arguments[param_name] = self.rng.choice(prop['enum']) if 'enum' in prop else 'Hello'
+
+        self.function_call_count += 1
+        return {
+            'id': f'call_{self.call_count}',
+            'type': 'function',
+            'function': {
+                'name': function['name'],
+                'arguments': json.dumps(arguments),
+            }
+        }
+
+    def fill_template(self, template):
+        answer_lines = []
+        for line in template.strip().split('\n'):
+            line = line.strip()
+            if line.startswith('<'):
+                continue # e.g., "<...provide up to 3 items>"
+            if line.startswith('-') and '<' in line:
+                answer_lines.append('- The app behaves as expected.')
+                continue
+            if ': <' not in line:
+                answer_lines.append(line)
+                continue
+            label = line.split(': <')[0]
+            answer_lines.append(f'{label}: {self.get_answer(label)}')
+        return '\n'.join(answer_lines)
+
+    def get_answer(self, label):
+        if label.endswith('next task'):
+            self.task_count += 1
+            return f'Explore feature {self.task_count} of the app'
+        if label.startswith('End condition'):
+            return 'The task is known to be completed when a new page of the app is shown'
+        if label.startswith('Rough plan'):
+            return 'I plan to try the widgets on the current page'
+        if label.startswith('Task done successfully?'):
+            return self.rng.choice(['yes', 'no'])
+        if label.startswith('Need a workaround plan?'):
+            return 'no'
+        if label.startswith('Workaround plan'):
+            return 'none'
+        if label.startswith('Critique'):
+            return 'okay'
+        if label == 'Text':
+            return 'Hello'
+        return 'The current screen looks as expected.'
+
+
+def main(result_dir, output_dir, profile_id, num_steps, seed, latency=0, app_id=None):
+    states = load_recorded_states(result_dir)
+    if len(states) == 0:
+        raise FileNotFoundError(f'No recorded states in {result_dir}')
+    app = SimulatedApp.from_result_dir(result_dir, states)
+    device = SimulatedDevice(states, load_event_records(result_dir), app, seed=seed)
+    print(f'Simulating {app.apk.get_app_name()} ({app.package_name}): {len(device.state_dicts) - 1} screens, {len(device.transitions)} recorded transitions')
+
+    fake_llm = FakeLLM(seed=seed, latency=latency)
+    set_llm_backend(fake_llm)
+
+    persona = OrderedDict()
+    persona.update(load_profile(profile_id))
+    persona.update({
+        'ultimate_goal': 'visit as many pages as possible while trying their core functionalities',
+        'initial_knowledge': initial_knowledge_map(app_id, persona['name'], app.apk.get_app_name()),
+    })
+
+    clock = SimulatedClock()
+    agent = TaskBasedAgent(output_dir, app=app, persona=persona)
+    pipeline = BackgroundPipeline()
+    device_manager = DeviceManager(device, app, output_dir=output_dir, pipeline=pipeline, navigation_index=agent.memory.navigation,
+                                   image_store=ImageStore(os.path.join(output_dir, IMAGE_DIR)), event_listener=SimulatedEventListener())
+    device_manager.settle_detector = UISettleDetector(device, clock=clock.time, sleep=clock.sleep)
+    recovery_engine = RecoveryEngine(device_manager, clock=clock.time, sleep=clock.sleep)
+    agent.set_current_gui_state(device_manager.current_state)
+
+    start_time = time.perf_counter()
+    run_agent_loop(agent, device_manager, recovery_engine, max_steps=num_steps)
+    device_manager.close()
+    elapsed_time = time.perf_counter() - start_time
+
+    print(f'{agent.step_count} steps in {elapsed_time:.2f}s: {agent.step_count / elapsed_time:.2f} steps/s')
+    print(f'Fake LLM: {fake_llm.call_count} calls ({fake_llm.function_call_count} function calls, {fake_llm.task_count} tasks)')
+    print(f'Simulated device: {device.event_count} events, {device.unknown_event_count} without recorded transition, {len(set(device.trace))} distinct screens')
+    print(f'Trace digest: {device.get_trace_digest()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the agent on a simulated device replaying a previous run, with a fake LLM (steps/second benchmark)')
+    parser.add_argument('--result_dir', type=str, required=True, help='output directory of a previous run (containing `states/` and `events/`)')
+    parser.add_argument('--output_dir', type=str, help='path to the output directory (a temporary directory removed after the run if not given)', default=None)
+    parser.add_argument('--app', type=str, help='name of the app (for its initial knowledge)', default=None)
+    parser.add_argument('--profile_id', type=str, help='name of the persona profile to be used', default='jade')
+    parser.add_argument('--num_steps', type=int, help='number of agent steps', default=100)
+    parser.add_argument('--seed', type=int, help='seed of the simulated device and the fake LLM', default=0)
+    parser.add_argument('--latency', type=float, help='emulated LLM response time per call (seconds)', default=0)
+    parser.add_argument('--compress_artifacts', action='store_true', help='whether to gzip the prompts, event records and memory snapshots or not', default=False)
+    args = parser.parse_args()
+
+    artifact_writer.compress = args.compress_artifacts
+    output_dir = args.output_dir if args.output_dir is not None else tempfile.mkdtemp(prefix='droidagent_simulator_')
+    try:
+        main(args.result_dir, output_dir, args.profile_id, args.num_steps, args.seed, latency=args.latency, app_id=args.app)
+    finally:
+        if args.output_dir is None:
+            shutil.rmtree(output_dir, ignore_errors=True)
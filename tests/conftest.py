@@ -0,0 +1,23 @@
+import os
+import sys
+
+# the OpenAI client is created when droidagent is imported, but never called by the tests
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+
+# the scripts import each other as top-level modules (e.g., `from device_manager import ...`)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+
+def make_view(temp_id, parent, children, view_class='android.widget.TextView', **properties):
+    view = {
+        'temp_id': temp_id, 'parent': parent, 'children': children, 'class': view_class, 'package': 'com.example',
+        'bounds': [[0, temp_id * 100], [1080, temp_id * 100 + 100]], 'text': None, 'resource_id': None, 'content_description': None,
+        'visible': True, 'enabled': True, 'focused': False, 'selected': False, 'checked': False, 'checkable': False, 'is_password': False,
+        'clickable': False, 'long_clickable': False, 'scrollable': False, 'editable': False, 'view_str': f'view{temp_id}',
+    }
+    view.update(properties)
+    return view
+
+
+def make_state_dict(views, state_str='state', activity='com.example/.MainActivity', tag='2024-01-01_120000'):
+    return {'tag': tag, 'state_str': state_str, 'foreground_activity': activity, 'activity_stack': [activity], 'views': views, 'width': 1080, 'height': 1920}
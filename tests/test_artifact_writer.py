@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from droidagent.artifact_writer import ArtifactWriter
+
+
+def read_text(file_path):
+    with open(file_path, 'r') as f:
+        return f.read()
+
+
+def test_unexpected_error_does_not_stop_the_writer(tmp_path):
+    writer = ArtifactWriter()
+    writer.write(str(tmp_path / 'broken.json'), 123) # not str nor bytes: TypeError on the writer thread
+    writer.write(str(tmp_path / 'event.json'), '{}')
+
+    with pytest.raises(TypeError):
+        writer.flush()
+    assert writer.is_running()
+    assert read_text(tmp_path / 'event.json') == '{}'
+
+    writer.write(str(tmp_path / 'event.json'), '{"tag": 1}')
+    writer.close()
+    assert read_text(tmp_path / 'event.json') == '{"tag": 1}'
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_dead_thread_is_restarted(tmp_path):
+    writer = ArtifactWriter(max_queue_size=2)
+    writer.write(str(tmp_path / 'first.json'), '{}')
+    writer.flush()
+
+    # the thread dies with the next batch (e.g., killed by an error outside the writes)
+    write_batch = writer.write_batch
+    def exit_thread(batch):
+        writer.write_batch = write_batch
+        raise SystemExit
+    writer.write_batch = exit_thread
+    writer.write(str(tmp_path / 'lost.json'), '{}')
+    writer.thread.join(timeout=5)
+    assert not writer.is_running()
+
+    # more writes than the queue can hold: they would block forever without a thread
+    writing = threading.Thread(target=lambda: [writer.write(str(tmp_path / f'event_{i}.json'), str(i)) for i in range(5)], daemon=True)
+    writing.start()
+    writing.join(timeout=5)
+    assert not writing.is_alive()
+
+    writer.close()
+    assert [read_text(tmp_path / f'event_{i}.json') for i in range(5)] == [str(i) for i in range(5)]
@@ -0,0 +1,145 @@
+from conftest import make_view
+
+from device_manager import UISettleDetector, parse_ui_probe, UI_PROBE_COMMAND, SETTLE_POLL_INTERVAL, SETTLE_STABLE_WINDOW, SETTLE_TIMEOUT
+from simulator import render_activity_top, render_window_focus
+
+
+ACTIVITY = 'com.example/.MainActivity'
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeDevice:
+    """
+    Device whose screen is a function of the virtual time: `screen(now)` -> list of view dicts of the activity window,
+    `dialog(now)` -> list of view dicts of a dialog window on top of it (None if there is no dialog)
+    """
+    def __init__(self, clock, screen, dialog=lambda now: None):
+        self.clock = clock
+        self.screen = screen
+        self.dialog = dialog
+        self.adb = self
+        self.queries = []
+
+    def shell(self, command):
+        self.queries.append(command)
+        focused_window_id = 1 if self.dialog(self.clock.now) is None else 2
+        return render_activity_top(ACTIVITY, self.screen(self.clock.now)) + '\n' + render_window_focus(ACTIVITY, focused_window_id)
+
+    def get_top_activity_name(self):
+        self.queries.append('get_top_activity_name')
+        return ACTIVITY
+
+    def get_views(self):
+        # the accessibility service reads the focused window
+        self.queries.append('get_views')
+        dialog_views = self.dialog(self.clock.now)
+        return dialog_views if dialog_views is not None else self.screen(self.clock.now)
+
+
+def make_screen(label, label_bounds=None):
+    views = [make_view(0, -1, [1, 2], 'android.widget.FrameLayout'), make_view(1, 0, [], text=label), make_view(2, 0, [], 'android.widget.Button', text='OK', clickable=True)]
+    if label_bounds is not None:
+        views[1]['bounds'] = label_bounds
+    return views
+
+
+def make_detector(screen, dialog=lambda now: None):
+    clock = VirtualClock()
+    device = FakeDevice(clock, screen, dialog)
+    return UISettleDetector(device, clock=clock.time, sleep=clock.sleep), device
+
+
+def make_loading_screen(now):
+    if now < 0.3:
+        return [make_view(0, -1, [1], 'android.widget.FrameLayout'), make_view(1, 0, [], 'android.widget.ProgressBar')]
+    return make_screen('Decks')
+
+
+def test_parse_ui_probe():
+    probe_output = '\n'.join([
+        'TASK com.example id=12 userId=0',
+        '  ACTIVITY com.example/.SettingsActivity 1a2b3c pid=4321',
+        '    View Hierarchy:',
+        '      DecorView@5d6e7f[SettingsActivity]',
+        '        android.widget.LinearLayout{8a9b0c V.E...... ........ 0,0-1080,1920}',
+        '          android.widget.TextView{1d2e3f V.ED..... ........ 0,0-1080,100 #7f0a0012 app:id/title}',
+        '    Looper (main, tid 1) {4f5a6b}',
+        '      (Total messages: 3, polling=false, quitting=false)',
+    ])
+    foreground_activity, fingerprint = parse_ui_probe(probe_output)
+    assert foreground_activity == 'com.example/.SettingsActivity'
+    # message queue statistics are not part of the view hierarchy
+    assert parse_ui_probe(probe_output.replace('Total messages: 3', 'Total messages: 0')) == (foreground_activity, fingerprint)
+    assert parse_ui_probe(probe_output.replace('0,0-1080,100', '0,0-1080,200'))[1] != fingerprint
+    # a dialog is another window of the activity
+    assert parse_ui_probe(probe_output + '\n' + render_window_focus('com.example/.SettingsActivity', 2)) != parse_ui_probe(probe_output + '\n' + render_window_focus('com.example/.SettingsActivity', 1))
+
+
+def test_settles_once_the_screen_stops_changing():
+    detector, device = make_detector(make_loading_screen)
+    wait_time = detector.wait()
+
+    # the change is seen by the poll at 0.4s, then the screen has to stay the same for the stable window, and the view list for one more poll
+    assert abs(wait_time - (3 * SETTLE_POLL_INTERVAL + SETTLE_STABLE_WINDOW)) < 1e-6
+    assert detector.timeout_count == 0
+    settled_activity, settled_views = detector.take_settled_ui()
+    assert settled_activity == ACTIVITY and [view.get('text') for view in settled_views] == [None, 'Decks', 'OK']
+    assert detector.take_settled_ui() == (None, None)
+    # a single round trip per poll
+    assert device.queries == [UI_PROBE_COMMAND] * (detector.poll_count - 2) + ['get_views'] * 2
+
+
+def test_ticking_clock_does_not_prevent_settling():
+    detector, _ = make_detector(lambda now: make_screen(f'12:{int(now * 10) % 60:02d}'))
+    wait_time = detector.wait()
+
+    assert wait_time < SETTLE_STABLE_WINDOW + 3 * SETTLE_POLL_INTERVAL
+    assert detector.timeout_count == 0
+
+
+def test_gives_up_at_timeout():
+    # e.g., an endless animation
+    detector, _ = make_detector(lambda now: make_screen('Syncing', label_bounds=[[0, 0], [int(now * 100), 100]]))
+    wait_time = detector.wait()
+
+    assert SETTLE_TIMEOUT <= wait_time < SETTLE_TIMEOUT + SETTLE_POLL_INTERVAL + 1e-6
+    assert detector.timeout_count == 1
+    assert detector.take_settled_ui() == (None, None)
+
+
+def test_waits_for_dialog_on_unchanged_activity():
+    # the dialog appears at 0.3s and shows a spinner until its message at 0.9s: the view hierarchy of the activity stays the same
+    def make_dialog(now):
+        if now < 0.3:
+            return None
+        if now < 0.9:
+            return [make_view(0, -1, [1], 'android.widget.FrameLayout'), make_view(1, 0, [], 'android.widget.ProgressBar')]
+        return make_screen('Deck created')
+
+    detector, _ = make_detector(lambda now: make_screen('Decks'), make_dialog)
+    wait_time = detector.wait()
+
+    assert wait_time >= 0.9
+    assert detector.timeout_count == 0
+    _, settled_views = detector.take_settled_ui()
+    assert 'Deck created' in [view.get('text') for view in settled_views]
+
+
+def test_initial_probe_saves_first_poll():
+    detector, _ = make_detector(lambda now: make_screen('Decks'))
+    detector.wait(initial_probe=detector.poll())
+    polls_with_initial_probe = detector.poll_count
+
+    detector, _ = make_detector(lambda now: make_screen('Decks'))
+    detector.wait()
+    assert polls_with_initial_probe == detector.poll_count
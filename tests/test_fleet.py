@@ -0,0 +1,67 @@
+import json
+import time
+import threading
+
+from fleet import FleetOrchestrator, build_matrix, MAX_DEVICE_FAILURES, STATUS_SUCCEEDED, STATUS_FAILED
+
+
+class FakeLauncher:
+    """
+    Runs nothing: the return code only depends on the device (`failing_serials` always fail)
+    """
+    def __init__(self, failing_serials=(), run_time=0.05):
+        self.failing_serials = set(failing_serials)
+        self.run_time = run_time
+        self.lock = threading.Lock()
+        self.launches = [] # (run ID, serial, output dir)
+
+    def __call__(self, run, device_serial, output_dir):
+        with self.lock:
+            self.launches.append((run.run_id, device_serial, output_dir))
+        if device_serial in self.failing_serials:
+            return 1
+        time.sleep(self.run_time)
+        return 0
+
+
+def read_progress(result_root):
+    with open(result_root / 'progress.json') as f:
+        return json.load(f)
+
+
+def test_failed_runs_are_retried_on_another_device(tmp_path):
+    runs = build_matrix(['AnkiDroid'], ['jade', 'olivia'], [0, 1, 2])
+    launcher = FakeLauncher(failing_serials=['emulator-5554'])
+    FleetOrchestrator(runs, ['emulator-5554', 'emulator-5556'], launcher, str(tmp_path)).run()
+
+    assert all(run.status == STATUS_SUCCEEDED for run in runs)
+    for run in runs:
+        serials = [attempt['device_serial'] for attempt in run.attempts]
+        assert serials[-1] == 'emulator-5556'
+        assert serials.count('emulator-5554') <= 1 # never retried on the device it failed on
+        assert len(set(attempt['output_dir'] for attempt in run.attempts)) == len(run.attempts) # fresh output directory per attempt
+
+    # the failing device is retired after MAX_DEVICE_FAILURES runs in a row
+    assert sum(1 for _, serial, _ in launcher.launches if serial == 'emulator-5554') == MAX_DEVICE_FAILURES
+
+    progress = read_progress(tmp_path)
+    assert progress['total_runs'] == 6
+    assert progress['status_counts'] == {'pending': 0, 'running': 0, 'succeeded': 6, 'failed': 0}
+    assert progress['devices']['emulator-5554'] == {'active': False, 'current_run': None, 'consecutive_failures': MAX_DEVICE_FAILURES}
+    assert progress['devices']['emulator-5556'] == {'active': True, 'current_run': None, 'consecutive_failures': 0}
+    assert progress['runs']['AnkiDroid-jade-seed0']['status'] == STATUS_SUCCEEDED
+
+
+def test_runs_fail_once_all_devices_are_retired(tmp_path):
+    runs = build_matrix(['AnkiDroid'], ['jade'], [0, 1])
+    launcher = FakeLauncher(failing_serials=['emulator-5554'])
+    FleetOrchestrator(runs, ['emulator-5554'], launcher, str(tmp_path), max_attempts=3).run()
+
+    # the only device is retried (no other device to go to) until it is retired
+    assert len(launcher.launches) == MAX_DEVICE_FAILURES
+    assert all(run.status == STATUS_FAILED for run in runs)
+
+    progress = read_progress(tmp_path)
+    assert progress['status_counts'] == {'pending': 0, 'running': 0, 'succeeded': 0, 'failed': 2}
+    assert not progress['devices']['emulator-5554']['active']
+    assert sum(len(run['attempts']) for run in progress['runs'].values()) == MAX_DEVICE_FAILURES
@@ -0,0 +1,36 @@
+from conftest import make_view, make_state_dict
+from recorded_states import RecordedState
+
+from droidagent.gui_state import GUIState, GUIStateCache
+
+
+def make_state(label):
+    views = [
+        make_view(0, -1, [1, 2], 'android.widget.FrameLayout'),
+        make_view(1, 0, [], text=label, resource_id='com.example:id/label'),
+        make_view(2, 0, [], 'android.widget.Button', text='OK', clickable=True),
+    ]
+    # DroidBot's state_str replaces texts longer than 50 characters with "None": both screens get the same state_str
+    return RecordedState(make_state_dict(views, state_str='same_state_str'))
+
+
+def test_cache_does_not_reuse_screen_with_different_long_text():
+    GUIStateCache.cache.clear()
+    first_label = 'Your deck has been exported to the downloads folder (1)'
+    second_label = 'Your deck has been exported to the downloads folder (2)'
+    assert len(first_label) > 50
+
+    first_gui_state = GUIState().from_droidbot_state(make_state(first_label))
+    second_gui_state = GUIState().from_droidbot_state(make_state(second_label))
+
+    assert [widget.text for widget in first_gui_state.widgets if widget.text is not None and 'deck' in widget.text] == [first_label]
+    assert [widget.text for widget in second_gui_state.widgets if widget.text is not None and 'deck' in widget.text] == [second_label]
+
+
+def test_cache_reuses_identical_screen():
+    GUIStateCache.cache.clear()
+    label = 'Your deck has been exported to the downloads folder (1)'
+    GUIState().from_droidbot_state(make_state(label))
+    hits = GUIStateCache.hits
+    GUIState().from_droidbot_state(make_state(label))
+    assert GUIStateCache.hits == hits + 1
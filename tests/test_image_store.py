@@ -0,0 +1,68 @@
+import os
+import shutil
+
+from droidagent.artifact_writer import artifact_writer
+from droidagent.image_store import ImageStore, ImageStoreReader, KIND_SCREEN, KIND_VIEW, MANIFEST_FILE
+
+
+def write_image(file_path, content):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+
+def read_image(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def get_disk_usage(root_dir):
+    # bytes of the distinct files under root_dir (hard links to the same file are counted once), without the manifest
+    file_sizes = {}
+    for dir_path, _, file_names in os.walk(root_dir):
+        for file_name in file_names:
+            if file_name != MANIFEST_FILE:
+                stat = os.stat(os.path.join(dir_path, file_name))
+                file_sizes[(stat.st_dev, stat.st_ino)] = stat.st_size
+    return sum(file_sizes.values())
+
+
+def test_rewritten_screenshot_gets_its_own_blob(tmp_path):
+    store = ImageStore(str(tmp_path / 'images'))
+    screen = str(tmp_path / 'states' / 'screen_1.png')
+    write_image(screen, b'main page')
+    main_blob = store.add(screen, KIND_SCREEN, tag='1', state_str='a')
+    assert not os.path.exists(screen) # moved into the store
+
+    # DroidBot writes the screenshot of a later state with the same tag to the same path
+    write_image(str(tmp_path / 'new_screen.png'), b'edit page')
+    shutil.copyfile(str(tmp_path / 'new_screen.png'), screen)
+    edit_blob = store.add(screen, KIND_SCREEN, tag='1', state_str='b')
+
+    assert read_image(main_blob) == b'main page' and read_image(edit_blob) == b'edit page'
+    artifact_writer.flush()
+    assert ImageStoreReader(str(tmp_path)).get_screenshots() == [('1', 'a', main_blob), ('1', 'b', edit_blob)]
+
+
+def test_every_image_is_on_disk_once(tmp_path):
+    store = ImageStore(str(tmp_path / 'images'))
+    images = {
+        ('states', 'screen_1.png'): b'main page',
+        ('states', 'screen_2.png'): b'edit page',
+        ('states', 'screen_3.png'): b'main page',
+        ('views', 'view_a.png'): b'add button',
+        ('views', 'view_b.png'): b'add button',
+    }
+    for (dir_name, file_name), content in images.items():
+        file_path = str(tmp_path / dir_name / file_name)
+        write_image(file_path, content)
+        store.add(file_path, KIND_SCREEN if dir_name == 'states' else KIND_VIEW, tag=file_name)
+
+    distinct_bytes = sum(len(content) for content in set(images.values()))
+    assert get_disk_usage(str(tmp_path)) == distinct_bytes
+    assert store.stored_bytes == distinct_bytes and store.saved_bytes == len(b'main page') + len(b'add button')
+    assert store.exact_duplicate_count == 2
+
+    # the crops stay in views/, as links to their blob
+    assert read_image(str(tmp_path / 'views' / 'view_b.png')) == b'add button'
+    assert store.is_stored(str(tmp_path / 'views' / 'view_a.png'))
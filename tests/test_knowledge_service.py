@@ -0,0 +1,25 @@
+from multiprocessing import AuthenticationError
+
+import pytest
+
+from droidagent.knowledge_service import start_knowledge_server, connect_knowledge_service, get_authkey, generate_authkey, SharedKnowledgeClient, AUTHKEY_ENV
+
+
+def test_clients_need_the_key_of_the_server(monkeypatch):
+    authkey = generate_authkey()
+    service, address = start_knowledge_server(authkey=authkey.encode('utf-8'))
+
+    with pytest.raises(AuthenticationError):
+        connect_knowledge_service(address, authkey=generate_authkey().encode('utf-8'))
+
+    monkeypatch.setenv(AUTHKEY_ENV, authkey)
+    client = SharedKnowledgeClient(connect_knowledge_service(f'{address[0]}:{address[1]}'), agent_id='po-a-1')
+    client.publish_entry('1', 'Main page: the "Add" button adds a deck', {'type': 'WIDGET'})
+    assert service.get_stats()['agent_entry_counts'] == {'po-a-1': 1}
+
+
+def test_no_default_key(monkeypatch):
+    monkeypatch.delenv(AUTHKEY_ENV, raising=False)
+    with pytest.raises(ValueError):
+        get_authkey()
+    assert generate_authkey() != generate_authkey()
@@ -0,0 +1,157 @@
+from types import SimpleNamespace
+
+from device_manager import get_activity_depth
+from recovery import RecoveryEngine, FOREGROUND_STABLE_WINDOW, APP_START_TIMEOUT
+
+
+APP_ACTIVITY = 'com.example/.MainActivity'
+LAUNCHER = 'com.android.launcher3/.Launcher'
+FILE_PICKER = 'com.android.documentsui/.picker.PickActivity'
+SETTINGS = 'com.android.settings/.SubSettings'
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ScriptedDevice:
+    """
+    Activity stack (top first) as a function of the virtual time: `react(event, activity_stack)` returns the list of
+    (delay in seconds, activity stack) the event leads to
+    """
+    def __init__(self, clock, activity_stack, react):
+        self.clock = clock
+        self.timeline = [(0, activity_stack)]
+        self.react = react
+        self.sent_events = []
+
+    @property
+    def activity_stack(self):
+        return [activity_stack for start_time, activity_stack in self.timeline if start_time <= self.clock.now][-1]
+
+    def send_event(self, event):
+        self.sent_events.append(event)
+        self.timeline.extend((self.clock.now + delay, activity_stack) for delay, activity_stack in self.react(event, self.activity_stack))
+        self.timeline.sort(key=lambda change: change[0])
+
+
+class FakeDeviceManager:
+    def __init__(self, device):
+        self.device = device
+        self.app = SimpleNamespace(package_name='com.example', get_package_name=lambda: 'com.example',
+                                   get_start_intent=lambda: f'am start {APP_ACTIVITY}', get_stop_intent=lambda: 'am force-stop com.example')
+        self.pipeline = SimpleNamespace(submit=lambda *args: None)
+        self.fetch_device_state()
+
+    def fetch_device_state(self):
+        activity_stack = list(self.device.activity_stack)
+        self.current_state = SimpleNamespace(foreground_activity=activity_stack[0], activity_stack=activity_stack, state_str='+'.join(activity_stack))
+
+    def probe_foreground(self):
+        return self.device.activity_stack[0]
+
+    def get_app_activity_depth(self, probe=False):
+        activity_stack = self.device.activity_stack if probe else self.current_state.activity_stack
+        return get_activity_depth(activity_stack, self.app.package_name)
+
+    def record_event(self, *args):
+        pass
+
+
+def make_agent():
+    actions = []
+    return SimpleNamespace(memory=SimpleNamespace(append_to_working_memory=lambda action, action_type: actions.append(action)), clear_temporary_message=lambda: None, actions=actions)
+
+
+def is_start_intent(event):
+    return event.event_type == 'intent' and event.intent.startswith('am start')
+
+
+def react(back_works_on=(), start_delay=0.3):
+    """
+    - BACK leaves the pages of the packages in `back_works_on` (the other apps ignore it)
+    - the start intent shows the app after `start_delay` seconds, the stop intent removes it from the stack
+    """
+    def react_to_event(event, activity_stack):
+        if event.event_type == 'key' and activity_stack[0].split('/')[0] in back_works_on:
+            return [(0.2, activity_stack[1:])]
+        if is_start_intent(event):
+            return [(start_delay, [APP_ACTIVITY] + [activity for activity in activity_stack if activity != APP_ACTIVITY])]
+        if event.event_type == 'intent':
+            return [(0.2, [activity for activity in activity_stack if activity != APP_ACTIVITY] or [LAUNCHER])]
+        return []
+    return react_to_event
+
+
+def make_engine(activity_stack, react_to_event, time_budget=20):
+    clock = VirtualClock()
+    device = ScriptedDevice(clock, activity_stack, react_to_event)
+    device_manager = FakeDeviceManager(device)
+    return RecoveryEngine(device_manager, time_budget=time_budget, max_steps_outside=0, clock=clock.time, sleep=clock.sleep), device, clock
+
+
+def move_to(engine, device, activity_stack):
+    device.timeline.append((engine.clock(), activity_stack))
+    engine.device_manager.fetch_device_state()
+
+
+def test_strategy_order():
+    engine, _, _ = make_engine([FILE_PICKER, APP_ACTIVITY], react())
+    assert engine.get_strategy_order('com.android.documentsui', app_closed=False) == ['back', 'reopen', 'back_reopen', 'restart']
+    # nothing of the app to go back to
+    assert engine.get_strategy_order('com.android.launcher3', app_closed=True) == ['reopen', 'restart']
+
+
+def test_back_recovers_from_foreign_page():
+    engine, device, _ = make_engine([FILE_PICKER, APP_ACTIVITY], react(back_works_on=['com.android.documentsui']))
+    assert engine.recover(make_agent())
+    assert [event.event_type for event in device.sent_events] == ['key']
+    assert engine.preferred_strategies == {'com.android.documentsui': 'back'}
+
+
+def test_successful_strategy_is_memoized_per_foreign_package():
+    engine, device, _ = make_engine([FILE_PICKER, APP_ACTIVITY], react(back_works_on=['com.android.documentsui']))
+    assert engine.recover(make_agent())
+
+    # BACK does not leave the settings: the app is reopened
+    move_to(engine, device, [SETTINGS, APP_ACTIVITY])
+    device.sent_events = []
+    assert engine.recover(make_agent())
+    assert is_start_intent(device.sent_events[-1])
+    assert engine.preferred_strategies == {'com.android.documentsui': 'back', 'com.android.settings': 'reopen'}
+
+    # each foreign package starts with the strategy that last worked for it
+    assert engine.get_strategy_order('com.android.settings', app_closed=False)[0] == 'reopen'
+    assert engine.get_strategy_order('com.android.documentsui', app_closed=False)[0] == 'back'
+    move_to(engine, device, [SETTINGS, APP_ACTIVITY])
+    device.sent_events = []
+    assert engine.recover(make_agent())
+    assert len(device.sent_events) == 1 and is_start_intent(device.sent_events[0])
+
+
+def test_slow_app_start_is_not_a_failure():
+    # a cold start takes longer than the stable window of the top activity
+    start_delay = 3 * FOREGROUND_STABLE_WINDOW
+    engine, device, _ = make_engine([LAUNCHER], react(start_delay=start_delay))
+    agent = make_agent()
+    assert engine.recover(agent)
+    assert len(device.sent_events) == 1 and is_start_intent(device.sent_events[0])
+    assert engine.strategy_stats['reopen'].successes == 1 and engine.strategy_stats['restart'].attempts == 0
+    assert [str(action) for action in agent.actions] == ['Open the app again because the previous action led to closing the app']
+
+
+def test_episode_stops_at_time_budget():
+    # the app cannot be started (e.g., it crashes on start)
+    engine, device, clock = make_engine([LAUNCHER], lambda event, activity_stack: [], time_budget=20)
+    assert not engine.recover(make_agent())
+    assert engine.failed_episode_count == 1
+    # the strategy running when the budget is exhausted is not interrupted
+    assert 20 <= clock.now <= 20 + APP_START_TIMEOUT + 1
+    assert engine.preferred_strategies == {}
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+from conftest import make_view, make_state_dict
+from recorded_states import RecordedState
+
+from droidagent.agent import Agent
+from droidagent.gui_state import GUIState
+from droidagent.state_diff import compute_state_diff, WidgetMatcher, TEXT_CHANGED, APPEARED, DISAPPEARED
+
+
+def make_droidbot_state(status_text, input_text='', extra_label=None):
+    views = [
+        make_view(0, -1, [1, 2, 3], 'android.widget.FrameLayout'),
+        make_view(1, 0, [], text=status_text, resource_id='com.example:id/status'),
+        make_view(2, 0, [], 'android.widget.EditText', text=input_text, resource_id='com.example:id/title', clickable=True, editable=True),
+        make_view(3, 0, [], 'android.widget.Button', text='Save', resource_id='com.example:id/save', clickable=True),
+    ]
+    if extra_label is not None:
+        views[0]['children'].append(4)
+        views.append(make_view(4, 0, [], text=extra_label))
+    return RecordedState(make_state_dict(views, state_str=f'{status_text}/{input_text}/{extra_label}'))
+
+
+def make_gui_state(status_text, input_text='', extra_label=None):
+    return GUIState().from_droidbot_state(make_droidbot_state(status_text, input_text, extra_label), use_cache=False)
+
+
+def make_rows_gui_state(root_class, button_first):
+    # two identical rows (a container with a button) and a loose button with the same text as the row buttons
+    views = [
+        make_view(0, -1, [], root_class, scrollable=True),
+        make_view(1, 0, [2], 'android.widget.LinearLayout', resource_id='com.example:id/row', long_clickable=True),
+        make_view(2, 1, [], 'android.widget.Button', text='Delete', clickable=True),
+        make_view(3, 0, [4], 'android.widget.LinearLayout', resource_id='com.example:id/row', long_clickable=True),
+        make_view(4, 3, [], 'android.widget.Button', text='Delete', clickable=True),
+        make_view(5, 0, [], 'android.widget.Button', text='Delete', clickable=True),
+    ]
+    views[0]['children'] = [5, 1, 3] if button_first else [1, 3, 5]
+    return GUIState().from_droidbot_state(RecordedState(make_state_dict(views, state_str=f'{root_class}/{button_first}')), use_cache=False)
+
+
+def capture_temporary_message(old_gui_state, droidbot_state):
+    agent = SimpleNamespace(current_gui_state=old_gui_state, memory=SimpleNamespace(temp_messages=[]))
+    Agent.capture_temporary_message(agent, droidbot_state)
+    return [widget.text for widget in agent.memory.temp_messages]
+
+
+def test_in_place_text_change_is_a_text_edit():
+    state_diff = compute_state_diff(make_gui_state('Ready'), make_gui_state('Saved successfully'))
+    assert [(edit.edit_type, edit.old_widget.text, edit.new_widget.text) for edit in state_diff.edits] == [(TEXT_CHANGED, 'Ready', 'Saved successfully')]
+
+    changed_widgets, appeared_widgets, disappeared_widgets = make_gui_state('Ready').diff_widgets(make_gui_state('Saved successfully'))
+    assert [change for _, change in changed_widgets] == [{'old_text': 'Ready', 'new_text': 'Saved successfully'}]
+    assert appeared_widgets == [] and disappeared_widgets == []
+
+
+def test_appeared_widget():
+    state_diff = compute_state_diff(make_gui_state('Ready'), make_gui_state('Ready', extra_label='Deck created'))
+    assert [(edit.edit_type, edit.new_widget.text) for edit in state_diff.edits] == [(APPEARED, 'Deck created')]
+
+
+def test_captures_message_replacing_label_text():
+    assert capture_temporary_message(make_gui_state('Ready'), make_droidbot_state('Saved successfully')) == ['Saved successfully']
+
+
+def test_captures_appeared_message():
+    assert capture_temporary_message(make_gui_state('Ready'), make_droidbot_state('Ready', extra_label='Deck created')) == ['Deck created']
+
+
+def test_does_not_capture_typed_text():
+    assert capture_temporary_message(make_gui_state('Ready'), make_droidbot_state('Ready', input_text='My deck')) == []
+
+
+def test_global_matching_keeps_partners_consistent():
+    # the containers differ, so the rows and buttons are only paired by the global pass, where a row is paired after a button inside it
+    old_gui_state = make_rows_gui_state('android.widget.FrameLayout', button_first=False)
+    new_gui_state = make_rows_gui_state('android.widget.ScrollView', button_first=True)
+    old_partners, new_partners = WidgetMatcher(old_gui_state, new_gui_state).match()
+    for i, j in enumerate(old_partners):
+        assert j is None or new_partners[j] == i
+    for j, i in enumerate(new_partners):
+        assert i is None or old_partners[i] == j
+
+    state_diff = compute_state_diff(old_gui_state, new_gui_state)
+    removed_widget_ids = {id(edit.old_widget) for edit in state_diff.edits if edit.edit_type == DISAPPEARED}
+    matched_old_indices = {i for i in state_diff.new_partners if i is not None}
+    for i, old_widget in enumerate(old_gui_state.widgets):
+        assert i in matched_old_indices or id(old_widget) in removed_widget_ids